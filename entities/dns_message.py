@@ -1,21 +1,29 @@
-import binascii
+import struct
 from dataclasses import dataclass
-from ipaddress import IPv4Address, IPv6Address
+from typing import Optional
 
+from entities.edns import Edns, OPT
 from entities.flags import Flags
 from entities.query import Query
 from entities.question import Question
 
+HEADER = struct.Struct('!HHHHHH')
+TCP_LENGTH = struct.Struct('!H')
+
 
 @dataclass
 class DnsMessage:
+    __slots__ = ('is_tcp', 'transaction_id', 'flags', 'questions', 'answers',
+                 'authorities', 'add_records', 'edns')
+
     def __init__(self, is_tcp: bool,
                  transaction_id: int,
                  flags: Flags,
                  questions: list[Question],
                  answers: list[Query],
                  authorities: list[Query],
-                 add_records: list[Query]):
+                 add_records: list[Query],
+                 edns: Optional[Edns] = None):
         self.is_tcp = is_tcp
         self.transaction_id = transaction_id
         self.flags = flags
@@ -23,123 +31,87 @@ class DnsMessage:
         self.answers = answers
         self.authorities = authorities
         self.add_records = add_records
+        self.edns = edns
 
-    def __str__(self):
-        result = ""
-        result += "{:04x}".format(self.transaction_id)
-        result += str(self.flags)
-        result += "{:04x}".format(len(self.questions))
-        result += "{:04x}".format(len(self.answers))
-        result += "{:04x}".format(len(self.authorities))
-        result += "{:04x}".format(len(self.add_records))
+    def to_bytes(self, ttl_offsets: Optional[list[int]] = None,
+                 compress: bool = False) -> bytes:
+        """Encodes the message, with a TCP length prefix if is_tcp.
+
+        ttl_offsets, if given, receives the offset of every record's TTL
+        from the start of the DNS message. With compress, repeated name
+        suffixes are written as compression pointers.
+        """
+        size = HEADER.size
+        for question in self.questions:
+            size += question.wire_size()
+        for query in self.get_all_queries():
+            size += query.wire_size()
+        opt = self.edns.to_query() if self.edns is not None else None
+        if opt is not None:
+            size += opt.wire_size()
+        prefix = TCP_LENGTH.size if self.is_tcp else 0
+        buffer = bytearray(prefix + size)
+        message = memoryview(buffer)[prefix:]
+        names = {} if compress else None
+        HEADER.pack_into(message, 0,
+                         self.transaction_id,
+                         self.flags.to_int(),
+                         len(self.questions),
+                         len(self.answers),
+                         len(self.authorities),
+                         len(self.add_records) + (1 if opt else 0))
+        offset = HEADER.size
         for question in self.questions:
-            result += str(question)
-        for query in self.answers + self.authorities + self.add_records:
-            result += str(query)
+            offset = question.pack_into(message, offset, names)
+        for query in self.get_all_queries():
+            offset = query.pack_into(message, offset, ttl_offsets, names)
+        if opt is not None:
+            offset = opt.pack_into(message, offset)
+        message.release()
         if self.is_tcp:
-            result = "{:04x}".format(len(result) // 2) + result
-        return result
+            TCP_LENGTH.pack_into(buffer, 0, offset)
+        return bytes(buffer[:prefix + offset])
 
     @staticmethod
-    def parse(message: str, is_tcp: bool):
+    def from_bytes(data: bytes, is_tcp: bool):
+        buffer = memoryview(data)
         if is_tcp:
-            message = message[4:]
-        message_transaction_id = int(message[0:4], 16)
-        message_flags = Flags.parse(message[4:8])
-        qdcount = int(message[8:12], 16)
-        ancount = int(message[12:16], 16)
-        nscount = int(message[16:20], 16)
-        arcount = int(message[20:24], 16)
+            length, = TCP_LENGTH.unpack_from(buffer, 0)
+            buffer = buffer[TCP_LENGTH.size:]
+            if length != len(buffer):
+                raise ValueError(f'Length prefix {length} does not match '
+                                 f'message length {len(buffer)}')
+        (message_transaction_id, flags,
+         qdcount, ancount, nscount, arcount) = HEADER.unpack_from(buffer, 0)
+        message_flags = Flags.from_int(flags)
         questions, answers, authorities, add_records = [], [], [], []
-        start = 24
+        edns = None
+        names: dict[int, str] = {}
+        start = HEADER.size
         for _ in range(qdcount):
-            name_end = find_name_end_index(start, message)
-            question = Question(
-                get_joined_by_dots_name(message[start: name_end], message),
-                int(message[name_end: name_end + 4], 16),
-                int(message[name_end + 4: name_end + 8], 16))
+            question, start = Question.unpack_from(buffer, start, names)
             questions.append(question)
-            start = name_end + 8
-        for i in range(sum([ancount, nscount, arcount])):
-            if start >= len(message):
+        for i in range(ancount + nscount + arcount):
+            if start >= len(buffer):
                 break
-            end = find_name_end_index(start, message)
-            name = get_joined_by_dots_name(message[start: end], message)
-            tp = int(message[end: end + 4], 16)
-            cls = int(message[end + 4: end + 8], 16)
-            ttl = int(message[end + 8: end + 16], 16)
-            length = int(message[end + 16: end + 20],
-                         16)
-            address = message[end + 20:
-                              end + 20 + length * 2]
-            start = end + 20 + length * 2
-            if tp == 1:
-                decoded_address = str(IPv4Address(int(address, 16)))
-            elif tp in {2, 12}:
-                decoded_address = get_joined_by_dots_name(address, message)
-            elif tp == 28:
-                decoded_address = str(IPv6Address(int(address, 16)))
-            else:
-                continue
-            query = Query(name, tp, cls, ttl, decoded_address)
-            if 0 <= i < ancount:
+            query, start = Query.unpack_from(buffer, start, names)
+            if i < ancount:
                 answers.append(query)
-            if ancount <= i < ancount + nscount:
+            elif i < ancount + nscount:
                 authorities.append(query)
+            elif query.tp == OPT:
+                edns = Edns.from_query(query)
             else:
                 add_records.append(query)
-        dns_message = DnsMessage(is_tcp, message_transaction_id, message_flags,
-                                 questions, answers, authorities, add_records)
-        return dns_message
-
-    def get_all_queries(self):
-        return self.answers + self.authorities + self.add_records
-
+        return DnsMessage(is_tcp, message_transaction_id, message_flags,
+                          questions, answers, authorities, add_records, edns)
 
-def get_joined_by_dots_name(name: str, message: str):
-    return ".".join(
-        map(lambda p: binascii.unhexlify(p).decode('iso8859-1'),
-            get_name_partition(decompress_message(name, message), 0, [])))
-
-
-def get_name_partition(name, start, parts):
-    len_octet = name[start: start + 2]
-    if not len_octet:
-        return parts
-    part_end = start + 2 + int(len_octet, 16) * 2
-    parts.append(name[start + 2: part_end])
-    if part_end > len(name) or name[part_end: part_end + 2] == "00":
-        return parts
-    else:
-        return get_name_partition(name, part_end, parts)
-
-
-def decompress_message(msg_substring, msg):
-    if len(msg_substring) >= 4 and msg_substring[-4] == "c":
-        msg_substring = (msg_substring[:-4] +
-                         decompress_four_bytes(msg_substring[-4:], msg))
-    return msg_substring
-
-
-def decompress_four_bytes(four_bytes: str, message: str) -> str:
-    if len(four_bytes) != 4:
-        return four_bytes
-    start = int(four_bytes[-3:], 16) * 2
-    end = find_name_end_index(start, message)
-    result = message[start: end]
-    if result[-4] == "c":
-        result = (message[start: end - 4] +
-                  decompress_four_bytes(message[end - 4: end], message))
-    return result
+    def __str__(self):
+        return self.to_bytes().hex()
 
+    @staticmethod
+    def parse(message: str, is_tcp: bool):
+        return DnsMessage.from_bytes(bytes.fromhex(message), is_tcp)
 
-def find_name_end_index(start, message):
-    end = start
-    for i in range(0, (len(message) - start) // 2):
-        if message[start + i * 2: start + i * 2 + 2] == "00":
-            end = start + i * 2 + 2
-            break
-        if message[start + i * 2] == "c":
-            end = start + i * 2 + 4
-            break
-    return end
+    def get_all_queries(self):
+        return self.answers + self.authorities + self.add_records
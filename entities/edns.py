@@ -0,0 +1,44 @@
+from entities.query import Query
+
+OPT = 41
+MIN_PAYLOAD_SIZE = 512
+
+
+class Edns:
+    """EDNS(0) parameters carried by the OPT pseudo-record (RFC 6891)."""
+
+    __slots__ = ('payload_size', 'extended_rcode', 'version', 'dnssec_ok',
+                 'options')
+
+    def __init__(self, payload_size: int, extended_rcode: int = 0,
+                 version: int = 0, dnssec_ok: int = 0, options: bytes = b''):
+        self.payload_size = payload_size
+        self.extended_rcode = extended_rcode
+        self.version = version
+        self.dnssec_ok = dnssec_ok
+        self.options = options
+
+    def to_tuple(self) -> tuple:
+        return (self.payload_size, self.extended_rcode, self.version,
+                self.dnssec_ok, self.options)
+
+    def __eq__(self, other):
+        if not isinstance(other, Edns):
+            return False
+        return self.to_tuple() == other.to_tuple()
+
+    def __repr__(self):
+        return 'Edns({}, {}, {}, {}, {!r})'.format(*self.to_tuple())
+
+    @staticmethod
+    def from_query(query: Query):
+        return Edns(query.cls, query.ttl >> 24, query.ttl >> 16 & 0xff,
+                    query.ttl >> 15 & 1, query.data)
+
+    def to_query(self) -> Query:
+        return Query('', OPT, self.payload_size,
+                     self.extended_rcode << 24 | self.version << 16 |
+                     self.dnssec_ok << 15, self.options)
+
+    def to_bytes(self) -> bytes:
+        return self.to_query().to_bytes()
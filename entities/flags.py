@@ -3,6 +3,8 @@ from dataclasses import dataclass
 
 @dataclass
 class Flags:
+    __slots__ = ('qr', 'opcode', 'aa', 'tc', 'rd', 'ra', 'z', 'reply_code')
+
     def __init__(self, qr: int, opcode: int, aa: int, tc: int,
                  rd: int, ra: int, z: int, reply_code: int):
         self.qr = qr
@@ -14,22 +16,23 @@ class Flags:
         self.z = z
         self.reply_code = reply_code
 
+    @staticmethod
+    def from_int(value: int):
+        return Flags(value >> 15 & 1, value >> 11 & 0xf,
+                     value >> 10 & 1,
+                     value >> 9 & 1,
+                     value >> 8 & 1, value >> 7 & 1,
+                     value >> 6 & 1,
+                     value & 0xf)
+
+    def to_int(self) -> int:
+        return (self.qr << 15 | self.opcode << 11 | self.aa << 10 |
+                self.tc << 9 | self.rd << 8 | self.ra << 7 | self.z << 6 |
+                self.reply_code)
+
     @staticmethod
     def parse(line: str):
-        params = "{:b}".format(int(line, 16)).zfill(16)
-        return Flags(int(params[0:1], 2), int(params[1:5], 2),
-                     int(params[5:6], 2),
-                     int(params[6:7], 2),
-                     int(params[7:8], 2), int(params[8:9], 2),
-                     int(params[9:10], 2),
-                     int(params[12:16], 2))
+        return Flags.from_int(int(line, 16))
 
     def __str__(self):
-        result = str(self.qr)
-        result += bin(self.opcode)[2:].zfill(4)
-        result += str(self.aa) + str(self.tc) + str(self.rd) + str(self.ra)
-        result += str(self.z)
-        result += "00"
-        result += bin(self.reply_code)[2:].zfill(4)
-        result = "{:04x}".format(int(result, 2))
-        return result
+        return "{:04x}".format(self.to_int())
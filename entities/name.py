@@ -0,0 +1,123 @@
+import struct
+from functools import lru_cache
+from typing import Optional
+
+NAME_POINTER = struct.Struct('!H')
+MAX_POINTER = 0x3fff
+MAX_LABEL_LENGTH = 63
+MAX_NAME_LENGTH = 255
+# Real compressors point straight at a suffix; longer pointer chains
+# only make a crafted message expensive to decode.
+MAX_POINTERS = 32
+
+
+@lru_cache(maxsize=4096)
+def encode_name(name: str) -> bytes:
+    result = bytearray()
+    if name:
+        for part in name.split("."):
+            encoded_part = part.encode('iso8859-1')
+            result.append(len(encoded_part))
+            result += encoded_part
+    result.append(0)
+    return bytes(result)
+
+
+@lru_cache(maxsize=4096)
+def split_name(name: str) -> tuple[tuple[str, bytes], ...]:
+    if not name:
+        return ()
+    parts = name.split(".")
+    labels = []
+    for i, part in enumerate(parts):
+        encoded_part = part.encode('iso8859-1')
+        labels.append((".".join(parts[i:]),
+                       bytes((len(encoded_part),)) + encoded_part))
+    return tuple(labels)
+
+
+def pack_name_into(buffer: bytearray, offset: int, name: str,
+                   names: Optional[dict[str, int]] = None) -> int:
+    """Writes name at offset and returns the offset after it.
+
+    If names is given it maps already written suffixes to their offsets
+    in the message: a known suffix is replaced by a compression pointer
+    and the new suffixes are added to it.
+    """
+    if names is None:
+        encoded = encode_name(name)
+        end = offset + len(encoded)
+        buffer[offset:end] = encoded
+        return end
+    for suffix, label in split_name(name):
+        pointer = names.get(suffix)
+        if pointer is not None:
+            NAME_POINTER.pack_into(buffer, offset, 0xc000 | pointer)
+            return offset + NAME_POINTER.size
+        if offset <= MAX_POINTER:
+            names[suffix] = offset
+        end = offset + len(label)
+        buffer[offset:end] = label
+        offset = end
+    buffer[offset] = 0
+    return offset + 1
+
+
+def read_name(buffer, offset: int,
+              names: Optional[dict[int, str]] = None) -> tuple[str, int]:
+    """Decodes the name at offset in one pass and returns it with the
+    offset after it.
+
+    Pointers must point before the name being read, which rules out
+    loops, and at most MAX_POINTERS of them are followed. If names is
+    given it maps pointer targets in the message to the names decoded
+    there, so a suffix many pointers refer to is decoded once.
+    """
+    labels = []
+    targets = []
+    suffix = ''
+    end = None
+    limit = offset
+    pointers = 0
+    size = 1
+    try:
+        while True:
+            length = buffer[offset]
+            if length >= 0xc0:
+                pointer = (length & 0x3f) << 8 | buffer[offset + 1]
+                if end is None:
+                    end = offset + 2
+                pointers += 1
+                if pointer >= limit or pointers > MAX_POINTERS:
+                    raise ValueError(f'Invalid name pointer {pointer} '
+                                     f'at offset {offset}')
+                offset = limit = pointer
+                if names is not None:
+                    if (known := names.get(pointer)) is not None:
+                        suffix = known
+                        size += len(known) + 1
+                        break
+                    targets.append((pointer, len(labels)))
+                continue
+            if length == 0:
+                break
+            if length > MAX_LABEL_LENGTH:
+                raise ValueError(f'Invalid label length {length} '
+                                 f'at offset {offset}')
+            size += length + 1
+            if size > MAX_NAME_LENGTH:
+                raise ValueError(f'Name at offset {offset} is too long')
+            start = offset + 1
+            offset = start + length
+            # A label cut short by the end of the message is caught when
+            # the next length byte is read.
+            labels.append(str(buffer[start:offset], 'iso8859-1'))
+    except IndexError:
+        raise ValueError(f'Name at offset {offset} overruns the message')
+    if size > MAX_NAME_LENGTH:
+        raise ValueError(f'Name at offset {offset} is too long')
+    if suffix:
+        labels.append(suffix)
+    for pointer, index in targets:
+        names[pointer] = ".".join(labels[index:])
+    return ".".join(labels), offset + 1 if end is None else end
@@ -1,59 +1,291 @@
-import binascii
 import socket
+import struct
 from dataclasses import dataclass
+from typing import NamedTuple, Optional, Union
+
+from entities.name import encode_name, pack_name_into, read_name
+
+QUERY_TAIL = struct.Struct('!HHIH')
+RDATA_LENGTH = struct.Struct('!H')
+SOA_TAIL = struct.Struct('!IIIII')
+MX_HEAD = struct.Struct('!H')
+SRV_HEAD = struct.Struct('!HHH')
+A, NS, CNAME, SOA, PTR, MX, TXT, AAAA, SRV, OPT = (
+    1, 2, 5, 6, 12, 15, 16, 28, 33, 41)
+
+
+class Soa(NamedTuple):
+    mname: str
+    rname: str
+    serial: int
+    refresh: int
+    retry: int
+    expire: int
+    minimum: int
+
+    def pack_into(self, buffer: bytearray, offset: int,
+                  names: Optional[dict[str, int]] = None) -> int:
+        offset = pack_name_into(buffer, offset, self.mname, names)
+        offset = pack_name_into(buffer, offset, self.rname, names)
+        SOA_TAIL.pack_into(buffer, offset, *self[2:])
+        return offset + SOA_TAIL.size
+
+    @staticmethod
+    def unpack_from(buffer, offset: int,
+                    names: Optional[dict[int, str]] = None
+                    ) -> tuple['Soa', int]:
+        mname, offset = read_name(buffer, offset, names)
+        rname, offset = read_name(buffer, offset, names)
+        return (Soa(mname, rname, *SOA_TAIL.unpack_from(buffer, offset)),
+                offset + SOA_TAIL.size)
+
+
+class Mx(NamedTuple):
+    preference: int
+    exchange: str
+
+    def pack_into(self, buffer: bytearray, offset: int,
+                  names: Optional[dict[str, int]] = None) -> int:
+        MX_HEAD.pack_into(buffer, offset, self.preference)
+        return pack_name_into(buffer, offset + MX_HEAD.size, self.exchange,
+                              names)
+
+    @staticmethod
+    def unpack_from(buffer, offset: int,
+                    names: Optional[dict[int, str]] = None
+                    ) -> tuple['Mx', int]:
+        preference, = MX_HEAD.unpack_from(buffer, offset)
+        exchange, end = read_name(buffer, offset + MX_HEAD.size, names)
+        return Mx(preference, exchange), end
+
+
+class Srv(NamedTuple):
+    priority: int
+    weight: int
+    port: int
+    target: str
+
+    def pack_into(self, buffer: bytearray, offset: int,
+                  names: Optional[dict[str, int]] = None) -> int:
+        SRV_HEAD.pack_into(buffer, offset, self.priority, self.weight,
+                           self.port)
+        # The target must not be compressed (RFC 2782).
+        return pack_name_into(buffer, offset + SRV_HEAD.size, self.target)
+
+    @staticmethod
+    def unpack_from(buffer, offset: int,
+                    names: Optional[dict[int, str]] = None
+                    ) -> tuple['Srv', int]:
+        priority, weight, port = SRV_HEAD.unpack_from(buffer, offset)
+        target, end = read_name(buffer, offset + SRV_HEAD.size, names)
+        return Srv(priority, weight, port, target), end
+
+
+RecordData = Union[str, bytes, tuple, Soa, Mx, Srv]
+
+
+class RdataCodec:
+    """Encodes and decodes the RDATA of one record type.
+
+    The base codec passes RDATA through as opaque bytes (RFC 3597), so
+    records of types without a codec are kept and served unchanged.
+    """
+
+    def encode(self, data) -> bytes:
+        return data
+
+    def pack_into(self, buffer: bytearray, offset: int, data,
+                  names: Optional[dict[str, int]] = None) -> int:
+        rdata = self.encode(data)
+        end = offset + len(rdata)
+        buffer[offset:end] = rdata
+        return end
+
+    def decode(self, buffer, offset: int, end: int,
+               names: Optional[dict[int, str]] = None):
+        return bytes(buffer[offset:end])
+
+
+class AddressCodec(RdataCodec):
+    """Addresses are held packed, as they are on the wire; Query.data
+    turns them into text when read."""
+
+    def __init__(self, family: int, size: int):
+        self.family = family
+        self.size = size
+
+    def decode(self, buffer, offset: int, end: int,
+               names: Optional[dict[int, str]] = None) -> bytes:
+        if end - offset != self.size:
+            raise ValueError(f'Invalid address length {end - offset}')
+        return bytes(buffer[offset:end])
+
+
+class NameCodec(RdataCodec):
+    def encode(self, data: str) -> bytes:
+        return encode_name(data)
+
+    def pack_into(self, buffer: bytearray, offset: int, data: str,
+                  names: Optional[dict[str, int]] = None) -> int:
+        return pack_name_into(buffer, offset, data, names)
+
+    def decode(self, buffer, offset: int, end: int,
+               names: Optional[dict[int, str]] = None) -> str:
+        name, name_end = read_name(buffer, offset, names)
+        if name_end > end:
+            raise ValueError(f'Name at offset {offset} overruns RDATA')
+        return name
+
+
+class StructuredCodec(RdataCodec):
+    """RDATA held as a NamedTuple with pack_into and unpack_from."""
+
+    def __init__(self, data_type):
+        self.data_type = data_type
+
+    def encode(self, data) -> bytes:
+        # Room for two names of at most 255 bytes and the fixed fields.
+        buffer = bytearray(1024)
+        return bytes(buffer[:data.pack_into(buffer, 0)])
+
+    def pack_into(self, buffer: bytearray, offset: int, data,
+                  names: Optional[dict[str, int]] = None) -> int:
+        return data.pack_into(buffer, offset, names)
+
+    def decode(self, buffer, offset: int, end: int,
+               names: Optional[dict[int, str]] = None):
+        data, data_end = self.data_type.unpack_from(buffer, offset, names)
+        if data_end != end:
+            raise ValueError(f'RDATA at offset {offset} has {end - offset} '
+                             f'bytes, expected {data_end - offset}')
+        return data
+
+
+class TextCodec(RdataCodec):
+    """TXT RDATA as a tuple of character strings."""
+
+    def encode(self, data: tuple) -> bytes:
+        return b''.join(bytes((len(string),)) + string for string in data)
+
+    def decode(self, buffer, offset: int, end: int,
+               names: Optional[dict[int, str]] = None) -> tuple:
+        strings = []
+        while offset < end:
+            length = buffer[offset]
+            offset += 1
+            if offset + length > end:
+                raise ValueError(f'TXT string overruns RDATA at {offset}')
+            strings.append(bytes(buffer[offset:offset + length]))
+            offset += length
+        return tuple(strings)
+
+
+OPAQUE = RdataCodec()
+# Names in the RDATA of the RFC 1035 types may be compressed; newer
+# types get no compression (RFC 3597, 4).
+RDATA_CODECS: dict[int, RdataCodec] = {
+    A: AddressCodec(socket.AF_INET, 4),
+    NS: NameCodec(),
+    CNAME: NameCodec(),
+    SOA: StructuredCodec(Soa),
+    PTR: NameCodec(),
+    MX: StructuredCodec(Mx),
+    TXT: TextCodec(),
+    AAAA: AddressCodec(socket.AF_INET6, 16),
+    SRV: StructuredCodec(Srv),
+}
+
+
+ADDRESS_FAMILIES = {A: socket.AF_INET, AAAA: socket.AF_INET6}
+
+
+def get_codec(tp: int) -> RdataCodec:
+    return RDATA_CODECS.get(tp, OPAQUE)
 
 
 @dataclass
 class Query:
+    # A cache holds millions of records: no per-instance __dict__, and
+    # addresses are kept packed in value rather than as text.
+    __slots__ = ('name', 'tp', 'cls', 'ttl', 'value')
+
     def __init__(self, name: str, tp: int,
-                 cls: int, ttl: int, data: str):
+                 cls: int, ttl: int, data: RecordData):
         self.name = name
         self.tp = tp
         self.cls = cls
         self.ttl = ttl
-        self.data = data
+        if tp in ADDRESS_FAMILIES and isinstance(data, str):
+            data = socket.inet_pton(ADDRESS_FAMILIES[tp], data)
+        self.value = data
     
 
+    @property
+    def data(self) -> RecordData:
+        if self.tp in ADDRESS_FAMILIES:
+            return socket.inet_ntop(ADDRESS_FAMILIES[self.tp], self.value)
+        return self.value
+
+    def with_ttl(self, ttl: int) -> 'Query':
+        """A copy of the record with another TTL, sharing its data."""
+        query = Query.__new__(Query)
+        query.name = self.name
+        query.tp = self.tp
+        query.cls = self.cls
+        query.ttl = ttl
+        query.value = self.value
+        return query
+
     def __hash__(self):
-        return hash((self.name, self.tp, self.cls, self.data))
+        return hash((self.name, self.tp, self.cls, self.value))
 
     def __eq__(self, other):
         if not isinstance(other, Query):
             return False
-        return (self.name, self.tp, self.cls, self.data) == (
-            other.name, other.tp, other.cls, other.data
+        return (self.name, self.tp, self.cls, self.value) == (
+            other.name, other.tp, other.cls, other.value
         )
 
+    def rdata(self) -> bytes:
+        return get_codec(self.tp).encode(self.value)
+
+    def wire_size(self) -> int:
+        return (len(encode_name(self.name)) + QUERY_TAIL.size +
+                len(self.rdata()))
+
+    def pack_into(self, buffer: bytearray, offset: int,
+                  ttl_offsets: Optional[list[int]] = None,
+                  names: Optional[dict[str, int]] = None) -> int:
+        offset = pack_name_into(buffer, offset, self.name, names)
+        if ttl_offsets is not None:
+            ttl_offsets.append(offset + 4)
+        QUERY_TAIL.pack_into(buffer, offset, self.tp, self.cls, self.ttl, 0)
+        offset += QUERY_TAIL.size
+        end = get_codec(self.tp).pack_into(buffer, offset, self.value, names)
+        RDATA_LENGTH.pack_into(buffer, offset - RDATA_LENGTH.size,
+                               end - offset)
+        return end
+
+    @staticmethod
+    def unpack_from(buffer, offset: int,
+                    names: Optional[dict[int, str]] = None):
+        name, offset = read_name(buffer, offset, names)
+        tp, cls, ttl, length = QUERY_TAIL.unpack_from(buffer, offset)
+        offset += QUERY_TAIL.size
+        end = offset + length
+        if end > len(buffer):
+            raise ValueError(f'RDATA of {name} overruns the message')
+        data = get_codec(tp).decode(buffer, offset, end, names)
+        return Query(name, tp, cls, ttl, data), end
+
+    def to_bytes(self) -> bytes:
+        buffer = bytearray(self.wire_size())
+        self.pack_into(buffer, 0)
+        return bytes(buffer)
+
     def __str__(self):
-        result = ""
-        for part in self.name.split("."):
-            result += "{:02x}".format(len(part))
-            result += (binascii.hexlify(part.encode('iso8859-1')).
-                       decode('iso8859-1'))
-        result += "00"
-        result += "{:04x}".format(self.tp)
-        result += "{:04x}".format(self.cls)
-        result += "{:08x}".format(self.ttl)
-        data = self.data
-        if self.tp == 1:
-            data = socket.inet_pton(socket.AF_INET, self.data)\
-                .decode('iso8859-1')
-        elif self.tp == 28:
-            data = socket.inet_pton(socket.AF_INET6, self.data)\
-                .decode('iso8859-1')
-        result += "{:04x}".format((len(data) +
-                                   (2 if not is_ip_type(self.tp) else 0)))
-        if is_ip_type(self.tp):
-            result += (binascii.hexlify(data.encode('iso8859-1')).
-                       decode('iso8859-1'))
-        else:
-            for part in data.split('.'):
-                result += "{:02x}".format(len(part))
-                result += (binascii.hexlify(part.encode('iso8859-1')).
-                           decode('iso8859-1'))
-            result += "00"
-        return result
+        return self.to_bytes().hex()
 
 
 def is_ip_type(number: int) -> bool:
-    return number in {1, 28}
+    return number in {A, AAAA}
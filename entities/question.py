@@ -1,9 +1,16 @@
-import binascii
+import struct
 from dataclasses import dataclass
+from typing import Optional
+
+from entities.name import encode_name, pack_name_into, read_name
+
+QUESTION_TAIL = struct.Struct('!HH')
 
 
 @dataclass
 class Question:
+    __slots__ = ('name', 'tp', 'cls')
+
     def __init__(self, name: str, tp: int, cls: int):
         self.name = name
         self.tp = tp
@@ -21,13 +28,26 @@ class Question:
         return (self.name, self.tp, self.cls) == (
             other.name, other.tp, other.cls)
 
+    def wire_size(self) -> int:
+        return len(encode_name(self.name)) + QUESTION_TAIL.size
+
+    def pack_into(self, buffer: bytearray, offset: int,
+                  names: Optional[dict[str, int]] = None) -> int:
+        offset = pack_name_into(buffer, offset, self.name, names)
+        QUESTION_TAIL.pack_into(buffer, offset, self.tp, self.cls)
+        return offset + QUESTION_TAIL.size
+
+    @staticmethod
+    def unpack_from(buffer, offset: int,
+                    names: Optional[dict[int, str]] = None):
+        name, offset = read_name(buffer, offset, names)
+        tp, cls = QUESTION_TAIL.unpack_from(buffer, offset)
+        return Question(name, tp, cls), offset + QUESTION_TAIL.size
+
+    def to_bytes(self) -> bytes:
+        buffer = bytearray(self.wire_size())
+        self.pack_into(buffer, 0)
+        return bytes(buffer)
+
     def __str__(self):
-        result = ""
-        for part in self.name.split("."):
-            result += "{:02x}".format(len(part))
-            result += (binascii.hexlify(part.encode('iso8859-1')).
-                       decode('iso8859-1'))
-        result += "00"
-        result += "{:04x}".format(self.tp)
-        result += "{:04x}".format(self.cls)
-        return result
+        return self.to_bytes().hex()
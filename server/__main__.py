@@ -4,7 +4,9 @@ import sys
 import logging
 
 from server.config import Config
+from server.query_log import setup_logging, stop_logging
 from server.server import Server
+from server.workers import create_server, run_workers
 
 
 def parse_arguments():
@@ -22,6 +24,12 @@ def parse_arguments():
     parser.add_argument('-v', '--verbose',
                         action='store_true',
                         help="run server in verbose mode")
+    parser.add_argument('-w', '--workers',
+                        metavar='count',
+                        type=int,
+                        default=1,
+                        help="run given count of worker processes "
+                             "sharing the port with SO_REUSEPORT")
     return parser.parse_args()
 
 def main():
@@ -33,18 +41,15 @@ def main():
     if args_dict.config:
         config.load(args_dict.config)
     log_level = logging.INFO if not args_dict.verbose else logging.DEBUG
-    if config.log_file:
-        logging.basicConfig(filename=config.log_file,
-                            level=log_level,
-                            format='[%(asctime)s] - %(levelname)s - %(message)s')
-    else:
-        logging.basicConfig(level=log_level,
-                            stream=sys.stdout,
-                            format='[%(asctime)s] - %(levelname)s - %(message)s')
+    setup_logging(config, log_level)
     logging.info(f'Starting server with {args_dict.config}')
+    if args_dict.workers > 1:
+        code = run_workers(config, args_dict.workers)
+        stop_logging()
+        sys.exit(code)
     server = None
     try:
-        server = Server(config)
+        server = create_server(config)
         server.run()
     except KeyboardInterrupt:
         print("Shutting down server...")
@@ -54,6 +59,7 @@ def main():
     finally:
         if server:
             server.shutdown()
+        stop_logging()
         sys.exit(0 if isinstance(server, Server) else 1)
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+import asyncio
+import concurrent.futures
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from server.server import Server, Steps, UpstreamQuery, get_protocol
+from server.tcp_framing import read_message
+
+
+class AsyncServer(Server):
+    def create_thread_resources(self) -> None:
+        # Upstream queries, prefetches and hedging run on the event loop.
+        pass
+
+    def run(self) -> None:
+        self.running = True
+        self.start_metrics_server()
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logging.info('Server stopped by keyboard interrupt')
+        except Exception as e:
+            logging.error(f'Server crashed: {e}')
+        finally:
+            self.running = False
+            self.shutdown()
+
+    async def serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: UdpServerProtocol(self),
+            local_addr=(self.config.hostname, self.config.port),
+            reuse_port=self.config.reuse_port)
+        tcp_server = await asyncio.start_server(self.handle_tcp_stream,
+                                                self.config.hostname,
+                                                self.config.port,
+                                                reuse_address=True,
+                                                reuse_port=self.config.reuse_port)
+        logging.info(f'Async server launched on '
+                     f'{self.config.hostname}:{self.config.port}')
+        try:
+            async with tcp_server:
+                await self.update_cache_loop_async()
+        finally:
+            transport.close()
+
+    async def update_cache_loop_async(self) -> None:
+        prefetches = set()
+        while self.running:
+            self.cache.update()
+            if self.negative_cache is not None:
+                self.negative_cache.update()
+            if self.rrsets is not None:
+                self.rrsets.update()
+            if self.delegations is not None:
+                self.delegations.update()
+            if self.config.prefetch_fraction > 0:
+                for key in self.get_prefetch_keys():
+                    task = asyncio.ensure_future(self.prefetch_async(key))
+                    prefetches.add(task)
+                    task.add_done_callback(prefetches.discard)
+            if self.is_snapshot_due():
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.save_cache)
+            await asyncio.sleep(1)
+
+    async def prefetch_async(self, key: tuple) -> None:
+        try:
+            await run_async(self.refresh_question(key),
+                            self.exchange_upstream_async)
+        except Exception as e:
+            logging.error(f'Failed to prefetch {key}: {e}')
+
+    async def handle_udp_client_async(self, transport: asyncio.DatagramTransport,
+                                      data: bytes, address: tuple) -> None:
+        ip, port = address[:2]
+        try:
+            response = await self.get_bytes_dns_response_async(data, False,
+                                                               address)
+            if response:
+                transport.sendto(response, address)
+        except Exception as e:
+            logging.error(f'Failed to handle UDP client {ip}:{port}: {e}')
+
+    async def handle_tcp_stream(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter) -> None:
+        ip, port = writer.get_extra_info('peername')[:2]
+        logging.debug('Handling TCP client %s:%s', ip, port)
+        answers = set()
+        try:
+            while True:
+                try:
+                    data = await read_message(reader,
+                                              self.config.tcp_idle_timeout)
+                except asyncio.TimeoutError:
+                    if answers:
+                        continue
+                    logging.debug('Closing idle TCP client %s:%s', ip, port)
+                    break
+                if data is None:
+                    break
+                answer = asyncio.ensure_future(
+                    self.answer_tcp_query_async(writer, data, (ip, port)))
+                answers.add(answer)
+                answer.add_done_callback(answers.discard)
+        except Exception as e:
+            logging.error(f'Failed to handle TCP client {ip}:{port}: {e}')
+        finally:
+            if answers:
+                await asyncio.wait(answers)
+            writer.close()
+
+    async def answer_tcp_query_async(self, writer: asyncio.StreamWriter,
+                                     data: bytes, address: tuple) -> None:
+        ip, port = address
+        try:
+            response = await self.get_bytes_dns_response_async(data, True,
+                                                               address)
+            writer.write(response)
+            await writer.drain()
+        except Exception as e:
+            logging.error(f'Failed to answer TCP query from {ip}:{port}: {e}')
+
+    async def get_bytes_dns_response_async(self, bytes_message: bytes,
+                                           is_tcp: bool,
+                                           client: Optional[tuple] = None
+                                           ) -> bytes:
+        start = time.perf_counter()
+        try:
+            return await run_async(self.process_message(bytes_message, is_tcp,
+                                                        client),
+                                   self.exchange_upstream_async)
+        finally:
+            self.metrics.latency.observe(time.perf_counter() - start,
+                                         (get_protocol(is_tcp),))
+
+    async def exchange_upstream_async(self, queries: List[UpstreamQuery]) -> bytes:
+        queries = self.nameservers.order(queries)
+        if not self.config.hedged_queries or len(queries) < 2:
+            for query in queries:
+                if data := await self.send_query_async(query):
+                    return data
+            return b''
+        pending = set()
+        try:
+            for query in queries:
+                pending.add(asyncio.ensure_future(self.send_query_async(query)))
+                deadline = (asyncio.get_running_loop().time() +
+                            self.nameservers.timeout((query.address,
+                                                      query.port)))
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending,
+                        timeout=max(0.0, deadline -
+                                    asyncio.get_running_loop().time()),
+                        return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        logging.debug('Hedging query after %s', query.address)
+                        break
+                    for future in done:
+                        if data := future.result():
+                            return data
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if data := future.result():
+                        return data
+            return b''
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def send_query_async(self, query: UpstreamQuery) -> bytes:
+        start = time.monotonic()
+        data = await send_upstream_query_async(query)
+        self.record_upstream_query(query, data, time.monotonic() - start)
+        return data
+
+
+class UdpServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: AsyncServer):
+        self.server = server
+        self.transport = None
+        self.tasks = set()
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address: tuple) -> None:
+        task = asyncio.ensure_future(
+            self.server.handle_udp_client_async(self.transport, data, address))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
+class UdpClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, message: bytes):
+        self.message = message
+        self.response = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport) -> None:
+        transport.sendto(self.message)
+
+    def datagram_received(self, data: bytes, address: tuple) -> None:
+        if not self.response.done():
+            self.response.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        if not self.response.done():
+            self.response.set_exception(exc)
+
+
+async def get_dns_bytes_response_async(bytes_message: bytes,
+                                       address: str,
+                                       port: int,
+                                       tcp: bool) -> bytes:
+    if tcp:
+        reader, writer = await asyncio.open_connection(address, port)
+        try:
+            writer.write(bytes_message)
+            await writer.drain()
+            return await read_message(reader) or b''
+        finally:
+            writer.close()
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: UdpClientProtocol(bytes_message),
+        remote_addr=(address, port))
+    try:
+        return await protocol.response
+    finally:
+        transport.close()
+
+
+async def send_upstream_query_async(query: UpstreamQuery) -> bytes:
+    try:
+        return await asyncio.wait_for(
+            get_dns_bytes_response_async(query.message, query.address,
+                                         query.port, query.tcp),
+            timeout=1)
+    except Exception as e:
+        logging.error(f'Failed to get DNS response from '
+                      f'{query.address}:{query.port}: {e!r}')
+        return b''
+
+
+async def exchange_async(queries: List[UpstreamQuery]) -> bytes:
+    for query in queries:
+        if data := await send_upstream_query_async(query):
+            return data
+    return b''
+
+
+async def run_async(steps: Steps,
+                    exchange: Callable[[List[UpstreamQuery]],
+                                       Awaitable[bytes]] = exchange_async):
+    try:
+        query = next(steps)
+        while True:
+            if isinstance(query, concurrent.futures.Future):
+                query = steps.send(await asyncio.wrap_future(query))
+            else:
+                query = steps.send(await exchange(query))
+    except StopIteration as stop:
+        return stop.value
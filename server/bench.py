@@ -0,0 +1,273 @@
+# server/bench.py
+"""Load generator and micro-benchmarks for the DNS server.
+
+Starts the server on a free local port with a stub authoritative
+upstream, so no network access is needed, and replays a query mix
+against it:
+
+    python -m server.bench --queries 20000 --hit-ratio 0.9 --tcp-ratio 0.1
+
+Cache hits are drawn from a Zipf distribution over names resolved
+during warm-up, misses are names that were never asked before.
+"""
+import argparse
+import itertools
+import logging
+import random
+import socket
+import statistics
+import threading
+import time
+import timeit
+from typing import List, NamedTuple
+
+from entities.dns_message import DnsMessage
+from entities.question import Question
+from server.cached_response import CachedResponse
+from server.config import Config
+from server.server import Server
+from server.stub_upstream import StubUpstream, make_request
+from server.tcp_framing import receive_message
+from server.timed_lru_cache import TimedLruCache
+from server.workers import create_server
+
+CLIENT_TIMEOUT = 2
+
+
+class LoadResult(NamedTuple):
+    queries: int
+    timeouts: int
+    upstream_queries: int
+    seconds: float
+    latencies: List[float]
+
+    @property
+    def qps(self) -> float:
+        """Answered queries per second; timeouts are not throughput."""
+        return (self.queries - self.timeouts) / self.seconds
+
+    def percentile(self, percent: int) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return statistics.quantiles(self.latencies, n=100)[percent - 1]
+
+
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def zipf_weights(count: int, exponent: float) -> List[float]:
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent
+                                     for rank in range(count)))
+
+
+def make_names(queries: int, names: int, hit_ratio: float, exponent: float,
+               seed: int) -> List[str]:
+    rng = random.Random(seed)
+    hot = [f'host{i}.example.com' for i in range(names)]
+    weights = zipf_weights(names, exponent)
+    misses = (f'miss{i}.example.com' for i in itertools.count())
+    return [rng.choices(hot, cum_weights=weights)[0]
+            if rng.random() < hit_ratio else next(misses)
+            for _ in range(queries)]
+
+
+def start_server(config: Config) -> Server:
+    server = create_server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(0.1)
+            try:
+                sock.sendto(make_request('ready.example.com'),
+                            (config.hostname, config.port))
+                sock.recvfrom(65535)
+                return server
+            except OSError:
+                continue
+    raise RuntimeError('Server did not start')
+
+
+class Client:
+    def __init__(self, address: tuple):
+        self.address = address
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.settimeout(CLIENT_TIMEOUT)
+        self.tcp = socket.create_connection(address, CLIENT_TIMEOUT)
+
+    def query(self, name: str, transaction_id: int, tcp: bool) -> bool:
+        if tcp:
+            self.tcp.sendall(make_request(name, transaction_id, True))
+            return receive_message(self.tcp) is not None
+        self.udp.sendto(make_request(name, transaction_id), self.address)
+        while True:
+            data, _ = self.udp.recvfrom(65535)
+            # Drop late answers to queries that already timed out.
+            if int.from_bytes(data[:2], 'big') == transaction_id:
+                return True
+
+    def close(self) -> None:
+        self.udp.close()
+        self.tcp.close()
+
+
+def run_load(config: Config, upstream: StubUpstream, names: List[str],
+             tcp_ratio: float, concurrency: int, seed: int) -> LoadResult:
+    address = (config.hostname, config.port)
+    rng = random.Random(seed)
+    plan = [(name, rng.random() < tcp_ratio) for name in names]
+    latencies: List[List[float]] = [[] for _ in range(concurrency)]
+    timeouts = [0] * concurrency
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index: int) -> None:
+        client = Client(address)
+        try:
+            barrier.wait()
+            for i in range(index, len(plan), concurrency):
+                name, tcp = plan[i]
+                start = time.perf_counter()
+                try:
+                    client.query(name, i & 0xffff, tcp)
+                except OSError:
+                    timeouts[index] += 1
+                    if tcp:
+                        client.tcp.close()
+                        client.tcp = socket.create_connection(address,
+                                                              CLIENT_TIMEOUT)
+                    continue
+                latencies[index].append(time.perf_counter() - start)
+        finally:
+            client.close()
+
+    workers = [threading.Thread(target=worker, args=(i,))
+               for i in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    upstream_queries = upstream.queries
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    seconds = time.perf_counter() - start
+    return LoadResult(len(plan), sum(timeouts),
+                      upstream.queries - upstream_queries, seconds,
+                      [latency for part in latencies for latency in part])
+
+
+def warm_up(config: Config, names: int) -> None:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(CLIENT_TIMEOUT)
+        for i in range(names):
+            sock.sendto(make_request(f'host{i}.example.com', i & 0xffff),
+                        (config.hostname, config.port))
+            sock.recvfrom(65535)
+
+
+def run_micro_benchmarks(number: int) -> None:
+    message = DnsMessage.from_bytes(make_request('www.example.com'), False)
+    hexed = str(message)
+    with StubUpstream(records=4) as upstream:
+        response = DnsMessage.from_bytes(upstream.answer(
+            make_request('www.example.com'), False), False)
+    response_bytes = response.to_bytes()
+    cached = CachedResponse(response, True, True)
+    cache = TimedLruCache(number)
+    keys = [Question(f'host{i}.example.com', 1, 1).to_tuple()
+            for i in range(number)]
+    benchmarks = {
+        'DnsMessage.parse': lambda: DnsMessage.parse(hexed, False),
+        'DnsMessage.__str__': lambda: str(message),
+        'DnsMessage.from_bytes': lambda: DnsMessage.from_bytes(
+            response_bytes, False),
+        'DnsMessage.to_bytes': lambda: response.to_bytes(),
+        'DnsMessage.to_bytes (compressed)': lambda: response.to_bytes(
+            compress=True),
+        'CachedResponse.to_bytes': lambda: cached.to_bytes(1, False),
+        'TimedLruCache.add_item': lambda: cache.add_item(
+            keys[random.randrange(number)], cached, 300),
+        'TimedLruCache.get_item': lambda: cache.get_item(
+            keys[random.randrange(number)]),
+    }
+    print(f'{"operation":<34} {"us/op":>10}')
+    for name, benchmark in benchmarks.items():
+        seconds = min(timeit.repeat(benchmark, number=number, repeat=3))
+        print(f'{name:<34} {seconds / number * 1e6:>10.2f}')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(prog='python3 -m server.bench')
+    parser.add_argument('--queries', type=int, default=20000,
+                        help="number of queries to send")
+    parser.add_argument('--names', type=int, default=1000,
+                        help="number of distinct cached names")
+    parser.add_argument('--zipf', type=float, default=1.1,
+                        help="Zipf exponent of cached name popularity")
+    parser.add_argument('--hit-ratio', type=float, default=0.9,
+                        help="share of queries for cached names")
+    parser.add_argument('--tcp-ratio', type=float, default=0.1,
+                        help="share of queries sent over TCP")
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help="number of concurrent clients")
+    parser.add_argument('--engine', choices=('threads', 'asyncio'),
+                        default='threads')
+    parser.add_argument('--udp-batch-size', type=int, metavar='count',
+                        help="datagrams the threads engine drains per "
+                             "wakeup, 0 to hand each one to the pool")
+    parser.add_argument('--upstream-delay', type=float, default=0.0,
+                        help="seconds the stub upstream waits per answer")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--config', metavar='config_path',
+                        help="load server options from given config")
+    parser.add_argument('--micro', type=int, default=10000, metavar='count',
+                        help="iterations of each micro-benchmark, "
+                             "0 to skip them")
+    parser.add_argument('--no-load', action='store_true',
+                        help="only run the micro-benchmarks")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.WARNING)
+    if args.micro:
+        run_micro_benchmarks(args.micro)
+    if args.no_load:
+        return
+    with StubUpstream(delay=args.upstream_delay) as upstream:
+        config = Config()
+        if args.config:
+            config.load(args.config)
+        config.hostname = '127.0.0.1'
+        config.port = get_free_port()
+        config.engine = args.engine
+        if args.udp_batch_size is not None:
+            config.udp_batch_size = args.udp_batch_size
+        config.cache_file = ''
+        config.cache_size = max(config.cache_size,
+                                2 * (args.names + args.queries))
+        config.proxy_hostname = '127.0.0.1'
+        config.proxy_port = upstream.port
+        start_server(config)
+        warm_up(config, args.names)
+        names = make_names(args.queries, args.names, args.hit_ratio,
+                           args.zipf, args.seed)
+        result = run_load(config, upstream, names, args.tcp_ratio,
+                          args.concurrency, args.seed)
+    print(f'engine {args.engine}, UDP batch size {config.udp_batch_size}, '
+          f'{result.queries} queries, '
+          f'{args.concurrency} clients, hit ratio {args.hit_ratio}, '
+          f'TCP ratio {args.tcp_ratio}')
+    print(f'throughput: {result.qps:,.0f} answered queries/s')
+    print(f'latency: p50 {result.percentile(50) * 1e3:.2f} ms, '
+          f'p95 {result.percentile(95) * 1e3:.2f} ms, '
+          f'p99 {result.percentile(99) * 1e3:.2f} ms')
+    print(f'timeouts: {result.timeouts}, '
+          f'upstream queries: {result.upstream_queries}')
+
+
+if __name__ == '__main__':
+    main()
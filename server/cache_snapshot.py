@@ -0,0 +1,116 @@
+# server/cache_snapshot.py
+"""Binary snapshots of the response cache.
+
+A snapshot is a header followed by one record per entry:
+
+    expiration time, original TTL, creation time   (three doubles)
+    question length, response length, TTL offsets  (three uint16)
+    question in wire format
+    response in wire format, as served from the cache
+    offsets of the response TTLs                   (uint16 each)
+
+Times are absolute, so a loaded entry keeps its remaining lifetime and
+expired entries are skipped by reading the fixed-size part only.
+Snapshots are written to a temporary file which then replaces the old
+one, so a crash while saving leaves the previous snapshot intact.
+"""
+import gc
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from time import time
+from contextlib import contextmanager
+from typing import Iterable
+
+from entities.name import read_name
+from entities.question import QUESTION_TAIL, Question
+from server.cached_response import CachedResponse
+
+MAGIC = b'DNSCACHE'
+VERSION = 1
+HEADER = struct.Struct('!8sHI')
+RECORD = struct.Struct('!dddHHH')
+OFFSET = struct.Struct('!H')
+
+
+def pack_entry(key: tuple, response: CachedResponse, ttl: float,
+               expiration_time: float) -> bytes:
+    question = Question(*key).to_bytes()
+    wire, ttl_offsets = response.wire, response.ttl_offsets
+    if wire is None:
+        ttl_offsets = []
+        wire = response.message.to_bytes(ttl_offsets)
+    return b''.join((RECORD.pack(expiration_time, ttl, response.created,
+                                 len(question), len(wire), len(ttl_offsets)),
+                     question, wire,
+                     struct.pack(f'!{len(ttl_offsets)}H', *ttl_offsets)))
+
+
+def write_snapshot(filename: str, entries: Iterable[tuple],
+                   maxsize: int) -> None:
+    """Saves (key, response, ttl, expiration time) entries."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, maxsize))
+            for entry in entries:
+                f.write(pack_entry(*entry))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, filename)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def read_snapshot(filename: str) -> tuple[int, list[tuple]]:
+    """Returns the cache size and the unexpired entries of a snapshot as
+    (key, response, ttl, expiration time), in the order they were saved."""
+    with open(filename, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        magic, version, maxsize = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{filename} is not a cache snapshot')
+        now = time()
+        entries = []
+        offset = HEADER.size
+        end = len(buffer)
+        while offset < end:
+            (expiration_time, ttl, created, question_length, wire_length,
+             offsets_count) = RECORD.unpack_from(buffer, offset)
+            offset += RECORD.size
+            record_end = (offset + question_length + wire_length +
+                          offsets_count * OFFSET.size)
+            if record_end > end:
+                raise ValueError(f'Truncated record at offset {offset}')
+            if expiration_time <= now:
+                offset = record_end
+                continue
+            name, tail = read_name(buffer, offset)
+            tp, cls = QUESTION_TAIL.unpack_from(buffer, tail)
+            offset += question_length
+            wire = buffer[offset:offset + wire_length]
+            offset += wire_length
+            ttl_offsets = array('H', struct.unpack_from(f'!{offsets_count}H',
+                                                        buffer, offset))
+            offset = record_end
+            response = CachedResponse.from_wire(wire, ttl_offsets, created)
+            entries.append(((name, tp, cls), response, ttl,
+                            expiration_time))
+        return maxsize, entries
+
+
+@contextmanager
+def paused_gc():
+    """Loading creates many objects and no garbage: collections
+    triggered along the way would only slow it down."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
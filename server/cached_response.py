@@ -0,0 +1,133 @@
+# server/cached_response.py
+import struct
+from array import array
+from time import time
+from typing import Optional
+
+from entities.dns_message import DnsMessage, TCP_LENGTH
+from entities.edns import Edns
+from entities.query import Query
+
+TRANSACTION_ID = struct.Struct('!H')
+COUNT = struct.Struct('!H')
+ARCOUNT_OFFSET = 10
+TTL = struct.Struct('!I')
+
+
+class CachedResponse:
+    """A response as served for one question, optionally pre-encoded.
+
+    With the wire form stored, a cache hit is served by copying it,
+    patching the transaction ID and lowering every TTL by the time spent
+    in the cache, without building or encoding a DnsMessage.
+
+    Records keep their own TTLs: the cache entry lives as long as the
+    answer, and authority or additional records that expire before it
+    are dropped from the response instead of ending it.
+
+    Once encoded, the message is not kept: records are shared with the
+    RRset cache and the message is parsed back from the wire if needed.
+    """
+
+    __slots__ = ('parsed_message', 'created', 'wire', 'ttl_offsets',
+                 'min_ttl')
+
+    def __init__(self, message: DnsMessage, store_wire: bool,
+                 compress: bool = False):
+        self.parsed_message: Optional[DnsMessage] = message
+        self.created = time()
+        self.wire = None
+        # Offsets fit 16 bits; an array holds them without an int each.
+        self.ttl_offsets = array('H')
+        self.min_ttl: Optional[int] = None
+        if store_wire:
+            self.wire = message.to_bytes(self.ttl_offsets, compress)
+            self.min_ttl = min((query.ttl
+                                for query in message.get_all_queries()),
+                               default=1 << 32)
+            self.parsed_message = None
+
+    @classmethod
+    def from_wire(cls, wire: bytes, ttl_offsets: array, created: float):
+        """Restores a saved response; it is only parsed if message is used."""
+        response = cls.__new__(cls)
+        response.parsed_message = None
+        response.created = created
+        response.wire = wire
+        response.ttl_offsets = ttl_offsets
+        response.min_ttl = None
+        return response
+
+    @property
+    def reply_code(self) -> int:
+        if self.wire is not None:
+            return self.wire[3] & 0xf
+        return self.parsed_message.flags.reply_code
+
+    @property
+    def message(self) -> DnsMessage:
+        if self.parsed_message is None:
+            self.parsed_message = DnsMessage.from_bytes(self.wire, False)
+        return self.parsed_message
+
+    def get_min_ttl(self) -> int:
+        """The TTL of the first of the stored records to expire."""
+        if self.min_ttl is None:
+            if self.parsed_message is not None:
+                ttls = [query.ttl
+                        for query in self.parsed_message.get_all_queries()]
+            else:
+                ttls = [TTL.unpack_from(self.wire, offset)[0]
+                        for offset in self.ttl_offsets]
+            self.min_ttl = min(ttls, default=1 << 32)
+        return self.min_ttl
+
+    def is_stale(self, now: Optional[float] = None) -> bool:
+        """Whether some record has expired and must not be served."""
+        return (now or time()) - self.created >= self.get_min_ttl()
+
+    def get_current_message(self, now: Optional[float] = None) -> DnsMessage:
+        """The message with TTLs lowered by the time spent in the cache and
+        without the records that have expired."""
+        message = self.message
+        elapsed = int((now or time()) - self.created)
+        if elapsed <= 0:
+            return message
+
+        def age(queries: list[Query]) -> list[Query]:
+            return [query.with_ttl(query.ttl - elapsed)
+                    for query in queries if query.ttl > elapsed]
+
+        return DnsMessage(message.is_tcp, message.transaction_id,
+                          message.flags, message.questions,
+                          age(message.answers), age(message.authorities),
+                          age(message.add_records), message.edns)
+
+    def wire_size(self, edns: Optional[Edns] = None) -> int:
+        size = len(self.wire)
+        if edns is not None:
+            size += edns.to_query().wire_size()
+        return size
+
+    def to_bytes(self, transaction_id: int, is_tcp: bool,
+                 edns: Optional[Edns] = None) -> bytes:
+        offset = TCP_LENGTH.size if is_tcp else 0
+        size = self.wire_size(edns)
+        buffer = bytearray(offset + size)
+        buffer[offset:offset + len(self.wire)] = self.wire
+        if is_tcp:
+            TCP_LENGTH.pack_into(buffer, 0, size)
+        TRANSACTION_ID.pack_into(buffer, offset, transaction_id)
+        if edns is not None:
+            # The stored wire has no OPT record: it goes last, after the
+            # additional records, and is counted in ARCOUNT.
+            edns.to_query().pack_into(buffer, offset + len(self.wire))
+            arcount, = COUNT.unpack_from(self.wire, ARCOUNT_OFFSET)
+            COUNT.pack_into(buffer, offset + ARCOUNT_OFFSET, arcount + 1)
+        elapsed = int(time() - self.created)
+        if elapsed > 0:
+            for ttl_offset in self.ttl_offsets:
+                ttl, = TTL.unpack_from(self.wire, ttl_offset)
+                TTL.pack_into(buffer, offset + ttl_offset,
+                              max(ttl - elapsed, 0))
+        return bytes(buffer)
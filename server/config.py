@@ -7,12 +7,34 @@ class Config:
     def __init__(self):
         self.hostname = '127.0.0.2'
         self.port = 53
+        self.reuse_port = False
+        self.engine = 'threads'
         self.max_threads = 5
+        self.udp_batch_size = 32
+        self.tcp_idle_timeout = 10
         self.cache_size = 100
+        self.cache_shards = 1
+        self.negative_cache_size = 100
+        self.negative_cache_max_ttl = 10800
+        self.rrset_cache_size = 1000
+        self.cache_wire_responses = True
+        self.compress_names = True
+        self.edns_buffer_size = 1232
+        self.delegation_cache_size = 1000
+        self.prefetch_fraction = 0.1
+        self.prefetch_min_hits = 3
         self.log_file = 'log.txt'
-        self.cache_file = 'cache.pkl'
+        self.query_log_file = ''
+        self.query_log_sample_rate = 1.0
+        self.cache_file = 'cache.bin'
+        self.cache_snapshot_interval = 60
         self.proxy_hostname = "a.root-servers.net"
         self.proxy_port = 53
+        self.upstream_pool_size = 4
+        self.upstream_idle_timeout = 10
+        self.hedged_queries = False
+        self.metrics_hostname = '127.0.0.1'
+        self.metrics_port = 0
 
     def load(self, path: str) -> None:
         with open(path) as json_file:
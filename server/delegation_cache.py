@@ -0,0 +1,76 @@
+# server/delegation_cache.py
+from typing import Optional
+
+from entities.dns_message import DnsMessage
+from server.timed_lru_cache import TimedLruCache
+
+
+class DelegationCache:
+    """Zone cuts learned from referrals, mapped to nameserver addresses.
+
+    Addresses come from glue A records; a nameserver without glue is
+    stored by name, just like the resolver follows it without a cache.
+    """
+
+    def __init__(self, maxsize):
+        self.cache = TimedLruCache(maxsize)
+
+    def add_delegation(self, zone: str, addresses: list[str],
+                       ttl: int) -> None:
+        self.cache.add_item(zone, addresses, ttl)
+
+    def find(self, domain: str) -> Optional[tuple[str, list[str]]]:
+        labels = domain.lower().split('.')
+        for i in range(len(labels)):
+            zone = '.'.join(labels[i:])
+            addresses = self.cache.get_item(zone)
+            if addresses:
+                return zone, addresses
+        return None
+
+    def update(self) -> None:
+        self.cache.update()
+
+    def __len__(self):
+        return len(self.cache)
+
+
+def get_referral(domain: str, zone: str, response: DnsMessage
+                 ) -> Optional[tuple[str, list[str], int]]:
+    """The zone cut, nameserver addresses and TTL of a referral for
+    domain sent by a server of zone, or None if it is not one.
+
+    Only a cut strictly below zone that encloses domain is accepted, so
+    a server cannot take over its parent or a sibling zone, and glue is
+    only used for nameservers inside the cut; other nameservers are
+    kept by name.
+    """
+    nameservers: dict[str, list] = {}
+    for authority in response.authorities:
+        if authority.tp == 2:
+            nameservers.setdefault(authority.name.lower(), []).append(
+                authority)
+    for cut in sorted(nameservers, key=len, reverse=True):
+        if (cut == zone.lower() or not is_subdomain(cut, zone) or
+                not is_subdomain(domain, cut)):
+            continue
+        records = nameservers[cut]
+        addresses = []
+        ttl = min(record.ttl for record in records)
+        for record in records:
+            address = record.data
+            if is_subdomain(address, cut):
+                for glue in response.add_records:
+                    if glue.name.lower() == address.lower() and glue.tp == 1:
+                        address = glue.data
+                        ttl = min(ttl, glue.ttl)
+                        break
+            addresses.append(address)
+        return cut, addresses, ttl
+    return None
+
+
+def is_subdomain(domain: str, zone: str) -> bool:
+    domain = domain.lower()
+    zone = zone.lower()
+    return zone == '' or domain == zone or domain.endswith('.' + zone)
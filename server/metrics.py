@@ -0,0 +1,254 @@
+# server/metrics.py
+"""Counters and histograms exposed in the Prometheus text format.
+
+Every thread updates its own copy of a metric, so recording a value on
+the request path takes no lock: the copies are only merged when the
+metrics are scraped.
+"""
+import logging
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5)
+REFERRAL_BUCKETS = (0, 1, 2, 3, 4, 5, 8)
+QTYPE_NAMES = {1: 'A', 2: 'NS', 5: 'CNAME', 6: 'SOA', 12: 'PTR', 15: 'MX',
+               16: 'TXT', 28: 'AAAA', 33: 'SRV', 41: 'OPT', 255: 'ANY'}
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"'
+                          for name, value in zip(names, values)) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.shards: list[dict] = []
+
+    def get_values(self) -> dict:
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = {}
+            with self.lock:
+                self.shards.append(values)
+            return values
+
+    def collect_shards(self) -> list[dict]:
+        with self.lock:
+            return [dict(shard) for shard in self.shards]
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}',
+                f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        values = self.get_values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def collect(self) -> dict:
+        totals = {}
+        for shard in self.collect_shards():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{format_labels(self.labelnames, labels)}'
+                         f' {value}')
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 buckets: tuple, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        values = self.get_values()
+        counts = values.get(labels)
+        if counts is None:
+            # One count per bucket, then the +Inf bucket and the sum.
+            counts = values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self) -> dict:
+        totals = {}
+        for shard in self.collect_shards():
+            for labels, counts in shard.items():
+                total = totals.setdefault(labels, [0] * len(counts))
+                for i, value in enumerate(counts):
+                    total[i] += value
+        return totals
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, counts in sorted(self.collect().items()):
+            cumulative = 0
+            bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames + ('le',),
+                                              labels + (bound,))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {counts[-1]}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+class CallbackMetric(Metric):
+    """A metric whose value is read from elsewhere when it is scraped."""
+
+    def __init__(self, name: str, documentation: str, kind: str,
+                 callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.kind = kind
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        return super().render() + [f'{self.name} {self.callback()}']
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+class ServerMetrics:
+    def __init__(self, server):
+        registry = self.registry = Registry()
+        self.queries = registry.register(Counter(
+            'dns_queries_total', 'Client queries by protocol and type.',
+            ('protocol', 'qtype')))
+        self.latency = registry.register(Histogram(
+            'dns_query_duration_seconds',
+            'Time to answer a client query.', LATENCY_BUCKETS,
+            ('protocol',)))
+        self.upstream_queries = registry.register(Counter(
+            'dns_upstream_queries_total', 'Queries sent to nameservers.',
+            ('protocol',)))
+        self.upstream_timeouts = registry.register(Counter(
+            'dns_upstream_timeouts_total',
+            'Nameserver queries that failed or timed out.', ('protocol',)))
+        self.upstream_rtt = registry.register(Histogram(
+            'dns_upstream_rtt_seconds', 'Nameserver round-trip time.',
+            LATENCY_BUCKETS, ('protocol',)))
+        self.referrals = registry.register(Histogram(
+            'dns_resolution_referrals',
+            'Referrals followed per resolution.', REFERRAL_BUCKETS))
+        registry.register(CallbackMetric(
+            'dns_cache_entries', 'Entries in the response cache.', 'gauge',
+            lambda: len(server.cache)))
+        for name in ('hits', 'misses', 'evictions', 'expirations'):
+            registry.register(CallbackMetric(
+                f'dns_cache_{name}_total', f'Response cache {name}.',
+                'counter',
+                lambda name=name: server.cache.stats()[name]))
+        if server.negative_cache is not None:
+            registry.register(CallbackMetric(
+                'dns_negative_cache_entries',
+                'Entries in the NXDOMAIN and NODATA cache.', 'gauge',
+                lambda: len(server.negative_cache)))
+            for name in ('hits', 'misses'):
+                registry.register(CallbackMetric(
+                    f'dns_negative_cache_{name}_total',
+                    f'NXDOMAIN and NODATA cache {name}.', 'counter',
+                    lambda name=name: server.negative_cache.stats()[name]))
+        if server.rrsets is not None:
+            registry.register(CallbackMetric(
+                'dns_rrset_cache_entries', 'RRsets in the RRset cache.',
+                'gauge', lambda: len(server.rrsets)))
+            registry.register(CallbackMetric(
+                'dns_synthesized_answers_total',
+                'Questions answered from RRsets cached for others.',
+                'counter', lambda: server.rrsets.synthesized))
+        if server.upstream_pool is not None:
+            for name, documentation in (
+                    ('udp_queries', 'UDP queries sent through the pool.'),
+                    ('tcp_queries', 'TCP queries sent through the pool.'),
+                    ('tcp_connections', 'TCP connections opened by the '
+                                        'pool.')):
+                registry.register(CallbackMetric(
+                    f'dns_upstream_pool_{name}_total', documentation,
+                    'counter',
+                    lambda name=name: server.upstream_pool.stats()[name]))
+            registry.register(CallbackMetric(
+                'dns_upstream_pool_reuse_rate',
+                'Share of upstream queries sent over an existing socket.',
+                'gauge',
+                lambda: server.upstream_pool.stats()['reuse_rate']))
+        registry.register(CallbackMetric(
+            'dns_coalesced_queries_total',
+            'Questions answered by an in-flight resolution.', 'counter',
+            lambda: server.coalesced_queries))
+        registry.register(CallbackMetric(
+            'dns_prefetches_total', 'Cache entries refreshed before expiry.',
+            'counter', lambda: server.prefetches))
+
+    def count_query(self, protocol: str, qtype: int) -> None:
+        self.queries.inc((protocol, QTYPE_NAMES.get(qtype, str(qtype))))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f'Metrics request from {self.address_string()}: '
+                      f'{format % args}')
+
+
+def start_metrics_server(registry: Registry, hostname: str,
+                         port: int) -> Optional[ThreadingHTTPServer]:
+    try:
+        httpd = ThreadingHTTPServer((hostname, port), MetricsHandler)
+    except OSError as e:
+        logging.error(f'Failed to start metrics server on '
+                      f'{hostname}:{port}: {e}')
+        return None
+    httpd.daemon_threads = True
+    httpd.registry = registry
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    logging.info(f'Metrics served on http://{hostname}:{port}/metrics')
+    return httpd
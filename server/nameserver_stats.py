@@ -0,0 +1,76 @@
+# server/nameserver_stats.py
+import random
+from threading import Lock
+
+MIN_TIMEOUT = 0.05
+MAX_TIMEOUT = 1.0
+# Like BIND, servers we have not talked to yet get a small random
+# smoothed RTT so that every nameserver of a zone gets probed.
+UNKNOWN_RTT = 0.032
+
+
+class NameserverRtt:
+    def __init__(self):
+        self.srtt = random.uniform(0, UNKNOWN_RTT)
+        self.rttvar = 0.0
+        self.samples = 0
+        self.timeouts = 0
+
+    def to_dict(self):
+        return {
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'samples': self.samples,
+            'timeouts': self.timeouts,
+        }
+
+
+class NameserverStats:
+    """Smoothed round-trip times per upstream (address, port) (RFC 6298)."""
+
+    def __init__(self):
+        self.servers: dict[tuple, NameserverRtt] = {}
+        self.lock = Lock()
+
+    def get(self, server_address: tuple) -> NameserverRtt:
+        server = self.servers.get(server_address)
+        if server is None:
+            server = self.servers[server_address] = NameserverRtt()
+        return server
+
+    def record(self, server_address: tuple, rtt: float) -> None:
+        with self.lock:
+            server = self.get(server_address)
+            if server.samples == 0:
+                server.srtt = rtt
+                server.rttvar = rtt / 2
+            else:
+                server.rttvar = (0.75 * server.rttvar +
+                                 0.25 * abs(server.srtt - rtt))
+                server.srtt = 0.875 * server.srtt + 0.125 * rtt
+            server.samples += 1
+
+    def record_timeout(self, server_address: tuple) -> None:
+        with self.lock:
+            server = self.get(server_address)
+            server.timeouts += 1
+            server.srtt = min(max(server.srtt, MIN_TIMEOUT) * 2, MAX_TIMEOUT)
+
+    def timeout(self, server_address: tuple) -> float:
+        """Time to wait for a server before hedging to the next one."""
+        with self.lock:
+            server = self.get(server_address)
+            if server.samples == 0:
+                return MAX_TIMEOUT / 2
+            return min(max(server.srtt + 4 * server.rttvar, MIN_TIMEOUT),
+                       MAX_TIMEOUT)
+
+    def order(self, queries: list) -> list:
+        with self.lock:
+            return sorted(queries, key=lambda query: self.get(
+                (query.address, query.port)).srtt)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {f'{address}:{port}': server.to_dict()
+                    for (address, port), server in self.servers.items()}
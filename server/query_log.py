@@ -0,0 +1,156 @@
+# server/query_log.py
+"""Logging off the request path.
+
+Request threads only put log records on a queue; a background writer
+formats them and writes them in batches, one write and flush per batch.
+Answered queries go to a separate structured query log, optionally
+sampled.
+"""
+import logging
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler
+from typing import List, Optional
+
+from entities.question import Question
+from server.config import Config
+from server.metrics import QTYPE_NAMES
+
+QUERY_LOGGER = 'server.queries'
+LOG_FORMAT = '[%(asctime)s] - %(levelname)s - %(message)s'
+QUERY_LOG_FORMAT = '%(created).3f %(message)s'
+BATCH_SIZE = 256
+RCODE_NAMES = {0: 'NOERROR', 1: 'FORMERR', 2: 'SERVFAIL', 3: 'NXDOMAIN',
+               4: 'NOTIMP', 5: 'REFUSED'}
+
+current_writer: Optional['LogWriter'] = None
+
+
+class LazyQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The writer runs in this process, so the record can be queued
+        # as is and its message formatted there rather than here.
+        return record
+
+
+class LogWriter:
+    def __init__(self, handlers: List[logging.StreamHandler],
+                 batch_size: int = BATCH_SIZE):
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.write([record for record in batch if record is not None])
+            if None in batch:
+                return
+
+    def write(self, records: List[logging.LogRecord]) -> None:
+        for handler in self.handlers:
+            lines = []
+            for record in records:
+                if record.levelno < handler.level or not handler.filter(record):
+                    continue
+                try:
+                    lines.append(handler.format(record))
+                except Exception:
+                    handler.handleError(record)
+            if not lines:
+                continue
+            handler.acquire()
+            try:
+                handler.stream.write('\n'.join(lines) + '\n')
+                handler.flush()
+            except Exception as e:
+                sys.stderr.write(f'Failed to write {len(lines)} log lines: {e}\n')
+            finally:
+                handler.release()
+
+
+def create_handler(filename: str, log_format: str) -> logging.StreamHandler:
+    handler = (logging.FileHandler(filename) if filename
+               else logging.StreamHandler(sys.stdout))
+    handler.setFormatter(logging.Formatter(log_format))
+    return handler
+
+
+def setup_logging(config: Config, level: int) -> LogWriter:
+    global current_writer
+    handler = create_handler(config.log_file, LOG_FORMAT)
+    handlers = [handler]
+    if config.query_log_file:
+        handler.addFilter(lambda record: record.name != QUERY_LOGGER)
+        query_handler = create_handler(config.query_log_file,
+                                       QUERY_LOG_FORMAT)
+        query_handler.addFilter(logging.Filter(QUERY_LOGGER))
+        handlers.append(query_handler)
+    writer = LogWriter(handlers)
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(LazyQueueHandler(writer.queue))
+    root.setLevel(level)
+    writer.start()
+    current_writer = writer
+    return writer
+
+
+def stop_logging() -> None:
+    """Writes out the queued records."""
+    if current_writer is not None:
+        current_writer.stop()
+
+
+def restart_after_fork() -> None:
+    """Gives a forked worker its own queue and writer thread: threads do
+    not survive fork and the inherited queue may be mid-operation."""
+    writer = current_writer
+    if writer is None:
+        return
+    writer.queue = queue.SimpleQueue()
+    writer.thread = None
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, LazyQueueHandler):
+            handler.queue = writer.queue
+    writer.start()
+
+
+class QueryLog:
+    def __init__(self, sample_rate: float):
+        self.logger = logging.getLogger(QUERY_LOGGER)
+        self.sample_rate = sample_rate
+
+    def is_sampled(self) -> bool:
+        if self.sample_rate <= 0 or not self.logger.isEnabledFor(logging.INFO):
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def log(self, client: tuple, is_tcp: bool, question: Question,
+            reply_code: int, latency: float, cache_hit: bool) -> None:
+        self.logger.info('client=%s:%s proto=%s qname=%s qtype=%s rcode=%s '
+                         'latency_ms=%.3f cache=%s',
+                         client[0], client[1], 'tcp' if is_tcp else 'udp',
+                         question.name or '.',
+                         QTYPE_NAMES.get(question.tp, question.tp),
+                         RCODE_NAMES.get(reply_code, reply_code),
+                         latency * 1000, 'hit' if cache_hit else 'miss')
@@ -0,0 +1,172 @@
+# server/rrset_cache.py
+"""Records cached by RRset, keyed by (name, type, class).
+
+Every cached response also feeds its RRsets here, so an RRset carried
+by many responses, such as the NS records of a zone and their glue, is
+held once and shared by them. A question can also be answered from
+records that arrived in the answer section for another one, such as
+the target of a CNAME.
+
+RRsets are ranked by the section they came from (RFC 2181, 5.4.1): an
+answer replaces authority data, which replaces glue, but lower ranked
+data does not replace a live RRset of a higher rank. Only answers are
+served as answers, and only those of the question's name and of the
+CNAMEs it leads to; glue is only kept for addresses inside the zone of
+the NS record that names them. A server cannot plant records for names
+it was not asked about.
+"""
+from sys import intern
+from time import time
+from typing import Optional
+
+from entities.dns_message import DnsMessage
+from entities.flags import Flags
+from entities.query import AAAA, A, CNAME, NS, Query
+from entities.question import Question
+from server.delegation_cache import is_subdomain
+from server.timed_lru_cache import TimedLruCache
+
+ADDITIONAL, AUTHORITY, ANSWER = 1, 2, 3
+# Longest CNAME chain followed for one question.
+MAX_CNAME_CHAIN = 8
+
+
+class RRset:
+    __slots__ = ('records', 'rank', 'created')
+
+    def __init__(self, records: tuple, rank: int):
+        self.records = records
+        self.rank = rank
+        self.created = time()
+
+    def get_records(self, now: float) -> list[Query]:
+        """The records with TTLs lowered by the time spent in the cache."""
+        elapsed = int(now - self.created)
+        return [record.with_ttl(record.ttl - elapsed)
+                for record in self.records if record.ttl > elapsed]
+
+
+class RRsetCache:
+    def __init__(self, maxsize: int):
+        self.cache = TimedLruCache(maxsize)
+        self.synthesized = 0
+
+    def add_message(self, message: DnsMessage) -> None:
+        """Stores the RRsets of message and makes it use the stored
+        records, so equal records of different responses are shared."""
+        share_names(message)
+        message.answers = self.add_records(message.answers, ANSWER,
+                                           get_chain(message))
+        message.authorities = self.add_records(message.authorities,
+                                               AUTHORITY)
+        message.add_records = self.add_records(message.add_records,
+                                               ADDITIONAL, get_glue(message))
+
+    def add_records(self, records: list[Query], rank: int,
+                    owners: Optional[set[str]] = None) -> list[Query]:
+        """Stores the RRsets of records, only those owned by one of owners
+        if it is given; glue is also limited to addresses."""
+        rrsets: dict[tuple, list[Query]] = {}
+        for record in records:
+            if owners is None or (record.name.lower() in owners and
+                                  (rank > ADDITIONAL or
+                                   record.tp in (A, AAAA))):
+                rrsets.setdefault((record.name, record.tp, record.cls),
+                                  []).append(record)
+        shared = {}
+        for key, rrset in rrsets.items():
+            for record in self.add_rrset(key, rrset, rank):
+                shared[record.ttl, record] = record
+        return [shared.get((record.ttl, record), record)
+                for record in records]
+
+    def add_rrset(self, key: tuple, records: list[Query],
+                  rank: int) -> list[Query]:
+        current = self.cache.peek_item(key)
+        if current is not None:
+            stored = {(record.ttl, record): record
+                      for record in current.records}
+            records = [stored.get((record.ttl, record), record)
+                       for record in records]
+            if current.rank > rank:
+                return records
+        self.cache.add_item(key, RRset(tuple(records), rank),
+                            min(record.ttl for record in records))
+        return records
+
+    def get_records(self, key: tuple, rank: int = ADDITIONAL) -> list[Query]:
+        """The live records of the RRset at key if it has at least rank."""
+        rrset = self.cache.get_item(key)
+        if rrset is None or rrset.rank < rank:
+            return []
+        return rrset.get_records(time())
+
+    def synthesize(self, question: Question) -> Optional[DnsMessage]:
+        """An answer to question built from cached answer RRsets,
+        following CNAMEs, or None if some RRset on the way is not cached.
+        Authority and glue data is never returned as an answer."""
+        answers = []
+        name = question.name
+        for _ in range(MAX_CNAME_CHAIN + 1):
+            records = self.get_records((name, question.tp, question.cls),
+                                       ANSWER)
+            if records:
+                self.synthesized += 1
+                return DnsMessage(False, 0, Flags(1, 0, 0, 0, 0, 0, 0, 0),
+                                  [question], answers + records, [], [])
+            if question.tp == CNAME:
+                return None
+            aliases = self.get_records((name, CNAME, question.cls), ANSWER)
+            if not aliases:
+                return None
+            answers += aliases
+            name = aliases[0].data
+        return None
+
+    def update(self) -> None:
+        self.cache.update()
+
+    def __len__(self):
+        return len(self.cache)
+
+
+def get_chain(message: DnsMessage) -> set[str]:
+    """Names of the questions in message and of the CNAMEs they lead to:
+    only their records are taken from the answer section."""
+    aliases = {record.name.lower(): record.data.lower()
+               for record in message.answers if record.tp == CNAME}
+    chain = set()
+    for question in message.questions:
+        name = question.name.lower()
+        for _ in range(MAX_CNAME_CHAIN + 1):
+            chain.add(name)
+            if name not in aliases:
+                break
+            name = aliases[name]
+    return chain
+
+
+def get_glue(message: DnsMessage) -> set[str]:
+    """Names of the nameservers in message that lie inside the zone they
+    serve: only their addresses are taken from the additional section."""
+    return {record.data.lower()
+            for record in message.answers + message.authorities
+            if record.tp == NS and is_subdomain(record.data, record.name)}
+
+
+def share_names(message: DnsMessage) -> None:
+    """Makes the records of message hold one copy of each name.
+
+    Answers share the names of the question and of the CNAMEs before
+    them. Names of zones and nameservers recur in the authority and
+    additional sections of many responses, so they are interned.
+    """
+    names = {question.name: question.name for question in message.questions}
+    for record in message.answers:
+        record.name = names.setdefault(record.name, record.name)
+        if isinstance(record.value, str):
+            record.value = names.setdefault(record.value, record.value)
+    for record in message.authorities + message.add_records:
+        record.name = intern(record.name)
+        if isinstance(record.value, str):
+            record.value = intern(record.value)
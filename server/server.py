@@ -1,48 +1,135 @@
-import binascii
 import concurrent.futures
 import logging
+import random
 import socket
 import time
 from functools import reduce
-from threading import Thread
-from typing import Optional, Union, List
+from threading import Lock, Thread
+from typing import Callable, Generator, NamedTuple, Optional, Union, List
 from dataclasses import astuple
 
-from entities.dns_message import DnsMessage
-from entities.query import Query
+from entities.dns_message import DnsMessage, TCP_LENGTH
+from entities.edns import Edns, MIN_PAYLOAD_SIZE
+from entities.query import CNAME, NS, SOA
 from entities.question import Question
 from entities.flags import Flags
+from server.cached_response import CachedResponse
 from server.config import Config
+from server.delegation_cache import (DelegationCache, get_referral,
+                                     is_subdomain)
+from server.metrics import ServerMetrics, start_metrics_server
+from server.nameserver_stats import NameserverStats
+from server.query_log import QueryLog
+from server.rrset_cache import MAX_CNAME_CHAIN, RRsetCache
+from server.sharded_timed_lru_cache import ShardedTimedLruCache
+from server.tcp_framing import receive_message
 from server.timed_lru_cache import TimedLruCache
+from server.upstream_pool import UpstreamPool
+
+NXDOMAIN = 3
+# Receives without blocking, for one call only; where the flag is
+# missing each wakeup takes a single datagram.
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+
+class UpstreamQuery(NamedTuple):
+    message: bytes
+    address: str
+    port: int
+    tcp: bool
+
+
+# Request handling is written as generators that yield the upstream
+# queries they need and receive the raw responses, so the same code runs
+# under the blocking thread engine (run_blocking) and the asyncio engine.
+# A yielded list holds equivalent nameservers for one query; the engine
+# picks among them and sends back the first non-empty reply, or b''.
+# A yielded Future means "wait for another resolution of the same
+# question" and is answered with that resolution's result.
+Steps = Generator[Union[List[UpstreamQuery], concurrent.futures.Future],
+                  object, object]
 
 
 class Server:
     def __init__(self, config: Config):
         self.config: Config = config
         try:
-            self.cache = TimedLruCache.try_load_from_file(config.cache_file,
-                                                          config.cache_size)
+            self.cache = load_cache(config)
         except Exception as e:
             logging.error(f'Failed to load cache from file {config.cache_file}: {e}')
-            self.cache = TimedLruCache(config.cache_size)
+            self.cache = create_cache(config)
+        self.negative_cache: Optional[TimedLruCache] = (
+            TimedLruCache(config.negative_cache_size)
+            if config.negative_cache_size > 0 else None)
+        self.rrsets: Optional[RRsetCache] = (
+            RRsetCache(config.rrset_cache_size)
+            if config.rrset_cache_size > 0 else None)
         self.server: Union[socket.socket, None] = None
         self.running: bool = False
+        self.persist_cache: bool = True
+        self.flights: dict[tuple, concurrent.futures.Future] = {}
+        self.flights_lock = Lock()
+        self.coalesced_queries = 0
+        self.prefetches = 0
+        self.delegations: Optional[DelegationCache] = (
+            DelegationCache(config.delegation_cache_size)
+            if config.delegation_cache_size > 0 else None)
+        self.nameservers = NameserverStats()
+        self.prefetch_executor: Optional[
+            concurrent.futures.ThreadPoolExecutor] = None
+        self.hedge_executor: Optional[
+            concurrent.futures.ThreadPoolExecutor] = None
+        self.upstream_pool: Optional[UpstreamPool] = None
+        self.create_thread_resources()
+        self.metrics = ServerMetrics(self)
+        self.query_log = QueryLog(config.query_log_sample_rate)
+        self.metrics_server = None
+        self.next_snapshot = (time.monotonic() +
+                              config.cache_snapshot_interval)
+
+    def create_thread_resources(self) -> None:
+        """Creates the thread pools and upstream sockets that only the
+        thread engine uses."""
+        config = self.config
+        if config.prefetch_fraction > 0:
+            self.prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.max_threads)
+        if config.hedged_queries:
+            self.hedge_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=4 * config.max_threads)
+        if config.upstream_pool_size > 0:
+            self.upstream_pool = UpstreamPool(config.upstream_pool_size,
+                                              config.upstream_idle_timeout)
 
     def shutdown(self):
         logging.info('Shutting down server')
         try:
-            logging.info(f'Saving cache to file {self.config.cache_file}')
-            self.cache.save_to_file(self.config.cache_file)
-        except Exception as e:
-            logging.error(f'Failed to save cache to file {self.config.cache_file}: {e}')
+            if self.persist_cache:
+                self.save_cache()
         finally:
             self.running = False
+            if self.metrics_server:
+                self.metrics_server.shutdown()
+                self.metrics_server.server_close()
+            if self.upstream_pool:
+                self.upstream_pool.close()
+            if self.hedge_executor:
+                self.hedge_executor.shutdown(wait=False)
+            if self.prefetch_executor:
+                self.prefetch_executor.shutdown(wait=False)
             if self.server:
                 logging.info(f'Closing server {self.server.getsockname()}')
                 self.server.close()
 
+    def start_metrics_server(self) -> None:
+        if self.config.metrics_port:
+            self.metrics_server = start_metrics_server(
+                self.metrics.registry, self.config.metrics_hostname,
+                self.config.metrics_port)
+
     def run(self) -> None:
         self.running = True
+        self.start_metrics_server()
         try:
             p1 = Thread(target=self.run_with_udp)
             p2 = Thread(target=self.run_with_tcp)
@@ -69,112 +156,620 @@ class Server:
     def run_with_udp(self):
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
             server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.config.reuse_port:
+                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             server.bind((self.config.hostname, self.config.port))
             with concurrent.futures.ThreadPoolExecutor(
                     max_workers=self.config.max_threads) as executor:
+                if self.config.udp_batch_size > 0:
+                    self.serve_udp_batches(server, executor)
+                    return
                 while self.running:
                     data, address = server.recvfrom(8192)
                     executor.submit(self.handle_udp_client,
                                     server=server, data=data, address=address)
 
+    def serve_udp_batches(self, server: socket.socket,
+                          executor: concurrent.futures.Executor) -> None:
+        """Drains up to udp_batch_size queued datagrams per wakeup and
+        answers those that need no upstream query on this thread; only
+        the others are handed to the pool."""
+        while self.running:
+            for data, address in receive_batch(server,
+                                               self.config.udp_batch_size):
+                self.answer_udp_client(server, data, address, executor)
+
+    def answer_udp_client(self, server: socket.socket, data: bytes,
+                          address: tuple,
+                          executor: concurrent.futures.Executor) -> None:
+        start = time.perf_counter()
+        try:
+            steps = self.process_message(data, False, address)
+            try:
+                query = next(steps)
+            except StopIteration as stop:
+                self.send_udp_response(server, stop.value, address, start)
+                return
+            executor.submit(self.resume_udp_client, server, steps, query,
+                            address, start)
+        except Exception as e:
+            ip, port = address
+            logging.error(f'Failed to handle UDP client {ip}:{port}: {e}')
+
+    def resume_udp_client(self, server: socket.socket, steps: Steps,
+                          query, address: tuple, start: float) -> None:
+        try:
+            response = resume_blocking(steps, query, self.exchange_upstream)
+            self.send_udp_response(server, response, address, start)
+        except Exception as e:
+            ip, port = address
+            logging.error(f'Failed to handle UDP client {ip}:{port}: {e}')
+
+    def send_udp_response(self, server: socket.socket, response: bytes,
+                          address: tuple, start: float) -> None:
+        self.metrics.latency.observe(time.perf_counter() - start,
+                                     (get_protocol(False),))
+        if response:
+            server.sendto(response, address)
+
     def run_with_tcp(self):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
             server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.config.reuse_port:
+                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             server.bind((self.config.hostname, self.config.port))
             server.listen()
             with concurrent.futures.ThreadPoolExecutor(
                     max_workers=self.config.max_threads) as executor:
                 while self.running:
                     client, address = server.accept()
-                    executor.submit(self.handle_tcp_client, client=client, address=address)
+                    # Connections stay open between queries, so each one
+                    # gets its own reader thread and the pool only runs
+                    # the queries.
+                    Thread(target=self.handle_tcp_client,
+                           args=(client, address, executor),
+                           daemon=True).start()
 
     def update_cache_loop(self):
         while self.running:
             self.cache.update()
+            if self.negative_cache is not None:
+                self.negative_cache.update()
+            if self.rrsets is not None:
+                self.rrsets.update()
+            if self.delegations is not None:
+                self.delegations.update()
+            if self.prefetch_executor is not None:
+                for key in self.get_prefetch_keys():
+                    self.prefetch_executor.submit(self.prefetch, key)
+            if self.is_snapshot_due():
+                self.save_cache()
             time.sleep(1)
 
+    def is_snapshot_due(self) -> bool:
+        interval = self.config.cache_snapshot_interval
+        if not self.persist_cache or interval <= 0:
+            return False
+        now = time.monotonic()
+        if now < self.next_snapshot:
+            return False
+        self.next_snapshot = now + interval
+        return True
+
+    def save_cache(self) -> None:
+        try:
+            logging.info(f'Saving cache to file {self.config.cache_file}')
+            self.cache.save_to_file(self.config.cache_file)
+        except Exception as e:
+            logging.error(f'Failed to save cache to file {self.config.cache_file}: {e}')
+
+    def get_prefetch_keys(self) -> List[tuple]:
+        keys = self.cache.pop_refresh_candidates(self.config.prefetch_min_hits)
+        self.prefetches += len(keys)
+        return keys
+
+    def prefetch(self, key: tuple) -> None:
+        try:
+            run_blocking(self.refresh_question(key), self.exchange_upstream)
+        except Exception as e:
+            logging.error(f'Failed to prefetch {key}: {e}')
+
+    def refresh_question(self, key: tuple) -> Steps:
+        question = Question(*key)
+        logging.debug('Prefetching response for %s', question.name)
+        request = DnsMessage(False, random.getrandbits(16),
+                             Flags(0, 0, 0, 0, 0, 0, 0, 0),
+                             [question], [], [], [])
+        return (yield from self.resolve_question(request, question, False))
+
     def handle_udp_client(self, server: socket.socket,
                           data: bytes, address: tuple) -> None:
-        ip, port = address
-        logging.info(f'Handling UDP client {ip}:{port}')
         try:
-            response = self.get_bytes_dns_response(data, False)
+            response = self.get_bytes_dns_response(data, False, address)
             if response:
                 server.sendto(response, address)
-            logging.info(f'Successfully handled UDP client {ip}:{port}')
         except Exception as e:
+            ip, port = address
             logging.error(f'Failed to handle UDP client {ip}:{port}: {e}')
 
-    def handle_tcp_client(self, client: socket.socket, address: tuple) -> None:
-        ip, port = address
-        logging.info(f'Handling TCP client {ip}:{port}')
+    def handle_tcp_client(self, client: socket.socket, address: tuple,
+                          executor: Optional[concurrent.futures.Executor] = None
+                          ) -> None:
+        """Answers queries from one connection until it is closed or idle.
+
+        Queries are pipelined: each one is answered as soon as it is
+        resolved, possibly out of order (RFC 7766, 6.2.1.1).
+        """
+        ip, port = address[:2]
+        logging.debug('Handling TCP client %s:%s', ip, port)
+        send_lock = Lock()
+        answers: set[concurrent.futures.Future] = set()
+        client.settimeout(self.config.tcp_idle_timeout)
         try:
-            data = client.recv(8192)
-            response = self.get_bytes_dns_response(data, True)
-            client.sendall(response)
-            logging.info(f'Successfully handled TCP client {ip}:{port}')
+            while True:
+                try:
+                    data = receive_message(client)
+                except socket.timeout:
+                    if any(not answer.done() for answer in list(answers)):
+                        continue
+                    logging.debug('Closing idle TCP client %s:%s', ip, port)
+                    break
+                if data is None:
+                    break
+                if executor is None:
+                    self.answer_tcp_query(client, send_lock, data, address)
+                    continue
+                answer = executor.submit(self.answer_tcp_query, client,
+                                         send_lock, data, address)
+                answers.add(answer)
+                answer.add_done_callback(answers.discard)
         except Exception as e:
             logging.error(f'Failed to handle TCP client {ip}:{port}: {e}')
         finally:
+            concurrent.futures.wait(list(answers))
             client.close()
 
-    def get_bytes_dns_response(self, bytes_message: bytes, is_tcp: bool) -> bytes:
-        message = get_hexed_string(bytes_message)
-        request = DnsMessage.parse(message, is_tcp)
-        
+    def answer_tcp_query(self, client: socket.socket, send_lock: Lock,
+                         data: bytes, address: tuple) -> None:
+        ip, port = address[:2]
+        try:
+            response = self.get_bytes_dns_response(data, True, address)
+            with send_lock:
+                client.sendall(response)
+        except Exception as e:
+            logging.error(f'Failed to answer TCP query from {ip}:{port}: {e}')
+
+    def get_bytes_dns_response(self, bytes_message: bytes, is_tcp: bool,
+                               client: Optional[tuple] = None) -> bytes:
+        start = time.perf_counter()
+        try:
+            return run_blocking(self.process_message(bytes_message, is_tcp,
+                                                     client),
+                                self.exchange_upstream)
+        finally:
+            self.metrics.latency.observe(time.perf_counter() - start,
+                                         (get_protocol(is_tcp),))
+
+    def exchange_upstream(self, queries: List[UpstreamQuery]) -> bytes:
+        queries = self.nameservers.order(queries)
+        if self.hedge_executor is not None and len(queries) > 1:
+            return self.exchange_hedged(queries)
+        for query in queries:
+            if data := self.send_query(query):
+                return data
+        return b''
+
+    def exchange_hedged(self, queries: List[UpstreamQuery]) -> bytes:
+        pending = set()
+        for query in queries:
+            pending.add(self.hedge_executor.submit(self.send_query, query))
+            deadline = time.monotonic() + self.nameservers.timeout(
+                (query.address, query.port))
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, timeout=max(0.0, deadline - time.monotonic()),
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                if not done:
+                    logging.debug('Hedging query after %s', query.address)
+                    break
+                for future in done:
+                    if data := future.result():
+                        return data
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if data := future.result():
+                    return data
+        return b''
+
+    def send_query(self, query: UpstreamQuery) -> bytes:
+        start = time.monotonic()
+        if self.upstream_pool is None:
+            data = send_upstream_query(query)
+        else:
+            try:
+                data = self.upstream_pool.exchange(query.message,
+                                                   query.address,
+                                                   query.port, query.tcp)
+            except Exception as e:
+                logging.error(f'Failed to get DNS response from '
+                              f'{query.address}:{query.port}: {e}')
+                data = b''
+        self.record_upstream_query(query, data, time.monotonic() - start)
+        return data
+
+    def record_upstream_query(self, query: UpstreamQuery, data: bytes,
+                              rtt: float) -> None:
+        protocol = (get_protocol(query.tcp),)
+        self.metrics.upstream_queries.inc(protocol)
+        if data:
+            self.nameservers.record((query.address, query.port), rtt)
+            self.metrics.upstream_rtt.observe(rtt, protocol)
+        else:
+            self.nameservers.record_timeout((query.address, query.port))
+            self.metrics.upstream_timeouts.inc(protocol)
+
+    def process_message(self, bytes_message: bytes, is_tcp: bool,
+                        client: Optional[tuple] = None) -> Steps:
+        start = time.perf_counter()
+        request = DnsMessage.from_bytes(bytes_message, is_tcp)
+        limit = self.get_payload_limit(request, is_tcp)
+        edns = self.get_response_edns(request)
+
         responses: List[DnsMessage] = []
         questions: List[Question] = request.questions
+        cache_hit = True
         for question in questions:
-            if response := self.get_cached_dns_response(question):
-                logging.debug(f'Using cached response for {question.name}')
-                responses.append(response)
+            self.metrics.count_query(get_protocol(is_tcp), question.tp)
+            if cached := self.get_cached_dns_response(question):
+                logging.debug('Using cached response for %s', question.name)
+                if (cached.wire is not None and len(questions) == 1 and
+                        cached.wire_size(edns) <= limit):
+                    data = cached.to_bytes(request.transaction_id, is_tcp,
+                                           edns)
+                    self.log_query(client, is_tcp, request,
+                                   cached.reply_code, start, cache_hit)
+                    return data
+                responses.append(cached.get_current_message())
+            elif synthesized := self.synthesize_response(question):
+                logging.debug('Answering %s from cached RRsets',
+                              question.name)
+                responses.append(synthesized)
             else:
-                logging.debug(f'Getting response for {question.name}')
-                request.questions = [question]
-                response = get_dns_response(request,
-                                            self.config.proxy_hostname,
-                                            self.config.proxy_port,
-                                            is_tcp)
+                logging.debug('Getting response for %s', question.name)
+                cache_hit = False
+                response = yield from self.resolve_question(request, question,
+                                                            is_tcp)
                 if not response:
                     request.flags.qr = 1
                     request.flags.reply_code = 2
-                    return binascii.unhexlify(str(request))
-                logging.debug(f'Caching response for {question.name}')
-                self.cache_dns_response(question, response)
+                    request.edns = edns
+                    data = request.to_bytes()
+                    self.log_query(client, is_tcp, request, 2, start,
+                                   cache_hit)
+                    return data
                 responses.append(response)
-        answers = set()
-        authorities = set()
-        add_records = set()
-        for response in responses:
-            answers |= set(response.answers)
-            authorities |= set(response.authorities)
-            add_records |= set(response.add_records)
-        response = DnsMessage(is_tcp, request.transaction_id, 
-                            Flags(1, 0, 0, 0, 0, 0, 0, 0),
-                            request.questions,
-                            list(answers),
-                            list(authorities),
-                            list(add_records))
-        return binascii.unhexlify(str(response))
-
-    def get_cached_dns_response(self, question: Question) -> Optional[DnsMessage]:
+        response = build_response(request.transaction_id, questions,
+                                  responses, is_tcp)
+        response.edns = edns
+        data = encode_response(response, limit, self.config.compress_names)
+        self.log_query(client, is_tcp, request, response.flags.reply_code,
+                       start, cache_hit)
+        return data
+
+    def log_query(self, client: Optional[tuple], is_tcp: bool,
+                  request: DnsMessage, reply_code: int, start: float,
+                  cache_hit: bool) -> None:
+        if (client is not None and request.questions and
+                self.query_log.is_sampled()):
+            self.query_log.log(client, is_tcp, request.questions[0],
+                               reply_code, time.perf_counter() - start,
+                               cache_hit)
+
+    def get_payload_limit(self, request: DnsMessage, is_tcp: bool) -> int:
+        if is_tcp:
+            return 0xffff
+        if request.edns is None or not self.config.edns_buffer_size:
+            return MIN_PAYLOAD_SIZE
+        return max(MIN_PAYLOAD_SIZE, min(request.edns.payload_size,
+                                         self.config.edns_buffer_size))
+
+    def get_response_edns(self, request: DnsMessage) -> Optional[Edns]:
+        if request.edns is None or not self.config.edns_buffer_size:
+            return None
+        return Edns(self.config.edns_buffer_size)
+
+    def resolve_question(self, request: DnsMessage, question: Question,
+                         is_tcp: bool) -> Steps:
+        key = question.to_tuple()
+        with self.flights_lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.coalesced_queries += 1
+                is_leader = False
+            else:
+                flight = self.flights[key] = concurrent.futures.Future()
+                is_leader = True
+        if not is_leader:
+            logging.debug('Waiting for in-flight response for %s',
+                          question.name)
+            return (yield flight)
+        response = None
+        edns = (Edns(self.config.edns_buffer_size)
+                if self.config.edns_buffer_size else None)
+        upstream_request = DnsMessage(is_tcp, request.transaction_id,
+                                      request.flags, [question], [], [], [],
+                                      edns)
+        try:
+            response = yield from resolve(upstream_request,
+                                          self.config.proxy_hostname,
+                                          self.config.proxy_port,
+                                          is_tcp, self.delegations,
+                                          self.metrics)
+            if response:
+                response = yield from self.chase_cnames(upstream_request,
+                                                        question, response)
+            if response:
+                logging.debug('Caching response for %s', question.name)
+                self.cache_dns_response(question, response)
+        finally:
+            flight.set_result(response)
+            with self.flights_lock:
+                del self.flights[key]
+        return response
+
+    def chase_cnames(self, request: DnsMessage, question: Question,
+                     response: DnsMessage) -> Steps:
+        """Completes a response that ends in a CNAME with the records of
+        its target, from the cache when possible (RFC 1034, 3.6.2).
+
+        Targets are resolved directly rather than through resolve_question:
+        waiting for another resolution here could wait for this one.
+        """
+        seen = {question.name}
+        while (target := get_cname_target(response, question)) is not None:
+            if target in seen or len(seen) > MAX_CNAME_CHAIN:
+                logging.debug('Not following CNAME loop or long chain '
+                              'from %s', question.name)
+                return response
+            seen.add(target)
+            target_question = Question(target, question.tp, question.cls)
+            if cached := self.get_cached_dns_response(target_question):
+                logging.debug('Using cached response for CNAME target %s',
+                              target)
+                target_response = cached.get_current_message()
+            elif synthesized := self.synthesize_response(target_question):
+                target_response = synthesized
+            else:
+                logging.debug('Following CNAME to %s', target)
+                target_request = DnsMessage(request.is_tcp,
+                                            request.transaction_id,
+                                            request.flags, [target_question],
+                                            [], [], [], request.edns)
+                target_response = yield from resolve(
+                    target_request, self.config.proxy_hostname,
+                    self.config.proxy_port, request.is_tcp,
+                    self.delegations, self.metrics)
+                if not target_response:
+                    return None
+                self.cache_dns_response(target_question, target_response)
+            response = merge_cname_response(response, target_response)
+        return response
+
+    def get_cached_dns_response(self, question: Question) -> Optional[CachedResponse]:
         item = question.to_tuple()
-        return self.cache.get_item(item)
+        cache = self.cache
+        cached = cache.get_item(item)
+        if cached is None and self.negative_cache is not None:
+            cache = self.negative_cache
+            cached = cache.get_item(item)
+        if cached is not None and cached.is_stale():
+            # An authority or additional record expired before the answer:
+            # keep serving the answer without it.
+            logging.debug('Dropping expired records from cached %s',
+                          question.name)
+            message = cached.get_current_message()
+            cached = CachedResponse(message, cached.wire is not None,
+                                    self.config.compress_names)
+            cache.add_item(item, cached, get_cache_ttl(message))
+        return cached
+
+    def synthesize_response(self, question: Question) -> Optional[DnsMessage]:
+        """Answers question from RRsets cached for other questions, and
+        caches the answer so that the next hit is served from the wire."""
+        if self.rrsets is None:
+            return None
+        message = self.rrsets.synthesize(question)
+        if message is not None:
+            self.store_response(question, message)
+        return message
 
     def cache_dns_response(self, question: Question, response: DnsMessage) -> None:
-        queries = response.get_all_queries()
-        if len(queries) == 0:
+        if is_negative(response):
+            self.cache_negative_response(question, response)
             return
-        min_ttl = min(query.ttl for query in queries)
-        item = question.to_tuple()
-        self.cache.add_item(item, response, min_ttl)
-
-def get_dns_string_response_from_socket(hexed_message: str,
-                                        address: str,
-                                        port: int,
-                                        tcp: bool) -> str:
-    hexed_message = hexed_message.replace(" ", "").replace("\n", "").strip()
-    bytes_message = binascii.unhexlify(hexed_message)
+        if not response.answers:
+            return
+        message = build_response(0, [question], [response], False)
+        if self.rrsets is not None:
+            self.rrsets.add_message(message)
+        self.store_response(question, message)
+
+    def store_response(self, question: Question, message: DnsMessage) -> None:
+        self.cache.add_item(question.to_tuple(),
+                            CachedResponse(message,
+                                           self.config.cache_wire_responses,
+                                           self.config.compress_names),
+                            get_cache_ttl(message))
+
+    def cache_negative_response(self, question: Question,
+                                response: DnsMessage) -> None:
+        """Caches NXDOMAIN and NODATA answers apart from the positive ones
+        so that lookups of missing names cannot evict them (RFC 2308)."""
+        ttl = get_negative_ttl(response)
+        if self.negative_cache is None or ttl is None:
+            return
+        ttl = min(ttl, self.config.negative_cache_max_ttl)
+        # The SOA is served with the negative TTL, as it is what tells
+        # the client how long the answer may be cached (RFC 2308, 5).
+        response.authorities = [
+            record.with_ttl(ttl) if record.tp == SOA else record
+            for record in response.authorities]
+        message = build_response(0, [question], [response], False)
+        self.negative_cache.add_item(question.to_tuple(),
+                                     CachedResponse(
+                                         message,
+                                         self.config.cache_wire_responses,
+                                         self.config.compress_names),
+                                     get_cache_ttl(message))
+
+
+def build_response(transaction_id: int, questions: List[Question],
+                   responses: List[DnsMessage], is_tcp: bool) -> DnsMessage:
+    answers = {}
+    authorities = {}
+    add_records = {}
+    reply_code = 0
+    for response in responses:
+        # Dicts drop duplicates but keep CNAME chains in order.
+        answers.update(dict.fromkeys(response.answers))
+        authorities.update(dict.fromkeys(response.authorities))
+        add_records.update(dict.fromkeys(response.add_records))
+        reply_code = reply_code or response.flags.reply_code
+    return DnsMessage(is_tcp, transaction_id,
+                      Flags(1, 0, 0, 0, 0, 0, 0, reply_code),
+                      questions,
+                      list(answers),
+                      list(authorities),
+                      list(add_records))
+
+
+def get_cache_ttl(message: DnsMessage) -> int:
+    """How long a response may be served from the cache: as long as its
+    answer and, for a negative one, its SOA. Other records are dropped
+    when they expire, so they do not shorten it."""
+    ttls = [query.ttl for query in message.answers]
+    ttls += [query.ttl for query in message.authorities if query.tp == SOA]
+    if not ttls:
+        ttls = [query.ttl for query in message.get_all_queries()]
+    return min(ttls, default=0)
+
+
+def get_cname_target(response: DnsMessage,
+                     question: Question) -> Optional[str]:
+    """The name the CNAME chain for question ends at in response, or None
+    if the chain is answered or there is none."""
+    if question.tp == CNAME:
+        return None
+    aliases = {answer.name: answer.data for answer in response.answers
+               if answer.tp == CNAME}
+    name = question.name
+    for _ in range(len(aliases) + 1):
+        for answer in response.answers:
+            if answer.tp == question.tp and answer.name == name:
+                return None
+        if name not in aliases:
+            break
+        name = aliases[name]
+    return None if name == question.name else name
+
+
+def merge_cname_response(response: DnsMessage,
+                         target_response: DnsMessage) -> DnsMessage:
+    """The answers of both with the rest of the target's response, whose
+    reply code is the one of the whole chain (RFC 6604, 3)."""
+    answers = list(dict.fromkeys(response.answers +
+                                 target_response.answers))
+    return DnsMessage(response.is_tcp, response.transaction_id,
+                      target_response.flags, response.questions, answers,
+                      target_response.authorities,
+                      target_response.add_records, response.edns)
+
+
+def drop_out_of_zone_answers(response: DnsMessage,
+                             zone: str) -> DnsMessage:
+    """Removes the answers a server of zone has no authority for, such
+    as the target of a CNAME in another zone, which is then resolved
+    on its own."""
+    response.answers = [answer for answer in response.answers
+                        if is_subdomain(answer.name, zone)]
+    return response
+
+
+def is_negative(response: DnsMessage) -> bool:
+    """Whether response says the name does not exist (NXDOMAIN) or has
+    no records of the asked type (NODATA, RFC 2308, 2.2)."""
+    if response.flags.reply_code == NXDOMAIN:
+        return True
+    return (response.flags.reply_code == 0 and not response.answers and
+            any(record.tp == SOA for record in response.authorities))
+
+
+def is_referral(response: DnsMessage) -> bool:
+    """Whether response sends the question on to the nameservers in its
+    authority section instead of answering it."""
+    return (response.flags.reply_code == 0 and not response.answers and
+            any(record.tp == NS for record in response.authorities))
+
+
+def get_negative_ttl(response: DnsMessage) -> Optional[int]:
+    """The lesser of the SOA TTL and its minimum field (RFC 2308, 5),
+    or None if there is no SOA and the answer must not be cached."""
+    for record in response.authorities:
+        if record.tp == SOA:
+            return min(record.ttl, record.data.minimum)
+    return None
+
+
+def get_protocol(is_tcp: bool) -> str:
+    return 'tcp' if is_tcp else 'udp'
+
+
+def encode_response(response: DnsMessage, limit: int,
+                    compress: bool = False) -> bytes:
+    """Encodes response so that it fits in limit bytes (RFC 2181, 9).
+
+    Additional records are dropped first since the client can do without
+    them; if the answer still does not fit, only the question is sent
+    with the TC flag set so that the client retries over TCP.
+    """
+    prefix = TCP_LENGTH.size if response.is_tcp else 0
+    data = response.to_bytes(compress=compress)
+    if len(data) - prefix <= limit:
+        return data
+    response.add_records = []
+    data = response.to_bytes(compress=compress)
+    if len(data) - prefix <= limit:
+        return data
+    response.answers = []
+    response.authorities = []
+    response.flags.tc = 1
+    return response.to_bytes(compress=compress)
+
+
+def create_cache(config: Config) -> Union[TimedLruCache, ShardedTimedLruCache]:
+    if config.cache_shards > 1:
+        return ShardedTimedLruCache(config.cache_size, config.cache_shards,
+                                    config.prefetch_fraction)
+    return TimedLruCache(config.cache_size, config.prefetch_fraction)
+
+
+def load_cache(config: Config) -> Union[TimedLruCache, ShardedTimedLruCache]:
+    if config.cache_shards > 1:
+        return ShardedTimedLruCache.try_load_from_file(config.cache_file,
+                                                       config.cache_size,
+                                                       config.cache_shards,
+                                                       config.prefetch_fraction)
+    return TimedLruCache.try_load_from_file(config.cache_file,
+                                            config.cache_size,
+                                            config.prefetch_fraction)
+
+
+def get_dns_bytes_response_from_socket(bytes_message: bytes,
+                                       address: str,
+                                       port: int,
+                                       tcp: bool) -> bytes:
     server_address = (address, port)
     sock = (socket.socket(socket.AF_INET, socket.SOCK_STREAM) if tcp
             else socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
@@ -184,66 +779,141 @@ def get_dns_string_response_from_socket(hexed_message: str,
             sock.connect(server_address)
         except socket.error as e:
             logging.error(f'Failed to connect to {address}:{port}: {e}')
-            return ''
+            return b''
     data = b''
     try:
         if tcp:
             sock.sendall(bytes_message)
-            data = sock.recv(4096)
+            data = receive_message(sock) or b''
         else:
-            sock.sendto(binascii.unhexlify(hexed_message), server_address)
-            data, _ = sock.recvfrom(4096)
+            sock.sendto(bytes_message, server_address)
+            data, _ = sock.recvfrom(65535)
     except socket.error as e:
         logging.error(f'Failed to send/receive data to/from {address}:{port}: {e}')
     finally:
         sock.close()
-    return get_hexed_string(data)
+    return data
+
+
+def send_upstream_query(query: UpstreamQuery) -> bytes:
+    try:
+        return get_dns_bytes_response_from_socket(query.message,
+                                                  query.address,
+                                                  query.port,
+                                                  query.tcp)
+    except Exception as e:
+        logging.error(f'Failed to get DNS response from '
+                      f'{query.address}:{query.port}: {e}')
+        return b''
+
+
+def exchange(queries: List[UpstreamQuery]) -> bytes:
+    for query in queries:
+        if data := send_upstream_query(query):
+            return data
+    return b''
+
+
+def receive_batch(sock: socket.socket, size: int) -> List[tuple]:
+    """Waits for a datagram, then takes up to size - 1 more that are
+    already queued without waiting again."""
+    batch = [sock.recvfrom(8192)]
+    while MSG_DONTWAIT and len(batch) < size:
+        try:
+            batch.append(sock.recvfrom(8192, MSG_DONTWAIT))
+        except BlockingIOError:
+            break
+    return batch
+
+
+def run_blocking(steps: Steps,
+                 exchange: Callable[[List[UpstreamQuery]], bytes] = exchange):
+    try:
+        query = next(steps)
+    except StopIteration as stop:
+        return stop.value
+    return resume_blocking(steps, query, exchange)
+
+
+def resume_blocking(steps: Steps, query,
+                    exchange: Callable[[List[UpstreamQuery]],
+                                       bytes] = exchange):
+    """Runs steps that have already yielded query to the end."""
+    try:
+        while True:
+            if isinstance(query, concurrent.futures.Future):
+                query = steps.send(query.result())
+            else:
+                query = steps.send(exchange(query))
+    except StopIteration as stop:
+        return stop.value
 
 
 def get_dns_response(request, hostname, port, tcp: bool) -> Optional[DnsMessage]:
+    return run_blocking(resolve(request, hostname, port, tcp))
+
+
+def resolve(request, hostname, port, tcp: bool,
+            delegations: Optional[DelegationCache] = None,
+            metrics: Optional[ServerMetrics] = None) -> Steps:
     if request is None:
         return None
     if len(request.questions) == 0:
         return None
     domain = request.questions[0].name
     question_type = request.questions[0].tp
-    data = str(request)
+    data = request.to_bytes()
+    # A truncated UDP reply is retried over TCP with the same question.
+    tcp_data = data if tcp else TCP_LENGTH.pack(len(data)) + data
+    queries: List[UpstreamQuery] = []
+    referrals = 0
+    bytes_response = b''
     try:
-        string_response = get_dns_string_response_from_socket(data,
-                                                              hostname,
-                                                              port, tcp)
-    except Exception as e:
-        logging.error(f'Failed to get DNS response from {hostname}:{port}: {e}')
-        return None
-    while string_response:
-        try:
-            response = DnsMessage.parse(string_response, tcp)
-        except Exception as e:
-            logging.error(f'Failed to parse DNS response: {e}')
-            return None
-        for answer in response.answers:
-            if answer.tp == question_type and answer.name == domain:
+        # The zone of the servers being asked: referrals are only
+        # followed to zones below it.
+        zone = ''
+        if delegations is not None and (delegation := delegations.find(domain)):
+            zone, addresses = delegation
+            logging.debug('Starting resolution of %s at %s', domain, zone)
+            queries = [UpstreamQuery(data, address, 53, tcp)
+                       for address in addresses]
+            bytes_response = yield queries
+        if not bytes_response:
+            zone = ''
+            queries = [UpstreamQuery(data, hostname, port, tcp)]
+            bytes_response = yield queries
+        while bytes_response:
+            try:
+                response = DnsMessage.from_bytes(bytes_response,
+                                                 queries[0].tcp)
+            except Exception as e:
+                logging.error(f'Failed to parse DNS response: {e}')
+                return None
+            if response.flags.tc and not queries[0].tcp:
+                logging.debug('Truncated response for %s, retrying over TCP',
+                              domain)
+                queries = [query._replace(message=tcp_data, tcp=True)
+                           for query in queries]
+                bytes_response = yield queries
+                continue
+            for answer in response.answers:
+                if (answer.tp in (question_type, CNAME) and
+                        answer.name == domain):
+                    return drop_out_of_zone_answers(response, zone)
+            if is_negative(response):
                 return response
-        for authority in response.authorities:
-            if authority.tp == 2 and authority.name != "":
-                address = authority.data
-                for record in response.add_records:
-                    if record.name == address and record.tp == 1:
-                        address = record.data
-                        break
-                try:
-                    string_response = get_dns_string_response_from_socket(
-                        data, address, 53, tcp)
-                except Exception as e:
-                    logging.error(f'Failed to get DNS response from {address}:53: {e}')
-                    continue
-                if not string_response:
-                    continue
-                break
-        else:
-            return response
-    return None
-
-
-def get_hexed_string(data: bytes) -> str:
-    return binascii.hexlify(data).decode("iso8859-1")
+            referral = get_referral(domain, zone, response)
+            if referral is None:
+                # A referral that cannot be followed is not an answer.
+                return None if is_referral(response) else response
+            zone, addresses, ttl = referral
+            if delegations is not None:
+                delegations.add_delegation(zone, addresses, ttl)
+            queries = [UpstreamQuery(data, address, 53, tcp)
+                       for address in addresses]
+            referrals += 1
+            bytes_response = yield queries
+        return None
+    finally:
+        if metrics is not None:
+            metrics.referrals.observe(referrals)
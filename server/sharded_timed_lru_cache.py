@@ -0,0 +1,80 @@
+# server/sharded_timed_lru_cache.py
+from server.cache_snapshot import paused_gc
+from server.timed_lru_cache import TimedLruCache, load_entries, save_entries
+
+
+class ShardedTimedLruCache:
+    def __init__(self, maxsize, shards=16, refresh_fraction=0.0):
+        self.maxsize = maxsize
+        self.refresh_fraction = refresh_fraction
+        self.shards = [TimedLruCache(-(-maxsize // shards), refresh_fraction)
+                       for _ in range(shards)]
+
+    def get_shard(self, key) -> TimedLruCache:
+        return self.shards[hash(key) % len(self.shards)]
+
+    def add_item(self, key, value, ttl):
+        self.get_shard(key).add_item(key, value, ttl)
+
+    def get_item(self, key):
+        return self.get_shard(key).get_item(key)
+
+    def update(self):
+        for shard in self.shards:
+            shard.update()
+
+    def pop_refresh_candidates(self, min_hits):
+        keys = []
+        for shard in self.shards:
+            keys += shard.pop_refresh_candidates(min_hits)
+        return keys
+
+    def stats(self):
+        totals = {}
+        for shard in self.shards:
+            for name, value in shard.stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def __contains__(self, item):
+        return item in self.get_shard(item)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def get_entries(self):
+        entries = {}
+        for shard in self.shards:
+            entries.update(shard.get_entries())
+        return entries
+
+    def set_entries(self, entries):
+        partitions = [{} for _ in self.shards]
+        for key, entry in entries.items():
+            partitions[hash(key) % len(self.shards)][key] = entry
+        for shard, partition in zip(self.shards, partitions):
+            shard.set_entries(partition)
+
+    def save_to_file(self, filename):
+        save_entries(filename, self.get_entries(), self.maxsize)
+
+    @classmethod
+    def load_from_file(cls, filename, shards=16, refresh_fraction=0.0,
+                       maxsize=None):
+        with paused_gc():
+            saved_maxsize, entries = load_entries(filename)
+            cache = cls(maxsize or saved_maxsize, shards, refresh_fraction)
+            cache.set_entries(entries)
+            return cache
+
+    @classmethod
+    def try_load_from_file(cls, filename, maxsize, shards=16,
+                           refresh_fraction=0.0):
+        try:
+            return cls.load_from_file(filename, shards, refresh_fraction,
+                                      maxsize)
+        except Exception as e:
+            print(e)
+        print("Ignoring cache file")
+        print(f"Initializing cache with {maxsize} size")
+        return cls(maxsize, shards, refresh_fraction)
@@ -0,0 +1,169 @@
+# server/stub_upstream.py
+"""Local authoritative DNS stub used by the tests and server.bench.
+
+It answers every question with as many A records as records, counting
+up from address, so the server can be exercised without network
+access. Names in missing get NXDOMAIN and types in nodata_types get an
+empty answer, both with an SOA whose minimum is negative_ttl. Names in
+aliases are answered with a lone CNAME to the name they map to. With
+glue_ttl set, answers also carry an NS record and its glue with that
+TTL.
+"""
+import socket
+import struct
+import threading
+import time
+
+from entities.dns_message import DnsMessage
+from entities.edns import Edns, MIN_PAYLOAD_SIZE
+from entities.flags import Flags
+from entities.query import CNAME, NS, Query, SOA, Soa
+from entities.question import Question
+from server.tcp_framing import receive_message
+
+BIND_ATTEMPTS = 20
+
+
+def bind_sockets() -> tuple[socket.socket, socket.socket]:
+    """UDP and TCP sockets bound to the same free local port.
+
+    The UDP socket gets an ephemeral port, which may already be taken
+    for TCP; another port is tried then.
+    """
+    for attempt in range(BIND_ATTEMPTS):
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            udp.bind(('127.0.0.1', 0))
+            tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            tcp.bind(('127.0.0.1', udp.getsockname()[1]))
+            return udp, tcp
+        except OSError:
+            udp.close()
+            tcp.close()
+            if attempt == BIND_ATTEMPTS - 1:
+                raise
+
+
+class StubUpstream:
+    def __init__(self, address='10.0.0.1', ttl=300, delay=0.0, records=1,
+                 missing=(), nodata_types=(), negative_ttl=60,
+                 aliases=None, glue_ttl=None):
+        self.address = address
+        self.ttl = ttl
+        self.delay = delay
+        self.records = records
+        self.missing = set(missing)
+        self.nodata_types = set(nodata_types)
+        self.negative_ttl = negative_ttl
+        self.aliases = aliases or {}
+        self.glue_ttl = glue_ttl
+        self.queries = 0
+        self.truncated = 0
+        self.lock = threading.Lock()
+        self.udp, self.tcp = bind_sockets()
+        self.port = self.udp.getsockname()[1]
+        self.tcp.listen()
+        self.running = False
+
+    def __enter__(self):
+        self.running = True
+        for target in (self.serve_udp, self.serve_tcp):
+            threading.Thread(target=target, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.running = False
+        self.udp.close()
+        self.tcp.close()
+
+    def answer(self, data: bytes, is_tcp: bool) -> bytes:
+        with self.lock:
+            self.queries += 1
+        if self.delay:
+            time.sleep(self.delay)
+        request = DnsMessage.from_bytes(data, is_tcp)
+        question = request.questions[0]
+        if question.name in self.aliases:
+            reply_code = 0
+            answers = [Query(question.name, CNAME, 1, self.ttl,
+                             self.aliases[question.name])]
+            authorities = []
+        elif (question.name in self.missing or
+                question.tp in self.nodata_types):
+            reply_code = 3 if question.name in self.missing else 0
+            answers = []
+            authorities = [self.make_soa(question.name)]
+        else:
+            first, = struct.unpack('!I', socket.inet_aton(self.address))
+            reply_code = 0
+            answers = [Query(question.name, 1, 1, self.ttl,
+                             socket.inet_ntoa(struct.pack('!I', first + i)))
+                       for i in range(self.records)]
+            authorities = []
+        add_records = []
+        if self.glue_ttl is not None and answers:
+            zone = question.name.partition('.')[2] or question.name
+            authorities = [Query(zone, NS, 1, self.glue_ttl, f'ns.{zone}')]
+            add_records = [Query(f'ns.{zone}', 1, 1, self.glue_ttl,
+                                 self.address)]
+        response = DnsMessage(is_tcp, request.transaction_id,
+                              Flags(1, 0, 1, 0, 0, 0, 0, reply_code),
+                              request.questions, answers, authorities,
+                              add_records, request.edns)
+        data = response.to_bytes()
+        limit = (request.edns.payload_size if request.edns is not None
+                 else MIN_PAYLOAD_SIZE)
+        if not is_tcp and len(data) > limit:
+            with self.lock:
+                self.truncated += 1
+            response.answers = []
+            response.flags.tc = 1
+            data = response.to_bytes()
+        return data
+
+    def make_soa(self, name: str) -> Query:
+        zone = name.partition('.')[2] or name
+        return Query(zone, SOA, 1, self.ttl,
+                     Soa(f'ns.{zone}', f'hostmaster.{zone}', 1, 3600, 600,
+                         86400, self.negative_ttl))
+
+    def serve_udp(self):
+        while self.running:
+            try:
+                data, address = self.udp.recvfrom(8192)
+            except OSError:
+                return
+            threading.Thread(target=self.reply_udp, args=(data, address),
+                             daemon=True).start()
+
+    def reply_udp(self, data: bytes, address: tuple):
+        try:
+            self.udp.sendto(self.answer(data, False), address)
+        except OSError:
+            pass
+
+    def serve_tcp(self):
+        while self.running:
+            try:
+                client, _ = self.tcp.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.reply_tcp, args=(client,),
+                             daemon=True).start()
+
+    def reply_tcp(self, client: socket.socket):
+        with client:
+            try:
+                while data := receive_message(client):
+                    client.sendall(self.answer(data, True))
+            except OSError:
+                pass
+
+
+def make_request(name: str, transaction_id: int = 1,
+                 is_tcp: bool = False, tp: int = 1,
+                 payload_size: int = 0) -> bytes:
+    edns = Edns(payload_size) if payload_size else None
+    return DnsMessage(is_tcp, transaction_id, Flags(0, 0, 0, 0, 1, 0, 0, 0),
+                      [Question(name, tp, 1)], [], [], [], edns).to_bytes()
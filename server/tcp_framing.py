@@ -0,0 +1,65 @@
+# server/tcp_framing.py
+import asyncio
+import socket
+from typing import Optional
+
+from entities.dns_message import TCP_LENGTH
+
+
+def receive_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    """Reads size bytes, or returns None if the peer closed the connection.
+
+    A timeout before the first byte is raised as is, so the caller can
+    tell an idle connection from a message cut short.
+    """
+    data = bytearray()
+    while len(data) < size:
+        try:
+            chunk = sock.recv(size - len(data))
+        except socket.timeout:
+            if data:
+                raise ConnectionError('Timed out in the middle of a message')
+            raise
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def receive_message(sock: socket.socket) -> Optional[bytes]:
+    """Reads one length-prefixed message (RFC 1035, 4.2.2).
+
+    The message is returned with its prefix, as DnsMessage.from_bytes
+    expects for TCP, or None once the peer has closed the connection.
+    """
+    prefix = receive_exactly(sock, TCP_LENGTH.size)
+    if prefix is None:
+        return None
+    length, = TCP_LENGTH.unpack(prefix)
+    body = receive_exactly(sock, length)
+    if body is None:
+        raise ConnectionError(f'Connection closed after {length} byte '
+                              f'message was announced')
+    return prefix + body
+
+
+async def read_message(reader: asyncio.StreamReader,
+                       idle_timeout: Optional[float] = None) -> Optional[bytes]:
+    """Async version of receive_message.
+
+    Only the wait for the length prefix is bounded by idle_timeout:
+    asyncio.TimeoutError means that no message has started arriving.
+    """
+    try:
+        prefix = await asyncio.wait_for(reader.readexactly(TCP_LENGTH.size),
+                                        idle_timeout)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError('Connection closed inside a length prefix')
+        return None
+    length, = TCP_LENGTH.unpack(prefix)
+    try:
+        return prefix + await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError(f'Connection closed after {length} byte '
+                              f'message was announced')
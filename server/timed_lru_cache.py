@@ -1,13 +1,24 @@
 # server/timed_lru_cache.py
+from collections import OrderedDict
+from heapq import heapify, heappop, heappush
+from itertools import count
 from threading import RLock
 from time import time
-import pickle
+
+from server.cache_snapshot import paused_gc, read_snapshot, write_snapshot
 
 class TimedLruCacheEntry:
+    __slots__ = ('value', 'ttl', 'expiration_time', 'hits')
+
     def __init__(self, value, expiration_time: float):
         self.value = value
+        self.hits = 0
+        self.ttl = expiration_time
         self.expiration_time = time() + expiration_time
 
+    def refresh_time(self, fraction: float) -> float:
+        return self.expiration_time - self.ttl * fraction
+
     def to_dict(self):
         return {
             'value': self.value,
@@ -20,61 +31,195 @@ class TimedLruCacheEntry:
         entry.expiration_time = data['expiration_time']
         return entry
 
+    @classmethod
+    def restore(cls, value, ttl, expiration_time):
+        entry = cls.__new__(cls)
+        entry.value = value
+        entry.ttl = ttl
+        entry.expiration_time = expiration_time
+        entry.hits = 0
+        return entry
+
 class TimedLruCache:
-    def __init__(self, maxsize):
-        self.entries = {}
+    def __init__(self, maxsize, refresh_fraction=0.0):
+        self.entries = OrderedDict()
+        self.expirations = []
+        self.refreshes = []
+        self.counter = count()
         self.maxsize = maxsize
+        self.refresh_fraction = refresh_fraction
         self.lock = RLock()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+        self.expiration_count = 0
 
     def add_item(self, key, value, ttl):
         with self.lock:
-            if key not in self:
+            entry = TimedLruCacheEntry(value, ttl)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            elif len(self.entries) >= self.maxsize:
+                self.update()
                 if len(self.entries) >= self.maxsize:
-                    del self.entries[next(iter(self.entries.keys()))]
-                self.entries[key] = TimedLruCacheEntry(value, ttl)
-            else:
-                del self.entries[key]
-                self.entries[key] = TimedLruCacheEntry(value, ttl)
+                    self.entries.popitem(last=False)
+                    self.eviction_count += 1
+            self.entries[key] = entry
+            # Rebuilding the expiration heap also rebuilds the refresh
+            # heap with this entry, so the refresh goes in first.
+            if self.refresh_fraction > 0 and ttl > 0:
+                self.push_refresh(key, entry)
+            self.push_expiration(key, entry)
 
     def get_item(self, key):
         with self.lock:
-            self.update()
             entry = self.entries.get(key, None)
-            return (entry.value if isinstance(entry, TimedLruCacheEntry)
-                    else None)
+            if entry is None:
+                self.miss_count += 1
+                return None
+            if entry.expiration_time <= time():
+                del self.entries[key]
+                self.miss_count += 1
+                self.expiration_count += 1
+                return None
+            self.entries.move_to_end(key)
+            entry.hits += 1
+            self.hit_count += 1
+            return entry.value
+
+    def peek_item(self, key):
+        """The live value for key, without counting a hit or a miss."""
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None or entry.expiration_time <= time():
+                return None
+            return entry.value
 
     def update(self):
         with self.lock:
-            self.entries = {k: v for k, v in self.entries.items()
-                           if v.expiration_time > time()}
+            now = time()
+            while self.expirations and self.expirations[0][0] <= now:
+                expiration_time, _, key = heappop(self.expirations)
+                entry = self.entries.get(key, None)
+                if (entry is not None and
+                        entry.expiration_time == expiration_time):
+                    del self.entries[key]
+                    self.expiration_count += 1
+
+    def push_expiration(self, key, entry):
+        # Replaced and evicted entries leave stale heap items behind;
+        # rebuild once they outnumber live entries to keep the heap bounded.
+        if len(self.expirations) > 2 * len(self.entries) + 64:
+            self.rebuild_expirations()
+        else:
+            heappush(self.expirations,
+                     (entry.expiration_time, next(self.counter), key))
+
+    def rebuild_expirations(self):
+        with self.lock:
+            self.expirations = [(entry.expiration_time, next(self.counter), key)
+                                for key, entry in self.entries.items()]
+            heapify(self.expirations)
+            self.rebuild_refreshes()
+
+    def push_refresh(self, key, entry):
+        if len(self.refreshes) > 2 * len(self.entries) + 64:
+            self.rebuild_refreshes()
+        else:
+            heappush(self.refreshes,
+                     (entry.refresh_time(self.refresh_fraction),
+                      next(self.counter), key, entry.expiration_time))
+
+    def rebuild_refreshes(self):
+        with self.lock:
+            self.refreshes = []
+            if self.refresh_fraction <= 0:
+                return
+            now = time()
+            for key, entry in self.entries.items():
+                refresh_time = entry.refresh_time(self.refresh_fraction)
+                if refresh_time > now:
+                    self.refreshes.append((refresh_time, next(self.counter),
+                                           key, entry.expiration_time))
+            heapify(self.refreshes)
+
+    def pop_refresh_candidates(self, min_hits):
+        """Keys of entries hit at least min_hits times that entered the
+        last refresh_fraction of their TTL since the previous call."""
+        with self.lock:
+            now = time()
+            keys = []
+            while self.refreshes and self.refreshes[0][0] <= now:
+                _, _, key, expiration_time = heappop(self.refreshes)
+                entry = self.entries.get(key, None)
+                if (entry is not None and
+                        entry.expiration_time == expiration_time and
+                        expiration_time > now and entry.hits >= min_hits):
+                    keys.append(key)
+            return keys
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hit_count,
+                'misses': self.miss_count,
+                'evictions': self.eviction_count,
+                'expirations': self.expiration_count,
+            }
 
     def __contains__(self, item):
         with self.lock:
-            self.update()
-            return item in self.entries
+            entry = self.entries.get(item, None)
+            return entry is not None and entry.expiration_time > time()
 
-    def save_to_file(self, filename):
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def get_entries(self):
+        with self.lock:
+            return dict(self.entries)
+
+    def set_entries(self, entries):
         with self.lock:
-            with open(filename, 'wb') as f:
-                pickle.dump({'entries': self.entries,
-                             'maxsize': self.maxsize}, f)
+            self.entries = OrderedDict(entries)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            self.rebuild_expirations()
+
+    def save_to_file(self, filename):
+        # The snapshot is written outside the lock from a copy of the
+        # entries, so saving does not stall lookups.
+        save_entries(filename, self.get_entries(), self.maxsize)
 
     @classmethod
-    def load_from_file(cls, filename):
-        with open(filename, 'rb') as f:
-            data = pickle.load(f)
-        cache = TimedLruCache(data['maxsize'])
-        cache.entries = data['entries']
-        return cache
+    def load_from_file(cls, filename, maxsize=None, refresh_fraction=0.0):
+        with paused_gc():
+            saved_maxsize, entries = load_entries(filename)
+            cache = cls(maxsize or saved_maxsize, refresh_fraction)
+            cache.set_entries(entries)
+            return cache
 
     @classmethod
-    def try_load_from_file(cls, filename, maxsize):
+    def try_load_from_file(cls, filename, maxsize, refresh_fraction=0.0):
         try:
-            cache = cls.load_from_file(filename)
-            cache.maxsize = maxsize
-            return cache
+            return cls.load_from_file(filename, maxsize, refresh_fraction)
         except Exception as e:
             print(e)
         print("Ignoring cache file")
         print(f"Initializing cache with {maxsize} size")
-        return cls(maxsize)
+        return cls(maxsize, refresh_fraction)
+
+
+def save_entries(filename, entries, maxsize):
+    write_snapshot(filename,
+                   ((key, entry.value, entry.ttl, entry.expiration_time)
+                    for key, entry in entries.items()),
+                   maxsize)
+
+
+def load_entries(filename):
+    maxsize, entries = read_snapshot(filename)
+    return maxsize, {key: TimedLruCacheEntry.restore(value, ttl,
+                                                     expiration_time)
+                     for key, value, ttl, expiration_time in entries}
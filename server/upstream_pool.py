@@ -0,0 +1,259 @@
+# server/upstream_pool.py
+import concurrent.futures
+import random
+import secrets
+import socket
+import struct
+import threading
+from concurrent.futures import Future
+
+from entities.dns_message import HEADER
+from entities.question import QUESTION_TAIL, Question
+from server.tcp_framing import receive_message
+
+TRANSACTION_ID = struct.Struct('!H')
+
+
+class UpstreamPool:
+    """Long-lived upstream sockets shared by all resolver threads.
+
+    UDP queries go through a fixed set of sockets and are matched to
+    replies by transaction ID and source address. TCP queries are
+    pipelined over one persistent connection per upstream (RFC 7766),
+    which is closed after idle_timeout seconds without traffic.
+    """
+
+    def __init__(self, size: int, idle_timeout: float, timeout: float = 1):
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.channels = [UdpChannel() for _ in range(size)]
+        self.connections: dict[tuple, TcpConnection] = {}
+        self.connect_locks: dict[tuple, threading.Lock] = {}
+        self.hosts: dict[str, str] = {}
+        self.udp_queries = 0
+        self.tcp_queries = 0
+        self.tcp_connections = 0
+
+    def exchange(self, message: bytes, address: str, port: int,
+                 tcp: bool) -> bytes:
+        server_address = (self.get_host(address), port)
+        if not tcp:
+            with self.lock:
+                self.udp_queries += 1
+            channel = random.choice(self.channels)
+            return channel.exchange(message, server_address, self.timeout)
+        with self.lock:
+            self.tcp_queries += 1
+        return self.get_connection(server_address).exchange(message,
+                                                            self.timeout)
+
+    def get_host(self, address: str) -> str:
+        """The IP address of address, looked up once."""
+        host = self.hosts.get(address)
+        if host is None:
+            host = self.hosts[address] = socket.gethostbyname(address)
+        return host
+
+    def get_connection(self, address: tuple) -> 'TcpConnection':
+        """The open connection to address, connecting if there is none.
+
+        Connecting may take up to timeout, so it is done under a lock of
+        that upstream only and does not hold up queries to the others.
+        """
+        with self.lock:
+            connection = self.connections.get(address)
+            if connection is not None and not connection.closed:
+                return connection
+            connect_lock = self.connect_locks.setdefault(address,
+                                                         threading.Lock())
+        with connect_lock:
+            with self.lock:
+                connection = self.connections.get(address)
+            if connection is None or connection.closed:
+                connection = TcpConnection(address, self.timeout,
+                                           self.idle_timeout)
+                with self.lock:
+                    self.connections[address] = connection
+                    self.tcp_connections += 1
+            return connection
+
+    def stats(self) -> dict:
+        with self.lock:
+            queries = self.udp_queries + self.tcp_queries
+            created = len(self.channels) + self.tcp_connections
+            return {
+                'udp_queries': self.udp_queries,
+                'udp_sockets': len(self.channels),
+                'tcp_queries': self.tcp_queries,
+                'tcp_connections': self.tcp_connections,
+                'reuse_rate': (1 - created / queries) if queries > created
+                else 0.0,
+            }
+
+    def close(self) -> None:
+        with self.lock:
+            for channel in self.channels:
+                channel.close()
+            for connection in self.connections.values():
+                connection.close()
+            self.connections.clear()
+
+
+class PendingQueries:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures: dict[tuple, tuple[Future, bytes]] = {}
+
+    def register(self, address, question: bytes) -> tuple[int, Future]:
+        """A fresh unpredictable transaction ID for a query with the given
+        question section to address and the future of its reply."""
+        future = Future()
+        with self.lock:
+            while True:
+                transaction_id = secrets.randbits(16)
+                if (transaction_id, address) not in self.futures:
+                    break
+            self.futures[(transaction_id, address)] = (future, question)
+        return transaction_id, future
+
+    def resolve(self, transaction_id: int, address, data: bytes,
+                offset: int = 0) -> None:
+        """Completes the query that data, a message starting at offset,
+        answers. Replies with another question are dropped, so a spoofer
+        must guess the question as well as the transaction ID."""
+        with self.lock:
+            pending = self.futures.get((transaction_id, address))
+            if pending is None:
+                return
+            future, question = pending
+            start = offset + HEADER.size
+            if lower_name(data[start:start + len(question)]) != question:
+                return
+            del self.futures[(transaction_id, address)]
+        future.set_result(data)
+
+    def discard(self, transaction_id: int, address) -> None:
+        with self.lock:
+            self.futures.pop((transaction_id, address), None)
+
+    def fail_all(self, error: Exception) -> None:
+        with self.lock:
+            futures = [future for future, _ in self.futures.values()]
+            self.futures.clear()
+        for future in futures:
+            future.set_exception(error)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.futures)
+
+
+class UdpChannel:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('0.0.0.0', 0))
+        self.pending = PendingQueries()
+        thread = threading.Thread(target=self.receive_loop, daemon=True)
+        thread.start()
+
+    def exchange(self, message: bytes, address: tuple,
+                 timeout: float) -> bytes:
+        transaction_id, future = self.pending.register(
+            address, get_question(message))
+        original_id = message[:TRANSACTION_ID.size]
+        self.sock.sendto(TRANSACTION_ID.pack(transaction_id) +
+                         message[TRANSACTION_ID.size:], address)
+        try:
+            data = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self.pending.discard(transaction_id, address)
+            raise socket.timeout('timed out')
+        return original_id + data[TRANSACTION_ID.size:]
+
+    def receive_loop(self) -> None:
+        while True:
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except OSError:
+                return
+            if len(data) < TRANSACTION_ID.size:
+                continue
+            transaction_id, = TRANSACTION_ID.unpack_from(data)
+            self.pending.resolve(transaction_id, address, data)
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class TcpConnection:
+    def __init__(self, address: tuple, timeout: float, idle_timeout: float):
+        self.address = address
+        self.closed = False
+        self.pending = PendingQueries()
+        self.send_lock = threading.Lock()
+        self.sock = socket.create_connection(address, timeout)
+        self.sock.settimeout(idle_timeout)
+        thread = threading.Thread(target=self.receive_loop, daemon=True)
+        thread.start()
+
+    def exchange(self, message: bytes, timeout: float) -> bytes:
+        # Messages are length-prefixed: the transaction ID follows the
+        # two-byte length.
+        transaction_id, future = self.pending.register(
+            self.address, get_question(message, 2))
+        original_id = message[2:4]
+        try:
+            with self.send_lock:
+                self.sock.sendall(message[:2] +
+                                  TRANSACTION_ID.pack(transaction_id) +
+                                  message[4:])
+            data = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self.pending.discard(transaction_id, self.address)
+            raise socket.timeout('timed out')
+        except OSError:
+            self.close()
+            raise
+        return data[:2] + original_id + data[4:]
+
+    def receive_loop(self) -> None:
+        error: Exception = ConnectionError('connection closed')
+        try:
+            while True:
+                try:
+                    data = receive_message(self.sock)
+                except socket.timeout:
+                    if len(self.pending) == 0:
+                        break
+                    continue
+                if data is None or len(data) < 2 + TRANSACTION_ID.size:
+                    break
+                transaction_id, = TRANSACTION_ID.unpack_from(data, 2)
+                self.pending.resolve(transaction_id, self.address, data, 2)
+        except OSError as e:
+            error = e
+        finally:
+            self.close()
+            self.pending.fail_all(error)
+
+    def close(self) -> None:
+        self.closed = True
+        self.sock.close()
+
+
+def get_question(message: bytes, offset: int = 0) -> bytes:
+    """The question section of the message starting at offset, as it is
+    on the wire with names lowercased."""
+    start = offset + HEADER.size
+    if HEADER.unpack_from(message, offset)[2] == 0:
+        return b''
+    _, end = Question.unpack_from(message, start)
+    return lower_name(message[start:end])
+
+
+def lower_name(question: bytes) -> bytes:
+    """question with the letters of its name, but not of its type and
+    class, lowercased."""
+    name_end = len(question) - QUESTION_TAIL.size
+    return question[:name_end].lower() + question[name_end:]
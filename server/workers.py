@@ -0,0 +1,143 @@
+# server/workers.py
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+from server.async_server import AsyncServer
+from server.config import Config
+from server.query_log import restart_after_fork, stop_logging
+from server.server import Server, create_cache
+
+SHUTDOWN_TIMEOUT = 10
+
+
+def create_server(config: Config) -> Server:
+    if config.engine == 'asyncio':
+        return AsyncServer(config)
+    return Server(config)
+
+
+def raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_worker(config: Config, index: int, results) -> None:
+    signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+    restart_after_fork()
+    logging.info(f'Worker {index} started with pid {os.getpid()}')
+    if config.metrics_port:
+        # Workers share the DNS port but each serves its own metrics.
+        config.metrics_port += index
+    server = create_server(config)
+    # The parent merges the caches of all workers and saves them.
+    server.persist_cache = False
+    stop = threading.Event()
+    reporter = threading.Thread(target=report_cache,
+                                args=(server, index, results, stop),
+                                daemon=True)
+    reporter.start()
+    try:
+        server.run()
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        stop.set()
+        reporter.join()
+        results.put((index, server.cache.get_entries(), True))
+        logging.info(f'Worker {index} stopped')
+        stop_logging()
+
+
+def report_cache(server: Server, index: int, results,
+                 stop: threading.Event) -> None:
+    """Sends the cache to the parent every snapshot interval."""
+    interval = server.config.cache_snapshot_interval
+    if interval <= 0:
+        return
+    while not stop.wait(interval):
+        results.put((index, server.cache.get_entries(), False))
+
+
+def run_workers(config: Config, workers: int) -> int:
+    config.reuse_port = True
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=run_worker,
+                                 args=(config, index, results))
+                 for index in range(workers)]
+    signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+    logging.info(f'Starting {workers} workers on '
+                 f'{config.hostname}:{config.port}')
+    for process in processes:
+        process.start()
+    # Caches are read before the workers are joined: a worker that has
+    # put a large cache on the queue cannot exit until it is read. The
+    # latest cache of every worker is kept, so a worker that dies still
+    # has its last report saved.
+    caches: dict[int, dict] = {}
+    stopped: set[int] = set()
+    interval = config.cache_snapshot_interval
+    next_snapshot = time.monotonic() + interval
+    try:
+        while len(stopped) < len(processes):
+            if not receive_cache(results, caches, stopped, 1):
+                if not any(process.is_alive() for process in processes):
+                    break
+            # A snapshot waits for every worker so that it does not
+            # replace the saved cache with part of the new one.
+            if (interval > 0 and len(caches) == len(processes) and
+                    time.monotonic() >= next_snapshot):
+                next_snapshot = time.monotonic() + interval
+                save_merged_cache(config, merge_caches(caches))
+    except KeyboardInterrupt:
+        logging.info('Stopping workers')
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    while len(stopped) < len(processes):
+        if not receive_cache(results, caches, stopped, SHUTDOWN_TIMEOUT):
+            logging.error('Worker did not report its cache before timeout')
+            break
+    for process in processes:
+        process.join(SHUTDOWN_TIMEOUT)
+    save_merged_cache(config, merge_caches(caches))
+    return 0
+
+
+def receive_cache(results, caches: dict[int, dict], stopped: set[int],
+                  timeout: float) -> bool:
+    """Takes the next cache a worker reported, or returns False if none
+    came within timeout."""
+    try:
+        index, entries, final = results.get(timeout=timeout)
+    except queue.Empty:
+        return False
+    caches[index] = entries
+    if final:
+        stopped.add(index)
+    return True
+
+
+def merge_caches(caches: dict[int, dict]) -> dict:
+    entries = {}
+    for worker_entries in caches.values():
+        for key, entry in worker_entries.items():
+            if (key not in entries or
+                    entries[key].expiration_time < entry.expiration_time):
+                entries[key] = entry
+    return entries
+
+
+def save_merged_cache(config: Config, entries: dict) -> None:
+    cache = create_cache(config)
+    cache.set_entries(dict(sorted(entries.items(),
+                                  key=lambda item: item[1].expiration_time)))
+    try:
+        logging.info(f'Saving cache to file {config.cache_file}')
+        cache.save_to_file(config.cache_file)
+    except Exception as e:
+        logging.error(f'Failed to save cache to file {config.cache_file}: {e}')
@@ -0,0 +1,69 @@
+"""Memory held by the server caches per cached response.
+
+Run from the repository root:
+
+    python -m tests.benchmark_cache_memory
+
+Responses look like real ones: an address answer, the NS records of
+the zone and their glue, with many hosts sharing a zone. Each one is
+parsed from its own wire, as it would be when it comes from upstream,
+and so is its question, as it comes from the client.
+"""
+import tracemalloc
+
+from entities.dns_message import DnsMessage
+from entities.flags import Flags
+from entities.query import Query
+from entities.question import Question
+from server.config import Config
+from server.server import Server
+
+RESPONSES = 20_000
+ZONES = 200
+
+
+def make_response(i: int) -> tuple[bytes, bytes]:
+    zone = f'zone{i % ZONES}.com'
+    name = f'host{i}.{zone}'
+    question = Question(name, 1, 1)
+    nameservers = [f'ns{n}.{zone}' for n in (1, 2)]
+    message = DnsMessage(False, i & 0xffff, Flags(1, 0, 1, 0, 0, 0, 0, 0),
+                         [question],
+                         [Query(name, 1, 1, 300, f'10.{i >> 16 & 255}.'
+                                                 f'{i >> 8 & 255}.{i & 255}')],
+                         [Query(zone, 2, 1, 172800, nameserver)
+                          for nameserver in nameservers],
+                         [Query(nameserver, 1, 1, 172800, f'192.0.2.{n}')
+                          for n, nameserver in enumerate(nameservers)])
+    return question.to_bytes(), message.to_bytes(compress=True)
+
+
+def measure(store_wire: bool) -> float:
+    config = Config()
+    config.cache_file = ''
+    config.cache_size = RESPONSES
+    config.cache_wire_responses = store_wire
+    config.prefetch_fraction = 0
+    config.upstream_pool_size = 0
+    server = Server(config)
+    responses = [make_response(i) for i in range(RESPONSES)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for question, data in responses:
+        server.cache_dns_response(Question.unpack_from(question, 0)[0],
+                                  DnsMessage.from_bytes(data, False))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / RESPONSES
+
+
+def main():
+    print(f'{RESPONSES:,} responses in {ZONES} zones')
+    print(f'{"stored as":>10} {"bytes per response":>19}')
+    for store_wire in (True, False):
+        print(f'{"wire" if store_wire else "objects":>10} '
+              f'{measure(store_wire):>19,.0f}')
+
+
+if __name__ == '__main__':
+    main()
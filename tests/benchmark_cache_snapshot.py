@@ -0,0 +1,75 @@
+"""Saving and loading a large cache: pickle vs binary snapshots.
+
+Run from the repository root:
+
+    python -m tests.benchmark_cache_snapshot
+"""
+import os
+import pickle
+import tempfile
+import time
+
+from entities.dns_message import DnsMessage
+from entities.flags import Flags
+from entities.query import Query
+from entities.question import Question
+from server.cached_response import CachedResponse
+from server.timed_lru_cache import TimedLruCache
+
+ENTRIES = 100_000
+
+
+def make_cache(expired_share: float) -> TimedLruCache:
+    cache = TimedLruCache(ENTRIES)
+    for i in range(ENTRIES):
+        name = f'host{i}.example.com'
+        message = DnsMessage(False, 0, Flags(1, 0, 0, 0, 0, 0, 0, 0),
+                             [Question(name, 1, 1)],
+                             [Query(name, 1, 1, 300, '192.0.2.1')], [], [])
+        ttl = -1 if i < ENTRIES * expired_share else 300
+        cache.add_item((name, 1, 1), CachedResponse(message, True, True), ttl)
+    return cache
+
+
+def measure(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        pickled = os.path.join(directory, 'cache.pkl')
+        snapshot = os.path.join(directory, 'cache.bin')
+        print(f'{ENTRIES:,} entries')
+        print(f'{"expired":>8} {"format":>9} {"size, MB":>9} '
+              f'{"save, s":>8} {"load, s":>8}')
+        for expired_share in (0.0, 0.5):
+            cache = make_cache(expired_share)
+
+            def save_pickle():
+                with open(pickled, 'wb') as f:
+                    pickle.dump({'entries': cache.get_entries(),
+                                 'maxsize': cache.maxsize}, f)
+
+            def load_pickle():
+                with open(pickled, 'rb') as f:
+                    data = pickle.load(f)
+                loaded = TimedLruCache(data['maxsize'])
+                loaded.set_entries(data['entries'])
+                loaded.update()
+
+            for name, filename, save, load in (
+                    ('pickle', pickled, save_pickle, load_pickle),
+                    ('snapshot', snapshot,
+                     lambda: cache.save_to_file(snapshot),
+                     lambda: TimedLruCache.load_from_file(snapshot))):
+                save_time = measure(save)
+                load_time = measure(load)
+                size = os.path.getsize(filename) / 2 ** 20
+                print(f'{expired_share:>8.0%} {name:>9} {size:>9.1f} '
+                      f'{save_time:>8.2f} {load_time:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Response sizes, encoding and decoding times with and without name
+compression.
+
+Run from the repository root:
+
+    python -m tests.benchmark_name_compression
+"""
+import timeit
+
+from entities.dns_message import DnsMessage
+from entities.flags import Flags
+from entities.query import Query
+from entities.question import Question
+
+GTLD_A = ['192.5.6.30', '192.33.14.30', '192.26.92.30', '192.31.80.30',
+          '192.12.94.30', '192.35.51.30', '192.42.93.30', '192.54.112.30',
+          '192.43.172.30', '192.48.79.30', '192.52.178.30', '192.41.162.30',
+          '192.55.83.30']
+
+
+def com_referral() -> DnsMessage:
+    servers = [f'{chr(ord("a") + i)}.gtld-servers.net'
+               for i in range(len(GTLD_A))]
+    return DnsMessage(False, 1, Flags(1, 0, 0, 0, 0, 0, 0, 0),
+                      [Question('www.example.com', 1, 1)], [],
+                      [Query('com', 2, 1, 172800, server)
+                       for server in servers],
+                      [Query(server, 1, 1, 172800, address)
+                       for server, address in zip(servers, GTLD_A)] +
+                      [Query(server, 28, 1, 172800, f'2001:503:{i:x}::30')
+                       for i, server in enumerate(servers)])
+
+
+def reverse_answer() -> DnsMessage:
+    zone = '52.201.91.in-addr.arpa'
+    return DnsMessage(False, 1, Flags(1, 0, 0, 0, 1, 1, 0, 0),
+                      [Question(f'139.{zone}', 12, 1)],
+                      [Query(f'139.{zone}', 12, 1, 3600, 'be24.netangels.ru')],
+                      [Query(zone, 2, 1, 14400, f'ns{i}.netangels.ru')
+                       for i in (1, 2, 3)],
+                      [Query(f'ns{i}.netangels.ru', 1, 1, 600, f'91.201.52.{i}')
+                       for i in (1, 2, 3)])
+
+
+def multi_address_answer() -> DnsMessage:
+    return DnsMessage(False, 1, Flags(1, 0, 0, 0, 1, 1, 0, 0),
+                      [Question('google.com', 1, 1)],
+                      [Query('google.com', 1, 1, 300, f'64.233.162.{i}')
+                       for i in (100, 101, 102, 113, 138, 139)],
+                      [Query('google.com', 2, 1, 345600, f'ns{i}.google.com')
+                       for i in (1, 2, 3, 4)],
+                      [Query(f'ns{i}.google.com', 1, 1, 345600,
+                             f'216.239.{30 + i * 2}.10') for i in (1, 2, 3, 4)])
+
+
+def time_us(function) -> float:
+    return min(timeit.repeat(function, number=1000, repeat=5)) * 1000
+
+
+def main():
+    print(f'{"response":>22} {"plain, B":>9} {"compressed, B":>14} '
+          f'{"saved":>6} {"plain, us":>10} {"compressed, us":>15} '
+          f'{"decode plain, us":>17} {"decode compressed, us":>22}')
+    for name, message in (('.com referral', com_referral()),
+                          ('reverse answer', reverse_answer()),
+                          ('A answer with NS', multi_address_answer())):
+        plain_data = message.to_bytes()
+        compressed_data = message.to_bytes(compress=True)
+        plain = len(plain_data)
+        compressed = len(compressed_data)
+        plain_time = time_us(message.to_bytes)
+        compressed_time = time_us(lambda: message.to_bytes(compress=True))
+        decode_time = time_us(lambda: DnsMessage.from_bytes(plain_data,
+                                                            False))
+        decode_compressed_time = time_us(
+            lambda: DnsMessage.from_bytes(compressed_data, False))
+        print(f'{name:>22} {plain:>9} {compressed:>14} '
+              f'{1 - compressed / plain:>6.0%} {plain_time:>10.1f} '
+              f'{compressed_time:>15.1f} {decode_time:>17.1f} '
+              f'{decode_compressed_time:>22.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Memory held per cached record by the old and the compact record form.
+
+Run from the repository root:
+
+    python -m tests.benchmark_record_memory
+
+The old form is a record with a __dict__, addresses as text and a name
+string of its own. The compact form is Query as cached: slots, packed
+addresses and names shared within a response and interned across them.
+Records come from responses parsed from their own wires: an A and an
+AAAA answer, the NS records of the zone and their glue.
+"""
+import tracemalloc
+
+from entities.dns_message import DnsMessage
+from entities.flags import Flags
+from entities.query import Query
+from entities.question import Question
+from server.rrset_cache import share_names
+
+RESPONSES = 10_000
+ZONES = 100
+
+
+class DictQuery:
+    def __init__(self, name, tp, cls, ttl, data):
+        self.name = name
+        self.tp = tp
+        self.cls = cls
+        self.ttl = ttl
+        self.data = data
+
+
+def make_response(i: int) -> bytes:
+    zone = f'zone{i % ZONES}.com'
+    name = f'host{i}.{zone}'
+    nameservers = [f'ns{n}.{zone}' for n in (1, 2)]
+    return DnsMessage(False, i & 0xffff, Flags(1, 0, 1, 0, 0, 0, 0, 0),
+                      [Question(name, 1, 1)],
+                      [Query(name, 1, 1, 300,
+                             f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'),
+                       Query(name, 28, 1, 300, f'2001:db8::{i:x}')],
+                      [Query(zone, 2, 1, 172800, nameserver)
+                       for nameserver in nameservers],
+                      [Query(nameserver, 1, 1, 172800, f'192.0.2.{n}')
+                       for n, nameserver in enumerate(nameservers)]
+                      ).to_bytes(compress=True)
+
+
+def old_records(message: DnsMessage) -> list:
+    return [DictQuery(query.name, query.tp, query.cls, query.ttl, query.data)
+            for query in message.get_all_queries()]
+
+
+def compact_records(message: DnsMessage) -> list:
+    share_names(message)
+    return message.get_all_queries()
+
+
+def measure(get_records, wires: list[bytes]) -> tuple[int, float]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = []
+    for data in wires:
+        records += get_records(DnsMessage.from_bytes(data, False))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return len(records), used / len(records)
+
+
+def main():
+    wires = [make_response(i) for i in range(RESPONSES)]
+    print(f'{RESPONSES:,} responses in {ZONES} zones')
+    print(f'{"form":>8} {"records":>8} {"bytes per record":>17}')
+    for form, get_records in (('old', old_records),
+                              ('compact', compact_records)):
+        count, used = measure(get_records, wires)
+        print(f'{form:>8} {count:>8,} {used:>17,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Throughput of TimedLruCache vs ShardedTimedLruCache under contention.
+
+Run from the repository root:
+
+    python -m tests.benchmark_sharded_cache
+"""
+import random
+import threading
+import time
+
+from server.sharded_timed_lru_cache import ShardedTimedLruCache
+from server.timed_lru_cache import TimedLruCache
+
+CACHE_SIZE = 10_000
+KEYS = 20_000
+OPERATIONS_PER_THREAD = 50_000
+THREADS = (1, 4, 16, 64)
+SHARDS = 16
+
+
+def hammer(cache, threads: int) -> float:
+    keys = [('host%d.example.com' % i, 1, 1) for i in range(KEYS)]
+    for key in keys[:CACHE_SIZE]:
+        cache.add_item(key, key, 3600)
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        ops = [(rng.random() < 0.9, rng.choice(keys))
+               for _ in range(OPERATIONS_PER_THREAD)]
+        barrier.wait()
+        for is_read, key in ops:
+            if is_read:
+                cache.get_item(key)
+            else:
+                cache.add_item(key, key, 3600)
+
+    workers = [threading.Thread(target=worker, args=(i,))
+               for i in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    return threads * OPERATIONS_PER_THREAD / (time.perf_counter() - start)
+
+
+def main():
+    print(f'{"threads":>8} {"single lock, ops/s":>20} '
+          f'{f"{SHARDS} shards, ops/s":>20}')
+    for threads in THREADS:
+        single = hammer(TimedLruCache(CACHE_SIZE), threads)
+        sharded = hammer(ShardedTimedLruCache(CACHE_SIZE, SHARDS), threads)
+        print(f'{threads:>8} {single:>20,.0f} {sharded:>20,.0f}')
+
+
+if __name__ == '__main__':
+    main()
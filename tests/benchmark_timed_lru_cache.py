@@ -0,0 +1,35 @@
+"""Hit latency of TimedLruCache for growing cache sizes.
+
+Run from the repository root:
+
+    python -m tests.benchmark_timed_lru_cache
+"""
+import random
+import time
+
+from server.timed_lru_cache import TimedLruCache
+
+SIZES = (100, 1_000, 10_000, 100_000, 1_000_000)
+LOOKUPS = 100_000
+
+
+def measure_hit_latency(size: int) -> float:
+    cache = TimedLruCache(size)
+    for i in range(size):
+        cache.add_item(('example.com', i, 1), i, 3600)
+    keys = [('example.com', random.randrange(size), 1)
+            for _ in range(LOOKUPS)]
+    start = time.perf_counter()
+    for key in keys:
+        cache.get_item(key)
+    return (time.perf_counter() - start) / LOOKUPS
+
+
+def main():
+    print(f'{"cache_size":>12} {"hit latency, us":>16}')
+    for size in SIZES:
+        print(f'{size:>12} {measure_hit_latency(size) * 1e6:>16.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""Helpers shared by the server tests."""
+from entities.dns_message import DnsMessage
+from entities.flags import Flags
+from entities.query import Query
+from entities.question import Question
+from server.cached_response import CachedResponse
+from server.config import Config
+from server.stub_upstream import StubUpstream, make_request
+
+__all__ = ['StubUpstream', 'make_cached_response', 'make_config',
+           'make_request']
+
+
+def make_config(upstream: StubUpstream, **options) -> Config:
+    config = Config()
+    config.cache_file = ''
+    config.proxy_hostname = '127.0.0.1'
+    config.proxy_port = upstream.port
+    config.__dict__.update(options)
+    return config
+
+
+def make_cached_response(name: str, address: str, ttl: int = 300,
+                         store_wire: bool = True) -> CachedResponse:
+    return CachedResponse(
+        DnsMessage(False, 0, Flags(1, 0, 0, 0, 0, 0, 0, 0),
+                   [Question(name, 1, 1)],
+                   [Query(name, 1, 1, ttl, address)], [], []), store_wire)
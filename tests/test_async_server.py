@@ -0,0 +1,51 @@
+import asyncio
+import time
+import unittest
+
+from entities.dns_message import DnsMessage
+from server.async_server import AsyncServer
+from stub_upstream import StubUpstream, make_config, make_request
+
+
+class TestAsyncServer(unittest.TestCase):
+    def test_resolves_over_udp_and_tcp(self):
+        with StubUpstream(address='10.0.0.7') as upstream:
+            server = AsyncServer(make_config(upstream, engine='asyncio'))
+            for is_tcp in (False, True):
+                with self.subTest(is_tcp=is_tcp):
+                    data = asyncio.run(server.get_bytes_dns_response_async(
+                        make_request('example.com', 7, is_tcp), is_tcp))
+                    response = DnsMessage.from_bytes(data, is_tcp)
+                    self.assertEqual(response.transaction_id, 7)
+                    self.assertEqual(response.answers[0].data, '10.0.0.7')
+
+    def test_thread_engine_resources_are_not_created(self):
+        with StubUpstream() as upstream:
+            server = AsyncServer(make_config(upstream, engine='asyncio',
+                                             prefetch_fraction=0.1,
+                                             hedged_queries=True))
+        self.assertIsNone(server.upstream_pool)
+        self.assertIsNone(server.prefetch_executor)
+        self.assertIsNone(server.hedge_executor)
+
+    def test_concurrent_resolutions_do_not_block_each_other(self):
+        with StubUpstream(delay=0.3) as upstream:
+            server = AsyncServer(make_config(upstream, engine='asyncio'))
+
+            async def resolve_all():
+                return await asyncio.gather(*(
+                    server.get_bytes_dns_response_async(
+                        make_request(f'host{i}.example.com', i), False)
+                    for i in range(200)))
+
+            start = time.perf_counter()
+            responses = asyncio.run(resolve_all())
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(len(responses), 200)
+        self.assertEqual(upstream.queries, 200)
+        self.assertLess(elapsed, 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from server.bench import (LoadResult, get_free_port, make_names, run_load,
+                          start_server, warm_up)
+from stub_upstream import StubUpstream, make_config
+
+
+class TestBench(unittest.TestCase):
+    def test_make_names(self):
+        names = make_names(10000, 100, 0.8, 1.1, 0)
+        hits = [name for name in names if name.startswith('host')]
+        self.assertAlmostEqual(len(hits) / len(names), 0.8, delta=0.02)
+        self.assertEqual(len(set(names)) - len(set(hits)),
+                         len(names) - len(hits))
+        # Zipf: the most popular name is asked far more than the median one.
+        self.assertGreater(hits.count('host0.example.com'),
+                           10 * hits.count('host50.example.com'))
+
+    def test_timeouts_do_not_count_as_throughput(self):
+        self.assertEqual(LoadResult(100, 40, 0, 2.0, []).qps, 30)
+
+    def test_run_load(self):
+        for engine in ('threads', 'asyncio'):
+            with self.subTest(engine=engine), StubUpstream() as upstream:
+                config = make_config(upstream, hostname='127.0.0.1',
+                                     port=get_free_port(), engine=engine,
+                                     cache_size=1000)
+                server = start_server(config)
+                warm_up(config, 50)
+                names = make_names(400, 50, 0.75, 1.1, 0)
+                result = run_load(config, upstream, names, 0.5, 4, 0)
+                server.running = False
+                misses = sum(name.startswith('miss') for name in names)
+                self.assertEqual(result.queries, 400)
+                self.assertEqual(result.timeouts, 0)
+                self.assertEqual(len(result.latencies), 400)
+                self.assertEqual(result.upstream_queries, misses)
+                self.assertLessEqual(result.percentile(50),
+                                     result.percentile(99))
+
+
+if __name__ == '__main__':
+    unittest.main()
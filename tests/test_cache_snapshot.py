@@ -0,0 +1,90 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from server.cache_snapshot import read_snapshot, write_snapshot
+from server.cached_response import CachedResponse
+from server.timed_lru_cache import TimedLruCache
+from stub_upstream import make_cached_response
+
+
+class TestCacheSnapshot(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.filename = os.path.join(directory.name, 'cache.bin')
+
+    def test_round_trip(self):
+        now = time.time()
+        compressed = make_cached_response('a.example.com', '192.0.2.1')
+        unstored = make_cached_response('b.example.com', '192.0.2.2',
+                                        store_wire=False)
+        write_snapshot(self.filename, [
+            (('a.example.com', 1, 1), compressed, 300, now + 300),
+            (('b.example.com', 1, 1), unstored, 60, now + 30),
+        ], 1000)
+        maxsize, entries = read_snapshot(self.filename)
+        self.assertEqual(maxsize, 1000)
+        self.assertEqual([entry[0] for entry in entries],
+                         [('a.example.com', 1, 1), ('b.example.com', 1, 1)])
+        key, response, ttl, expiration_time = entries[0]
+        self.assertEqual((ttl, expiration_time), (300, now + 300))
+        self.assertEqual(response.created, compressed.created)
+        self.assertEqual(response.to_bytes(7, False),
+                         compressed.to_bytes(7, False))
+        self.assertEqual(entries[1][1].message.to_bytes(),
+                         unstored.message.to_bytes())
+
+    def test_skips_expired_entries(self):
+        now = time.time()
+        response = make_cached_response('example.com', '192.0.2.1')
+        write_snapshot(self.filename, [
+            ((f'host{i}.example.com', 1, 1), response, 10,
+             now + (10 if i % 2 else -10))
+            for i in range(100)], 100)
+        with mock.patch.object(CachedResponse, 'from_wire',
+                               wraps=CachedResponse.from_wire) as from_wire:
+            _, entries = read_snapshot(self.filename)
+        self.assertEqual(len(entries), 50)
+        self.assertEqual(from_wire.call_count, 50)
+
+    def test_loaded_responses_are_parsed_on_demand(self):
+        cache = TimedLruCache(10)
+        response = make_cached_response('example.com', '192.0.2.1')
+        cache.add_item(('example.com', 1, 1), response, 300)
+        cache.save_to_file(self.filename)
+        loaded = TimedLruCache.load_from_file(self.filename)
+        cached = loaded.get_item(('example.com', 1, 1))
+        self.assertIsNone(cached.parsed_message)
+        self.assertEqual(cached.message.to_bytes(),
+                         response.message.to_bytes())
+        self.assertAlmostEqual(
+            loaded.entries[('example.com', 1, 1)].expiration_time,
+            cache.entries[('example.com', 1, 1)].expiration_time)
+
+    def test_failed_save_keeps_previous_snapshot(self):
+        cache = TimedLruCache(10)
+        cache.add_item(('example.com', 1, 1),
+                       make_cached_response('example.com', '192.0.2.1'), 300)
+        cache.save_to_file(self.filename)
+        cache.add_item(('broken.example.com', 1, 1), 'not a response', 300)
+        with self.assertRaises(AttributeError):
+            cache.save_to_file(self.filename)
+        self.assertEqual(os.listdir(self.directory), ['cache.bin'])
+        loaded = TimedLruCache.load_from_file(self.filename)
+        self.assertEqual(list(loaded.entries), [('example.com', 1, 1)])
+
+    def test_rejects_other_files(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'\x80\x04not a snapshot')
+        with self.assertRaises(ValueError):
+            read_snapshot(self.filename)
+        cache = TimedLruCache.try_load_from_file(self.filename, 5)
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
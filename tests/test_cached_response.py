@@ -0,0 +1,98 @@
+import unittest
+
+from entities.dns_message import DnsMessage
+from entities.flags import Flags
+from entities.query import Query
+from entities.question import Question
+from server.cached_response import CachedResponse
+from server.server import Server
+from stub_upstream import StubUpstream, make_config, make_request
+
+
+def make_response(transaction_id=0, ttl=300):
+    return DnsMessage(False, transaction_id, Flags(1, 0, 0, 0, 0, 0, 0, 0),
+                      [Question('example.com', 1, 1)],
+                      [Query('example.com', 1, 1, ttl, '192.0.2.1')],
+                      [Query('example.com', 2, 1, 2 * ttl, 'ns.example.com')],
+                      [Query('ns.example.com', 1, 1, 3 * ttl, '192.0.2.53')])
+
+
+class TestCachedResponse(unittest.TestCase):
+    def test_ttl_offsets(self):
+        offsets = []
+        data = make_response().to_bytes(offsets)
+        self.assertEqual(len(offsets), 3)
+        self.assertEqual([int.from_bytes(data[o:o + 4], 'big')
+                          for o in offsets], [300, 600, 900])
+
+    def test_patches_transaction_id(self):
+        cached = CachedResponse(make_response(), True)
+        for is_tcp in (False, True):
+            with self.subTest(is_tcp=is_tcp):
+                expected = make_response(0xabcd)
+                expected.is_tcp = is_tcp
+                self.assertEqual(cached.to_bytes(0xabcd, is_tcp),
+                                 expected.to_bytes())
+
+    def test_decrements_ttls(self):
+        cached = CachedResponse(make_response(), True)
+        cached.created -= 100
+        message = DnsMessage.from_bytes(cached.to_bytes(1, False), False)
+        self.assertEqual([q.ttl for q in message.get_all_queries()],
+                         [200, 500, 800])
+        cached.created -= 1000
+        message = DnsMessage.from_bytes(cached.to_bytes(1, False), False)
+        self.assertEqual([q.ttl for q in message.get_all_queries()],
+                         [0, 0, 0])
+
+    def test_current_message_drops_expired_records(self):
+        cached = CachedResponse(make_response(ttl=100), True)
+        self.assertFalse(cached.is_stale())
+        cached.created -= 150
+        self.assertTrue(cached.is_stale())
+        message = cached.get_current_message()
+        self.assertEqual([(q.tp, q.ttl) for q in message.get_all_queries()],
+                         [(2, 50), (1, 150)])
+        self.assertEqual(cached.reply_code, 0)
+
+    def test_min_ttl_of_restored_response(self):
+        cached = CachedResponse(make_response(), True)
+        restored = CachedResponse.from_wire(cached.wire, cached.ttl_offsets,
+                                            cached.created)
+        self.assertEqual(restored.get_min_ttl(), 300)
+
+    def test_server_outlives_short_glue(self):
+        with StubUpstream(address='10.0.0.5', ttl=300, glue_ttl=1) as upstream:
+            for store_wire in (False, True):
+                server = Server(make_config(
+                    upstream, cache_wire_responses=store_wire))
+                first = DnsMessage.from_bytes(server.get_bytes_dns_response(
+                    make_request('www.example.com', 1), False), False)
+                self.assertEqual(len(first.add_records), 1)
+                for entry in server.cache.entries.values():
+                    entry.value.created -= 2
+                response = DnsMessage.from_bytes(
+                    server.get_bytes_dns_response(
+                        make_request('www.example.com', 2), False), False)
+                self.assertEqual(response.answers[0].ttl, 298)
+                self.assertEqual((response.authorities, response.add_records),
+                                 ([], []))
+        self.assertEqual(upstream.queries, 2)
+
+    def test_server_serves_hits_from_wire(self):
+        with StubUpstream(address='10.0.0.5') as upstream:
+            responses = {}
+            for store_wire in (False, True):
+                server = Server(make_config(
+                    upstream, cache_wire_responses=store_wire))
+                server.get_bytes_dns_response(make_request('example.com', 1),
+                                              False)
+                responses[store_wire] = server.get_bytes_dns_response(
+                    make_request('example.com', 2), False)
+        self.assertEqual(responses[True], responses[False])
+        self.assertEqual(DnsMessage.from_bytes(responses[True], False)
+                         .transaction_id, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
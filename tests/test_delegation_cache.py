@@ -0,0 +1,215 @@
+import unittest
+
+from entities.dns_message import DnsMessage
+from entities.flags import Flags
+from entities.query import Query
+from entities.question import Question
+from server.config import Config
+from server.delegation_cache import DelegationCache
+from server.server import Server, resolve
+
+ROOT = 'a.root-servers.net'
+
+
+def make_message(name, answers=(), authorities=(), add_records=()):
+    return DnsMessage(False, 1, Flags(1, 0, 0, 0, 0, 0, 0, 0),
+                      [Question(name, 1, 1)], list(answers),
+                      list(authorities), list(add_records))
+
+
+def referral(name, zone, nameserver, address, ttl=3600):
+    return make_message(name,
+                        authorities=[Query(zone, 2, 1, ttl, nameserver)],
+                        add_records=[Query(nameserver, 1, 1, ttl, address)])
+
+
+def zone_of(name):
+    return '.'.join(name.split('.')[-2:])
+
+
+def answer(name, address):
+    return make_message(name, answers=[Query(name, 1, 1, 300, address)])
+
+
+def drive(steps, name, replies):
+    """Runs steps against replies, a function of the question name for
+    each address, and returns the addresses queried and the result.
+    Addresses without a reply time out."""
+    queried = []
+    try:
+        query = next(steps)
+        while True:
+            address = query[0].address
+            queried.append(address)
+            reply = replies.get(address)
+            query = steps.send(reply(name).to_bytes() if reply else b'')
+    except StopIteration as stop:
+        return queried, stop.value
+
+
+def make_server(**options) -> Server:
+    config = Config()
+    config.cache_file = ''
+    config.proxy_hostname = ROOT
+    config.__dict__.update(options)
+    return Server(config)
+
+
+class TestDelegationCache(unittest.TestCase):
+    def setUp(self):
+        self.delegations = DelegationCache(maxsize=10)
+
+    def walk(self, name, replies):
+        """Drives resolve() and returns the addresses it queried and the
+        name of the first answer, or None if there is none."""
+        queried, response = drive(resolve(make_message(name), ROOT, 53, False,
+                                          self.delegations), name, replies)
+        return queried, response and response.answers[0].name
+
+    def test_second_resolution_starts_at_closest_zone(self):
+        replies = {
+            ROOT: lambda name: referral(name, 'com', 'a.nic.com',
+                                        '192.5.6.30'),
+            '192.5.6.30': lambda name: referral(
+                name, zone_of(name), 'ns.' + zone_of(name), '192.0.2.53'),
+            '192.0.2.53': lambda name: answer(name, '192.0.2.1'),
+        }
+        self.assertEqual(self.walk('a.example.com', replies),
+                         ([ROOT, '192.5.6.30', '192.0.2.53'],
+                          'a.example.com'))
+        self.assertEqual(self.walk('b.example.com', replies),
+                         (['192.0.2.53'], 'b.example.com'))
+        self.assertEqual(self.walk('example.org.com', replies),
+                         (['192.5.6.30', '192.0.2.53'], 'example.org.com'))
+
+    def test_find_prefers_longest_zone(self):
+        replies = {
+            ROOT: lambda name: referral(name, 'com', 'a.nic.com',
+                                        '192.5.6.30'),
+            '192.5.6.30': lambda name: referral(
+                name, 'example.com', 'ns.example.com', '192.0.2.53'),
+            '192.0.2.53': lambda name: answer(name, '192.0.2.1'),
+        }
+        self.walk('www.example.com', replies)
+        self.assertEqual(self.delegations.find('WWW.Example.com'),
+                         ('example.com', ['192.0.2.53']))
+        self.assertEqual(self.delegations.find('www.google.com'),
+                         ('com', ['192.5.6.30']))
+        self.assertEqual(self.delegations.find('example.net'), None)
+
+    def test_out_of_bailiwick_referral_is_ignored(self):
+        replies = {
+            ROOT: lambda name: referral(name, 'evil.net', 'ns.evil.net',
+                                        '203.0.113.1'),
+        }
+        self.assertEqual(self.walk('www.example.com', replies),
+                         ([ROOT], None))
+        self.assertEqual(len(self.delegations), 0)
+
+    def test_referral_must_be_below_the_zone_asked(self):
+        # A server of example.com cannot hand out a delegation for com or
+        # for example.com itself.
+        for cut in ('com', 'example.com'):
+            with self.subTest(cut=cut):
+                self.delegations = DelegationCache(maxsize=10)
+                replies = {
+                    ROOT: lambda name: referral(
+                        name, 'example.com', 'ns.example.com', '192.0.2.53'),
+                    '192.0.2.53': lambda name: referral(
+                        name, cut, 'ns.evil.net', '6.6.6.6'),
+                }
+                self.assertEqual(self.walk('a.example.com', replies),
+                                 ([ROOT, '192.0.2.53'], None))
+                self.assertEqual(self.delegations.find('a.example.com'),
+                                 ('example.com', ['192.0.2.53']))
+                self.assertIsNone(self.delegations.find('www.google.com'))
+
+    def test_out_of_zone_glue_is_ignored(self):
+        replies = {
+            ROOT: lambda name: referral(name, 'com', 'ns.evil.net',
+                                        '6.6.6.6'),
+            'ns.evil.net': lambda name: answer(name, '192.0.2.1'),
+        }
+        self.assertEqual(self.walk('a.example.com', replies),
+                         ([ROOT, 'ns.evil.net'], 'a.example.com'))
+        self.assertEqual(self.delegations.find('www.google.com'),
+                         ('com', ['ns.evil.net']))
+
+    def test_resolve_ignores_referrals_to_parent_zones(self):
+        replies = {
+            ROOT: lambda name: referral(name, 'example.com', 'ns.example.com',
+                                        '192.0.2.53'),
+            '192.0.2.53': lambda name: referral(name, 'com', 'ns.com',
+                                                '6.6.6.6'),
+        }
+        queried, response = drive(
+            resolve(make_message('a.example.com'), ROOT, 53, False,
+                    self.delegations), 'a.example.com', replies)
+        self.assertEqual(queried, [ROOT, '192.0.2.53'])
+        self.assertIsNone(response)
+        self.assertEqual(self.delegations.find('www.google.com'), None)
+
+    def test_answers_outside_the_zone_are_dropped(self):
+        replies = {
+            ROOT: lambda name: referral(name, 'example.com', 'ns.example.com',
+                                        '192.0.2.53'),
+            '192.0.2.53': lambda name: make_message(name, answers=[
+                Query(name, 1, 1, 300, '192.0.2.1'),
+                Query('www.bank.com', 1, 1, 300, '6.6.6.6')]),
+        }
+        steps = resolve(make_message('a.example.com'), ROOT, 53, False,
+                        self.delegations)
+        query = next(steps)
+        with self.assertRaises(StopIteration) as stop:
+            while True:
+                query = steps.send(
+                    replies[query[0].address]('a.example.com').to_bytes())
+        self.assertEqual(stop.exception.value.answers,
+                         [Query('a.example.com', 1, 1, 300, '192.0.2.1')])
+
+    def test_server_without_delegation_cache_follows_referrals(self):
+        server = make_server(delegation_cache_size=0)
+        self.assertIsNone(server.delegations)
+        replies = {
+            ROOT: lambda name: referral(name, 'example.com', 'ns.example.com',
+                                        '192.0.2.53'),
+            '192.0.2.53': lambda name: answer(name, '192.0.2.1'),
+        }
+        _, data = drive(server.process_message(
+            make_message('a.example.com').to_bytes(), False),
+            'a.example.com', replies)
+        self.assertEqual(DnsMessage.from_bytes(data, False).answers,
+                         [Query('a.example.com', 1, 1, 300, '192.0.2.1')])
+
+    def test_unanswered_referral_is_a_server_failure(self):
+        server = make_server()
+        replies = {
+            ROOT: lambda name: referral(name, 'example.com', 'ns.example.com',
+                                        '192.0.2.53', ttl=172800),
+        }
+        for _ in range(2):
+            queried, data = drive(server.process_message(
+                make_message('a.example.com').to_bytes(), False),
+                'a.example.com', replies)
+            response = DnsMessage.from_bytes(data, False)
+            self.assertEqual(response.flags.reply_code, 2)
+            self.assertEqual(response.answers, [])
+        # Only the delegation was cached: the second query is resolved
+        # again, from the nameserver and then from the root.
+        self.assertEqual(queried, ['192.0.2.53', ROOT, '192.0.2.53'])
+        self.assertIsNone(server.get_cached_dns_response(
+            Question('a.example.com', 1, 1)))
+
+    def test_nameserver_without_glue_is_stored_by_name(self):
+        replies = {
+            ROOT: lambda name: make_message(
+                name, authorities=[Query('example.com', 2, 1, 60,
+                                         'ns.example.net')]),
+            'ns.example.net': lambda name: answer(name, '192.0.2.1'),
+        }
+        self.walk('www.example.com', replies)
+        self.assertEqual(self.delegations.find('www.example.com'),
+                         ('example.com', ['ns.example.net']))
+
+if __name__ == '__main__':
+    unittest.main()
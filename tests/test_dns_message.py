@@ -0,0 +1,211 @@
+import unittest
+
+from entities.dns_message import DnsMessage
+from entities.flags import Flags
+from entities.query import Mx, Query, Soa, Srv
+from entities.question import Question
+
+CORPUS = {
+    'query_a':
+        '1a2b0100000100000000000006676f6f676c6503636f6d0000010001',
+    'answer_a':
+        'd4d88180000100020000000006676f6f676c6503636f6d000001000106676f6f67'
+        '6c6503636f6d00000100010000012c000440e9a28b06676f6f676c6503636f6d00'
+        '000100010000012c000440e9a264',
+    'answer_aaaa':
+        '000185800001000100000000076578616d706c65036f726700001c000107657861'
+        '6d706c65036f726700001c000100000e10001026062800022000010248189325c8'
+        '1946',
+    'answer_ptr':
+        '130881800001000100020001033133390235320332303102393107696e2d616464'
+        '72046172706100000c0001033133390235320332303102393107696e2d61646472'
+        '046172706100000c000100000e1000130462653234096e6574616e67656c730272'
+        '75000235320332303102393107696e2d6164647204617270610000020001000038'
+        '400012036e7331096e6574616e67656c73027275000235320332303102393107696e'
+        '2d6164647204617270610000020001000038400012036e7332096e6574616e67656c'
+        '7302727500036e7331096e6574616e67656c7302727500000100010000025800045b'
+        'c93401',
+    'referral':
+        'beef8000000100000002000203777777076578616d706c6503636f6d0000010001'
+        '03636f6d00000200010002a300001401610c67746c642d73657276657273036e65'
+        '740003636f6d00000200010002a300001401620c67746c642d7365727665727303'
+        '6e65740001610c67746c642d73657276657273036e657400000100010002a30000'
+        '04c005061e01620c67746c642d73657276657273036e657400001c00010002a300'
+        '001020010503231d00000000000000020030',
+    'answer_any':
+        '070781800001000500000000076578616d706c6503636f6d0000ff000103777777'
+        '076578616d706c6503636f6d00000500010000012c000d076578616d706c650363'
+        '6f6d00076578616d706c6503636f6d00000f00010000012c0014000a046d61696c'
+        '076578616d706c6503636f6d00076578616d706c6503636f6d0000100001000001'
+        '2c00120b763d73706631202d616c6c0568656c6c6f045f736970045f7463700765'
+        '78616d706c6503636f6d00002100010000012c0017000a003c13c4037369700765'
+        '78616d706c6503636f6d00076578616d706c6503636f6d00004100010000012c00'
+        '0b0001000001000302683200',
+    'nxdomain':
+        '5a5a81830001000000010000046e6f7065076578616d706c6503636f6d00000100'
+        '01076578616d706c6503636f6d000006000100000e100035026e73056963616e6e'
+        '036f726700036e6f6303646e73056963616e6e036f72670078a5080700001c2000'
+        '000e100012750000000e10',
+    'server_failure':
+        '4242810200010000000000000662726f6b656e04746573740000010001',
+}
+
+COMPRESSED_ANSWER = bytes.fromhex(
+    'd4d881800001000100000000'
+    '06676f6f676c6503636f6d0000010001'
+    'c00c00010001'
+    '0000012c000440e9a28b')
+
+
+class TestDnsMessageCodec(unittest.TestCase):
+    def test_round_trip_is_byte_identical(self):
+        for name, hexed in CORPUS.items():
+            with self.subTest(name=name):
+                data = bytes.fromhex(hexed)
+                message = DnsMessage.from_bytes(data, False)
+                self.assertEqual(message.to_bytes(), data)
+
+    def test_tcp_round_trip_is_byte_identical(self):
+        for name, hexed in CORPUS.items():
+            with self.subTest(name=name):
+                data = bytes.fromhex(hexed)
+                framed = len(data).to_bytes(2, 'big') + data
+                message = DnsMessage.from_bytes(framed, True)
+                self.assertEqual(message.to_bytes(), framed)
+
+    def test_hex_debug_representation(self):
+        for name, hexed in CORPUS.items():
+            with self.subTest(name=name):
+                message = DnsMessage.parse(hexed, False)
+                self.assertEqual(str(message), hexed)
+
+    def test_sections(self):
+        message = DnsMessage.from_bytes(
+            bytes.fromhex(CORPUS['answer_ptr']), False)
+        self.assertEqual(message.transaction_id, 0x1308)
+        self.assertEqual(message.questions,
+                         [Question('139.52.201.91.in-addr.arpa', 12, 1)])
+        self.assertEqual(message.answers,
+                         [Query('139.52.201.91.in-addr.arpa', 12, 1, 3600,
+                                'be24.netangels.ru')])
+        self.assertEqual(len(message.authorities), 2)
+        self.assertEqual(message.add_records,
+                         [Query('ns1.netangels.ru', 1, 1, 600,
+                                '91.201.52.1')])
+
+    def test_compressed_names(self):
+        message = DnsMessage.from_bytes(COMPRESSED_ANSWER, False)
+        self.assertEqual(message.answers,
+                         [Query('google.com', 1, 1, 300, '64.233.162.139')])
+        self.assertEqual(message.answers[0].ttl, 300)
+
+    def test_compressed_round_trip(self):
+        for name, hexed in CORPUS.items():
+            with self.subTest(name=name):
+                data = bytes.fromhex(hexed)
+                message = DnsMessage.from_bytes(data, False)
+                compressed = message.to_bytes(compress=True)
+                decoded = DnsMessage.from_bytes(compressed, False)
+                self.assertLessEqual(len(compressed), len(data))
+                self.assertEqual(decoded.questions, message.questions)
+                self.assertEqual(decoded.get_all_queries(),
+                                 message.get_all_queries())
+                self.assertEqual(decoded.to_bytes(), data)
+
+    def test_compression_pointers(self):
+        message = DnsMessage.from_bytes(COMPRESSED_ANSWER, False)
+        self.assertEqual(message.to_bytes(compress=True), COMPRESSED_ANSWER)
+        message.is_tcp = True
+        framed = message.to_bytes(compress=True)
+        self.assertEqual(framed, len(COMPRESSED_ANSWER).to_bytes(2, 'big') +
+                         COMPRESSED_ANSWER)
+
+    def test_compressed_ttl_offsets(self):
+        message = DnsMessage.from_bytes(
+            bytes.fromhex(CORPUS['referral']), False)
+        offsets = []
+        data = message.to_bytes(offsets, compress=True)
+        self.assertEqual([int.from_bytes(data[o:o + 4], 'big')
+                          for o in offsets],
+                         [query.ttl for query in message.get_all_queries()])
+
+    def test_soa(self):
+        message = DnsMessage.from_bytes(bytes.fromhex(CORPUS['nxdomain']),
+                                        False)
+        self.assertEqual(message.flags.reply_code, 3)
+        soa = Soa('ns.icann.org', 'noc.dns.icann.org', 2024081415, 7200,
+                  3600, 1209600, 3600)
+        self.assertEqual(message.authorities,
+                         [Query('example.com', 6, 1, 3600, soa)])
+        compressed = message.to_bytes(compress=True)
+        # The zone and the icann.org suffix are written once.
+        self.assertEqual(len(compressed), 90)
+        self.assertEqual(DnsMessage.from_bytes(compressed, False).authorities,
+                         message.authorities)
+
+    def test_soa_must_fill_its_rdata(self):
+        data = CORPUS['nxdomain']
+        self.assertIn('00350', data)
+        for length, tail in (('0034', ''), ('0036', '00')):
+            with self.subTest(length=length):
+                broken = bytes.fromhex(data.replace('0035', length, 1) + tail)
+                with self.assertRaises(ValueError):
+                    DnsMessage.from_bytes(broken, False)
+
+    def test_record_types(self):
+        message = DnsMessage.from_bytes(bytes.fromhex(CORPUS['answer_any']),
+                                        False)
+        self.assertEqual([(answer.tp, answer.data)
+                          for answer in message.answers], [
+            (5, 'example.com'),
+            (15, Mx(10, 'mail.example.com')),
+            (16, (b'v=spf1 -all', b'hello')),
+            (33, Srv(10, 60, 5060, 'sip.example.com')),
+            # Types without a codec are kept as opaque RDATA.
+            (65, bytes.fromhex('0001000001000302683200')),
+        ])
+
+    def test_srv_target_is_not_compressed(self):
+        message = DnsMessage.from_bytes(bytes.fromhex(CORPUS['answer_any']),
+                                        False)
+        compressed = message.to_bytes(compress=True)
+        self.assertIn(bytes.fromhex('0017000a003c13c4'
+                                    '03736970076578616d706c6503636f6d00'),
+                      compressed)
+
+    def test_addresses_are_stored_packed(self):
+        message = DnsMessage.from_bytes(bytes.fromhex(CORPUS['answer_aaaa']),
+                                        False)
+        answer = message.answers[0]
+        self.assertEqual(answer.value,
+                         bytes.fromhex('26062800022000010248189325c81946'))
+        self.assertEqual(answer.data, '2606:2800:220:1:248:1893:25c8:1946')
+        self.assertEqual(answer, Query(answer.name, 28, 1, 0, answer.data))
+        copy = answer.with_ttl(60)
+        self.assertEqual((copy.ttl, copy.value), (60, answer.value))
+        self.assertFalse(hasattr(answer, '__dict__'))
+
+    def test_invalid_address_length(self):
+        data = bytearray.fromhex(CORPUS['answer_a'])
+        # The RDATA length of the last answer, one byte short.
+        data[-5] = 3
+        with self.assertRaises(ValueError):
+            DnsMessage.from_bytes(bytes(data[:-1]), False)
+
+    def test_flags(self):
+        for value in (0x0100, 0x8180, 0x8583, 0x8202, 0x7800):
+            with self.subTest(value=value):
+                self.assertEqual(Flags.from_int(value).to_int(), value)
+        flags = Flags.parse('8180')
+        self.assertEqual((flags.qr, flags.rd, flags.ra, flags.reply_code),
+                         (1, 1, 1, 0))
+
+    def test_root_name(self):
+        question = Question('', 2, 1)
+        self.assertEqual(question.to_bytes(), bytes.fromhex('0000020001'))
+        self.assertEqual(Question.unpack_from(question.to_bytes(), 0),
+                         (question, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
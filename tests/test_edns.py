@@ -0,0 +1,100 @@
+import asyncio
+import unittest
+
+from entities.dns_message import DnsMessage
+from entities.edns import Edns
+from entities.flags import Flags
+from entities.query import Query
+from entities.question import Question
+from server.async_server import AsyncServer
+from server.server import Server
+from stub_upstream import StubUpstream, make_config, make_request
+
+# 40 A records do not fit in 512 bytes but fit in 1232.
+RECORDS = 40
+
+
+class TestEdns(unittest.TestCase):
+    def test_opt_round_trip(self):
+        edns = Edns(4096, 0, 0, 1, b'\x00\x0a\x00\x02ab')
+        message = DnsMessage(False, 1, Flags(0, 0, 0, 0, 1, 0, 0, 0),
+                             [Question('example.com', 1, 1)], [], [],
+                             [Query('ns.example.com', 1, 1, 60, '192.0.2.1')],
+                             edns)
+        data = message.to_bytes()
+        self.assertEqual(int.from_bytes(data[10:12], 'big'), 2)
+        # Root owner, type 41, payload size 4096, DO bit, 6 bytes of options.
+        self.assertEqual(data[-17:-6],
+                         bytes.fromhex('00 0029 1000 00008000 0006'))
+        parsed = DnsMessage.from_bytes(data, False)
+        self.assertEqual((parsed.edns.payload_size, parsed.edns.extended_rcode,
+                          parsed.edns.version, parsed.edns.dnssec_ok,
+                          parsed.edns.options),
+                         (4096, 0, 0, 1, b'\x00\x0a\x00\x02ab'))
+        self.assertEqual(parsed.edns, edns)
+        self.assertNotEqual(parsed.edns, Edns(512, 1, 2, 1, b'x'))
+        self.assertNotEqual(parsed.edns, Edns(4096))
+        self.assertEqual(len(parsed.add_records), 1)
+        self.assertEqual(parsed.to_bytes(), data)
+
+    def test_message_without_opt(self):
+        data = make_request('example.com')
+        self.assertIsNone(DnsMessage.from_bytes(data, False).edns)
+
+    def test_truncates_for_clients_without_edns(self):
+        with StubUpstream(records=RECORDS) as upstream:
+            server = Server(make_config(upstream))
+            for _ in range(2):
+                data = server.get_bytes_dns_response(
+                    make_request('example.com'), False)
+                response = DnsMessage.from_bytes(data, False)
+                self.assertLessEqual(len(data), 512)
+                self.assertEqual(response.flags.tc, 1)
+                self.assertEqual(response.answers, [])
+                self.assertEqual(response.questions[0].name, 'example.com')
+
+    def test_uses_advertised_payload_size(self):
+        with StubUpstream(records=RECORDS) as upstream:
+            server = Server(make_config(upstream))
+            responses = [server.get_bytes_dns_response(
+                make_request('example.com', payload_size=4096), False)
+                for _ in range(2)]
+        self.assertEqual(responses[0], responses[1])
+        response = DnsMessage.from_bytes(responses[0], False)
+        self.assertEqual(response.flags.tc, 0)
+        self.assertEqual(len(response.answers), RECORDS)
+        self.assertEqual(response.edns.payload_size, 1232)
+        self.assertEqual(upstream.truncated, 0)
+
+    def test_tcp_is_not_truncated(self):
+        with StubUpstream(records=RECORDS) as upstream:
+            server = Server(make_config(upstream))
+            data = server.get_bytes_dns_response(
+                make_request('example.com', is_tcp=True), True)
+        response = DnsMessage.from_bytes(data, True)
+        self.assertEqual(response.flags.tc, 0)
+        self.assertEqual(len(response.answers), RECORDS)
+
+    def test_retries_truncated_upstream_response_over_tcp(self):
+        for engine in ('threads', 'asyncio'):
+            with self.subTest(engine=engine), \
+                    StubUpstream(records=RECORDS) as upstream:
+                config = make_config(upstream, edns_buffer_size=0)
+                request = make_request('example.com')
+                if engine == 'asyncio':
+                    server = AsyncServer(config)
+                    data = asyncio.run(
+                        server.get_bytes_dns_response_async(request, False))
+                else:
+                    server = Server(config)
+                    data = server.get_bytes_dns_response(request, False)
+                self.assertEqual(upstream.truncated, 1)
+                self.assertEqual(upstream.queries, 2)
+                self.assertEqual(DnsMessage.from_bytes(data, False).flags.tc, 1)
+                cached = server.get_cached_dns_response(
+                    Question('example.com', 1, 1))
+                self.assertEqual(len(cached.message.answers), RECORDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from server.metrics import (Counter, Histogram, Registry,
+                            start_metrics_server)
+from server.server import Server
+from stub_upstream import StubUpstream, make_config, make_request
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counter_merges_threads(self):
+        counter = Counter('test_total', 'Test counter.', ('kind',))
+
+        def work():
+            for i in range(1000):
+                counter.inc(('even' if i % 2 == 0 else 'odd',))
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.collect(), {('even',): 4000, ('odd',): 4000})
+        self.assertIn('test_total{kind="odd"} 4000', counter.render())
+
+    def test_histogram_render(self):
+        histogram = Histogram('test_seconds', 'Test histogram.', (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual(histogram.render(), [
+            '# HELP test_seconds Test histogram.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 2.65',
+            'test_seconds_count 4',
+        ])
+
+    def test_server_metrics(self):
+        with StubUpstream() as upstream:
+            server = Server(make_config(upstream))
+            for transaction_id in (1, 2):
+                server.get_bytes_dns_response(
+                    make_request('example.com', transaction_id), False)
+            server.get_bytes_dns_response(
+                make_request('example.com', 3, True, tp=28), True)
+        lines = server.metrics.registry.render().splitlines()
+        for line in ('dns_queries_total{protocol="tcp",qtype="AAAA"} 1',
+                     'dns_queries_total{protocol="udp",qtype="A"} 2',
+                     'dns_query_duration_seconds_count{protocol="udp"} 2',
+                     'dns_upstream_queries_total{protocol="udp"} 1',
+                     'dns_upstream_queries_total{protocol="tcp"} 1',
+                     'dns_upstream_rtt_seconds_count{protocol="udp"} 1',
+                     'dns_resolution_referrals_count 2',
+                     'dns_cache_hits_total 1',
+                     'dns_cache_misses_total 2',
+                     'dns_cache_entries 2',
+                     'dns_upstream_pool_udp_queries_total 1',
+                     'dns_upstream_pool_tcp_queries_total 1',
+                     'dns_upstream_pool_tcp_connections_total 1'):
+            with self.subTest(line=line):
+                self.assertIn(line, lines)
+        self.assertIn('# TYPE dns_upstream_pool_reuse_rate gauge', lines)
+
+    def test_http_endpoint(self):
+        registry = Registry()
+        registry.register(Counter('test_total', 'Test counter.')).inc()
+        httpd = start_metrics_server(registry, '127.0.0.1', 0)
+        url = f'http://127.0.0.1:{httpd.server_address[1]}'
+        try:
+            with urllib.request.urlopen(f'{url}/metrics') as response:
+                self.assertTrue(response.headers['Content-Type']
+                                .startswith('text/plain'))
+                self.assertIn(b'\ntest_total 1\n', response.read())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f'{url}/other')
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
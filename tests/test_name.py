@@ -0,0 +1,96 @@
+import random
+import struct
+import unittest
+
+from entities.dns_message import DnsMessage
+from entities.name import MAX_POINTERS, read_name
+from test_dns_message import CORPUS
+
+HEADER = bytes.fromhex('abcd81800001000100000000')
+
+
+def answer_with_name(name: bytes) -> bytes:
+    """A response whose question is example.com and whose answer has the
+    given encoded owner name."""
+    return (HEADER + bytes.fromhex('076578616d706c6503636f6d0000010001') +
+            name + bytes.fromhex('00010001000000010004') + bytes(4))
+
+
+class TestReadName(unittest.TestCase):
+    def test_pointer_to_itself(self):
+        with self.assertRaises(ValueError):
+            DnsMessage.from_bytes(answer_with_name(b'\xc0\x1d'), False)
+
+    def test_forward_pointer(self):
+        with self.assertRaises(ValueError):
+            DnsMessage.from_bytes(answer_with_name(b'\xc0\x40'), False)
+
+    def test_pointer_loop_through_labels(self):
+        # The answer points back at the question, whose name is made to
+        # point at the answer again.
+        data = bytearray(answer_with_name(b'\x01a\xc0\x0c'))
+        data[12:14] = b'\xc0\x1d'
+        with self.assertRaises(ValueError):
+            DnsMessage.from_bytes(bytes(data), False)
+
+    def test_pointer_chain_is_limited(self):
+        # The root name, then pointers each pointing at the one before.
+        chain = bytearray(b'\x00')
+        for _ in range(MAX_POINTERS + 1):
+            chain += struct.pack('!H', 0xc000 | max(0, len(chain) - 2))
+        self.assertEqual(read_name(chain, len(chain) - 4),
+                         ('', len(chain) - 2))
+        with self.assertRaises(ValueError):
+            read_name(chain, len(chain) - 2)
+
+    def test_reserved_label_types(self):
+        for length in (0x40, 0x80):
+            with self.subTest(length=length):
+                with self.assertRaises(ValueError):
+                    read_name(bytes((length,)) + bytes(length) + b'\x00', 0)
+
+    def test_long_name(self):
+        label = b'\x3f' + b'a' * 63
+        self.assertEqual(len(read_name(label * 3 + b'\x3da' + b'a' * 60 +
+                                       b'\x00', 0)[0]), 253)
+        with self.assertRaises(ValueError):
+            read_name(label * 4 + b'\x00', 0)
+
+    def test_truncated_name(self):
+        for data in (b'', b'\x03ab', b'\x03abc', b'\xc0'):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    read_name(data, 0)
+
+    def test_suffixes_are_memoized(self):
+        data = b'\x03com\x00' + b'\x01a\xc0\x00' + b'\x01b\xc0\x00'
+        names = {}
+        self.assertEqual(read_name(data, 5, names), ('a.com', 9))
+        self.assertEqual(names, {0: 'com'})
+        # A second pointer to the same suffix is answered from the memo.
+        names[0] = 'memo'
+        self.assertEqual(read_name(data, 9, names), ('b.memo', 13))
+
+    def test_fuzzed_messages(self):
+        rng = random.Random(2308)
+        corpus = [bytes.fromhex(hexed) for hexed in CORPUS.values()]
+        corpus += [DnsMessage.from_bytes(data, False).to_bytes(compress=True)
+                   for data in corpus]
+        for _ in range(3000):
+            data = bytearray(rng.choice(corpus))
+            for _ in range(rng.randint(1, 8)):
+                position = rng.randrange(len(data))
+                if rng.random() < 0.5:
+                    data[position] = rng.randrange(256)
+                else:
+                    data[position] = 0xc0 | rng.randrange(4)
+            if rng.random() < 0.3:
+                del data[rng.randrange(len(data)):]
+            try:
+                DnsMessage.from_bytes(bytes(data), False)
+            except (ValueError, struct.error):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
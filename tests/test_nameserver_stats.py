@@ -0,0 +1,70 @@
+import asyncio
+import time
+import unittest
+
+from server.async_server import AsyncServer
+from server.nameserver_stats import MAX_TIMEOUT, NameserverStats
+from server.server import Server, UpstreamQuery
+from stub_upstream import StubUpstream, make_config, make_request
+
+
+class TestNameserverStats(unittest.TestCase):
+    def setUp(self):
+        self.stats = NameserverStats()
+
+    def test_smoothed_rtt(self):
+        self.stats.record(('192.0.2.1', 53), 0.1)
+        self.stats.record(('192.0.2.1', 53), 0.2)
+        server = self.stats.snapshot()['192.0.2.1:53']
+        self.assertAlmostEqual(server['srtt'], 0.1125)
+        self.assertAlmostEqual(server['rttvar'], 0.0625)
+        self.assertEqual(server['samples'], 2)
+
+    def test_timeouts_back_off(self):
+        self.stats.record(('192.0.2.1', 53), 0.1)
+        for _ in range(10):
+            self.stats.record_timeout(('192.0.2.1', 53))
+        server = self.stats.snapshot()['192.0.2.1:53']
+        self.assertEqual(server['timeouts'], 10)
+        self.assertEqual(server['srtt'], MAX_TIMEOUT)
+
+    def test_fastest_server_first(self):
+        self.stats.record(('192.0.2.1', 53), 0.3)
+        self.stats.record(('192.0.2.2', 53), 0.05)
+        self.stats.record(('192.0.2.3', 53), 0.1)
+        queries = [UpstreamQuery(b'', f'192.0.2.{i}', 53, False)
+                   for i in (1, 2, 3)]
+        self.assertEqual([q.address for q in self.stats.order(queries)],
+                         ['192.0.2.2', '192.0.2.3', '192.0.2.1'])
+
+
+class TestHedgedQueries(unittest.TestCase):
+    def check_hedging(self, server, exchange):
+        with StubUpstream(delay=0.9) as slow, StubUpstream() as fast:
+            # The slow server looks fast, so it is tried first and the
+            # query is hedged to the other one after its adaptive timeout.
+            server.nameservers.record(('127.0.0.1', slow.port), 0.01)
+            server.nameservers.record(('127.0.0.1', fast.port), 0.02)
+            message = make_request('example.com')
+            queries = [UpstreamQuery(message, '127.0.0.1', upstream.port,
+                                     False) for upstream in (fast, slow)]
+            start = time.perf_counter()
+            self.assertTrue(exchange(queries))
+            self.assertLess(time.perf_counter() - start, 0.5)
+            self.assertEqual(slow.queries, 1)
+            self.assertEqual(fast.queries, 1)
+
+    def test_hedged_queries(self):
+        with StubUpstream() as upstream:
+            server = Server(make_config(upstream, hedged_queries=True))
+        self.check_hedging(server, server.exchange_upstream)
+
+    def test_hedged_queries_async(self):
+        with StubUpstream() as upstream:
+            server = AsyncServer(make_config(upstream, hedged_queries=True))
+        self.check_hedging(server, lambda queries: asyncio.run(
+            server.exchange_upstream_async(queries)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import io
+import logging
+import unittest
+
+from server.query_log import LazyQueueHandler, LogWriter, QueryLog
+from server.server import Server
+from stub_upstream import StubUpstream, make_config, make_request
+
+
+class CountingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super().write(text)
+
+
+class Lazy:
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return 'lazy'
+
+
+class TestQueryLog(unittest.TestCase):
+    def setUp(self):
+        self.stream = CountingStream()
+        handler = logging.StreamHandler(self.stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.writer = LogWriter([handler])
+        self.logger = logging.getLogger('test_query_log')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(LazyQueueHandler(self.writer.queue))
+        self.addCleanup(self.logger.handlers.clear)
+
+    def test_writes_records_in_batches(self):
+        for i in range(100):
+            self.logger.info('record %d', i)
+        self.writer.start()
+        self.writer.stop()
+        self.assertEqual(self.stream.getvalue().splitlines(),
+                         [f'record {i}' for i in range(100)])
+        self.assertEqual(self.stream.writes, 1)
+
+    def test_formats_in_writer_thread(self):
+        lazy = Lazy()
+        self.logger.info('value %s', lazy)
+        self.logger.debug('disabled %s', lazy)
+        self.assertEqual(lazy.formatted, 0)
+        self.writer.start()
+        self.writer.stop()
+        self.assertEqual(lazy.formatted, 1)
+        self.assertEqual(self.stream.getvalue(), 'value lazy\n')
+
+    def test_sampling(self):
+        self.assertFalse(QueryLog(0).is_sampled())
+        query_log = QueryLog(0.25)
+        with self.assertLogs('server.queries'):
+            sampled = sum(query_log.is_sampled() for _ in range(10000))
+            query_log.logger.info('enable assertLogs')
+        self.assertAlmostEqual(sampled / 10000, 0.25, delta=0.03)
+
+    def test_server_logs_queries(self):
+        with StubUpstream() as upstream, \
+                self.assertLogs('server.queries') as logs:
+            server = Server(make_config(upstream))
+            for transaction_id in (1, 2):
+                server.get_bytes_dns_response(
+                    make_request('example.com', transaction_id), False,
+                    ('127.0.0.1', 5353))
+            server.get_bytes_dns_response(make_request('example.com', 3),
+                                          False)
+        self.assertEqual(len(logs.records), 2)
+        for record, cache in zip(logs.records, ('miss', 'hit')):
+            message = record.getMessage()
+            self.assertTrue(message.startswith(
+                'client=127.0.0.1:5353 proto=udp qname=example.com '
+                'qtype=A rcode=NOERROR latency_ms='))
+            self.assertTrue(message.endswith(f'cache={cache}'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+
+from entities.dns_message import DnsMessage
+from entities.flags import Flags
+from entities.query import Query
+from entities.question import Question
+from server.rrset_cache import RRsetCache, share_names
+from server.server import Server
+from stub_upstream import StubUpstream, make_config, make_request
+
+
+def make_response(name, address, glue_address='192.0.2.53'):
+    return DnsMessage(False, 0, Flags(1, 0, 0, 0, 0, 0, 0, 0),
+                      [Question(name, 1, 1)],
+                      [Query(name, 1, 1, 300, address)],
+                      [Query('example.com', 2, 1, 3600, 'ns.example.com')],
+                      [Query('ns.example.com', 1, 1, 3600, glue_address),
+                       Query('other.example.org', 1, 1, 3600, '192.0.2.99')])
+
+
+class TestRRsetCache(unittest.TestCase):
+    def test_records_are_shared(self):
+        cache = RRsetCache(100)
+        first = make_response('a.example.com', '192.0.2.1')
+        second = make_response('b.example.com', '192.0.2.2')
+        cache.add_message(first)
+        cache.add_message(second)
+        self.assertIs(first.authorities[0], second.authorities[0])
+        self.assertIs(first.add_records[0], second.add_records[0])
+        self.assertEqual(len(cache), 4)
+
+    def test_names_are_shared(self):
+        first = DnsMessage.from_bytes(
+            make_response('a.example.com', '192.0.2.1').to_bytes(), False)
+        second = DnsMessage.from_bytes(
+            make_response('b.example.com', '192.0.2.2').to_bytes(), False)
+        share_names(first)
+        share_names(second)
+        self.assertIs(first.answers[0].name, first.questions[0].name)
+        self.assertIs(first.authorities[0].name, second.authorities[0].name)
+        self.assertIs(first.authorities[0].value, second.add_records[0].name)
+
+    def test_only_glue_is_taken_from_additional_section(self):
+        cache = RRsetCache(100)
+        cache.add_message(make_response('a.example.com', '192.0.2.1'))
+        self.assertEqual(cache.get_records(('ns.example.com', 1, 1)),
+                         [Query('ns.example.com', 1, 1, 3600, '192.0.2.53')])
+        self.assertEqual(cache.get_records(('other.example.org', 1, 1)), [])
+
+    def test_glue_does_not_replace_answer(self):
+        cache = RRsetCache(100)
+        cache.add_message(make_response('ns.example.com', '192.0.2.1'))
+        cache.add_message(make_response('a.example.com', '192.0.2.2',
+                                        '192.0.2.66'))
+        self.assertEqual(cache.get_records(('ns.example.com', 1, 1))[0].data,
+                         '192.0.2.1')
+
+    def test_synthesize_follows_cnames(self):
+        cache = RRsetCache(100)
+        cache.add_message(DnsMessage(
+            False, 0, Flags(1, 0, 0, 0, 0, 0, 0, 0),
+            [Question('www.example.com', 1, 1)],
+            [Query('www.example.com', 5, 1, 300, 'example.com'),
+             Query('example.com', 1, 1, 300, '192.0.2.1')], [], []))
+        message = cache.synthesize(Question('www.example.com', 1, 1))
+        self.assertEqual([answer.data for answer in message.answers],
+                         ['example.com', '192.0.2.1'])
+        self.assertIsNone(cache.synthesize(Question('example.com', 28, 1)))
+        self.assertEqual(cache.synthesized, 1)
+
+    def test_glue_is_not_served_as_answer(self):
+        cache = RRsetCache(100)
+        cache.add_message(make_response('a.example.com', '192.0.2.1'))
+        self.assertEqual(len(cache.get_records(('ns.example.com', 1, 1))), 1)
+        self.assertIsNone(cache.synthesize(Question('ns.example.com', 1, 1)))
+        self.assertIsNone(cache.synthesize(Question('example.com', 2, 1)))
+
+    def test_out_of_zone_glue_is_not_cached(self):
+        cache = RRsetCache(100)
+        cache.add_message(DnsMessage(
+            False, 0, Flags(1, 0, 0, 0, 0, 0, 0, 0),
+            [Question('evil.com', 1, 1)],
+            [Query('evil.com', 1, 1, 300, '203.0.113.1')],
+            [Query('evil.com', 2, 1, 86400, 'www.bank.com')],
+            [Query('www.bank.com', 1, 1, 86400, '6.6.6.6')]))
+        self.assertEqual(cache.get_records(('www.bank.com', 1, 1)), [])
+        self.assertIsNone(cache.synthesize(Question('www.bank.com', 1, 1)))
+
+    def test_answers_outside_the_cname_chain_are_not_cached(self):
+        cache = RRsetCache(100)
+        cache.add_message(DnsMessage(
+            False, 0, Flags(1, 0, 0, 0, 0, 0, 0, 0),
+            [Question('evil.com', 1, 1)],
+            [Query('evil.com', 5, 1, 300, 'www.evil.com'),
+             Query('www.evil.com', 1, 1, 300, '203.0.113.1'),
+             Query('www.bank.com', 1, 1, 86400, '6.6.6.6')], [], []))
+        self.assertEqual(cache.get_records(('www.bank.com', 1, 1)), [])
+        self.assertIsNone(cache.synthesize(Question('www.bank.com', 1, 1)))
+        self.assertEqual(
+            len(cache.synthesize(Question('evil.com', 1, 1)).answers), 2)
+
+    def test_server_does_not_answer_from_glue(self):
+        with StubUpstream(address='10.0.0.3', glue_ttl=600) as upstream:
+            server = Server(make_config(upstream))
+            server.get_bytes_dns_response(make_request('www.example.com'),
+                                          False)
+            for transaction_id in (1, 2):
+                response = DnsMessage.from_bytes(
+                    server.get_bytes_dns_response(
+                        make_request('ns.example.com', transaction_id),
+                        False), False)
+                self.assertEqual(response.transaction_id, transaction_id)
+                self.assertEqual([(answer.name, answer.data)
+                                  for answer in response.answers],
+                                 [('ns.example.com', '10.0.0.3')])
+        # The nameserver is asked once; the second answer is cached.
+        self.assertEqual(upstream.queries, 2)
+        self.assertEqual(server.rrsets.synthesized, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+import socket
+import threading
+import time
+import unittest
+
+from entities.dns_message import DnsMessage
+from entities.query import SOA
+from server.server import Server, receive_batch
+from stub_upstream import StubUpstream, make_config, make_request
+
+
+class RecordingExecutor:
+    """Runs submitted calls at once and counts them."""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        fn(*args)
+
+
+class TestServer(unittest.TestCase):
+    def test_resolves_and_caches(self):
+        with StubUpstream(address='10.0.0.9') as upstream:
+            server = Server(make_config(upstream))
+            for transaction_id in (1, 2):
+                data = server.get_bytes_dns_response(
+                    make_request('example.com', transaction_id), False)
+                response = DnsMessage.from_bytes(data, False)
+                self.assertEqual(response.transaction_id, transaction_id)
+                self.assertEqual(response.answers[0].data, '10.0.0.9')
+        self.assertEqual(upstream.queries, 1)
+
+    def test_hot_entry_is_prefetched_before_expiry(self):
+        with StubUpstream(ttl=1) as upstream:
+            server = Server(make_config(upstream, prefetch_fraction=0.5,
+                                        prefetch_min_hits=2))
+            for transaction_id in range(3):
+                server.get_bytes_dns_response(
+                    make_request('hot.example.com', transaction_id), False)
+            self.assertEqual(upstream.queries, 1)
+            time.sleep(0.6)
+            keys = server.get_prefetch_keys()
+            self.assertEqual(keys, [('hot.example.com', 1, 1)])
+            server.prefetch(keys[0])
+            self.assertEqual(upstream.queries, 2)
+            self.assertEqual(server.prefetches, 1)
+            time.sleep(0.6)
+            server.get_bytes_dns_response(make_request('hot.example.com'),
+                                          False)
+        self.assertEqual(upstream.queries, 2)
+
+    def test_concurrent_identical_misses_are_coalesced(self):
+        with StubUpstream(delay=0.5) as upstream:
+            server = Server(make_config(upstream))
+            barrier = threading.Barrier(1000)
+            responses = [None] * 1000
+
+            def query(i):
+                barrier.wait()
+                responses[i] = DnsMessage.from_bytes(
+                    server.get_bytes_dns_response(
+                        make_request('popular.example.com', i), False),
+                    False)
+
+            threads = [threading.Thread(target=query, args=(i,))
+                       for i in range(1000)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(upstream.queries, 1)
+        self.assertGreater(server.coalesced_queries, 0)
+        self.assertEqual(server.flights, {})
+        for i, response in enumerate(responses):
+            self.assertEqual(response.transaction_id, i)
+            self.assertEqual(response.answers[0].name, 'popular.example.com')
+
+    def test_nxdomain_is_cached_with_soa_minimum(self):
+        with StubUpstream(ttl=3600, missing={'nope.example.com'},
+                          negative_ttl=30) as upstream:
+            server = Server(make_config(upstream))
+            for transaction_id in (1, 2):
+                response = DnsMessage.from_bytes(
+                    server.get_bytes_dns_response(
+                        make_request('nope.example.com', transaction_id),
+                        False), False)
+                self.assertEqual(response.transaction_id, transaction_id)
+                self.assertEqual(response.flags.reply_code, 3)
+                self.assertEqual(response.answers, [])
+                soa, = response.authorities
+                self.assertEqual((soa.tp, soa.ttl), (SOA, 30))
+        self.assertEqual(upstream.queries, 1)
+        self.assertEqual(len(server.cache), 0)
+        self.assertEqual(server.negative_cache.stats()['hits'], 1)
+
+    def test_nodata_is_cached(self):
+        with StubUpstream(nodata_types={28}) as upstream:
+            server = Server(make_config(upstream,
+                                        negative_cache_max_ttl=10))
+            for transaction_id in (1, 2):
+                response = DnsMessage.from_bytes(
+                    server.get_bytes_dns_response(
+                        make_request('example.com', transaction_id, tp=28),
+                        False), False)
+                self.assertEqual(response.flags.reply_code, 0)
+                self.assertEqual(response.answers, [])
+                self.assertEqual(response.authorities[0].ttl, 10)
+        self.assertEqual(upstream.queries, 1)
+
+    def test_negative_answers_do_not_evict_positive_ones(self):
+        missing = {f'nope{i}.example.com' for i in range(10)}
+        with StubUpstream(missing=missing) as upstream:
+            server = Server(make_config(upstream, cache_size=2,
+                                        negative_cache_size=2))
+            server.get_bytes_dns_response(make_request('example.com'), False)
+            for name in sorted(missing):
+                server.get_bytes_dns_response(make_request(name), False)
+            self.assertEqual(len(server.negative_cache), 2)
+            server.get_bytes_dns_response(make_request('example.com'), False)
+        self.assertEqual(upstream.queries, 11)
+
+    def test_cname_is_chased(self):
+        aliases = {'www.example.com': 'cdn.example.net',
+                   'cdn.example.net': 'edge.example.net'}
+        with StubUpstream(address='10.0.0.7', aliases=aliases) as upstream:
+            server = Server(make_config(upstream))
+            for transaction_id in (1, 2):
+                response = DnsMessage.from_bytes(
+                    server.get_bytes_dns_response(
+                        make_request('www.example.com', transaction_id),
+                        False), False)
+                self.assertEqual([(answer.name, answer.data)
+                                  for answer in response.answers],
+                                 [('www.example.com', 'cdn.example.net'),
+                                  ('cdn.example.net', 'edge.example.net'),
+                                  ('edge.example.net', '10.0.0.7')])
+            self.assertEqual(upstream.queries, 3)
+            server.get_bytes_dns_response(make_request('edge.example.net'),
+                                          False)
+        self.assertEqual(upstream.queries, 3)
+
+    def test_cname_reuses_cached_target(self):
+        aliases = {'a.example.com': 'example.net',
+                   'b.example.com': 'example.net'}
+        with StubUpstream(aliases=aliases) as upstream:
+            server = Server(make_config(upstream))
+            server.get_bytes_dns_response(make_request('example.net'), False)
+            for name in aliases:
+                response = DnsMessage.from_bytes(
+                    server.get_bytes_dns_response(make_request(name), False),
+                    False)
+                self.assertEqual(response.answers[-1].data, '10.0.0.1')
+        self.assertEqual(upstream.queries, 3)
+
+    def test_cname_loop_is_not_followed_forever(self):
+        aliases = {'a.example.com': 'b.example.com',
+                   'b.example.com': 'a.example.com'}
+        with StubUpstream(aliases=aliases) as upstream:
+            server = Server(make_config(upstream))
+            response = DnsMessage.from_bytes(server.get_bytes_dns_response(
+                make_request('a.example.com'), False), False)
+        self.assertEqual(len(response.answers), 2)
+        self.assertEqual(upstream.queries, 2)
+
+    def test_cname_to_missing_name_is_nxdomain(self):
+        with StubUpstream(aliases={'www.example.com': 'gone.example.com'},
+                          missing={'gone.example.com'}) as upstream:
+            server = Server(make_config(upstream))
+            response = DnsMessage.from_bytes(server.get_bytes_dns_response(
+                make_request('www.example.com'), False), False)
+        self.assertEqual(response.flags.reply_code, 3)
+        self.assertEqual(response.answers[0].data, 'gone.example.com')
+
+    def test_receive_batch(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as listener, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+            listener.bind(('127.0.0.1', 0))
+            for data in (b'a', b'b', b'c'):
+                client.sendto(data, listener.getsockname())
+            self.assertEqual([data for data, _ in receive_batch(listener, 2)],
+                             [b'a', b'b'])
+            self.assertEqual([data for data, _ in receive_batch(listener, 2)],
+                             [b'c'])
+
+    def test_only_udp_misses_are_handed_to_workers(self):
+        with StubUpstream(address='10.0.0.4') as upstream, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as listener, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+            server = Server(make_config(upstream))
+            server.get_bytes_dns_response(make_request('hit.example.com'),
+                                          False)
+            listener.bind(('127.0.0.1', 0))
+            client.settimeout(2)
+            client.sendto(make_request('hit.example.com', 1),
+                          listener.getsockname())
+            client.sendto(make_request('miss.example.com', 2),
+                          listener.getsockname())
+            executor = RecordingExecutor()
+            for data, address in receive_batch(listener, 8):
+                server.answer_udp_client(listener, data, address, executor)
+            responses = [DnsMessage.from_bytes(client.recvfrom(512)[0], False)
+                         for _ in range(2)]
+        self.assertEqual([(response.transaction_id, response.answers[0].data)
+                          for response in responses],
+                         [(1, '10.0.0.4'), (2, '10.0.0.4')])
+        self.assertEqual(executor.submitted, 1)
+        self.assertEqual(upstream.queries, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
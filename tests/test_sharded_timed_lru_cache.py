@@ -0,0 +1,74 @@
+import unittest
+import os
+import tempfile
+import threading
+from server.sharded_timed_lru_cache import ShardedTimedLruCache
+from server.timed_lru_cache import TimedLruCache
+from stub_upstream import make_cached_response
+
+class TestShardedTimedLruCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ShardedTimedLruCache(maxsize=40, shards=4)
+
+    def test_add_and_get_item(self):
+        self.cache.add_item(("example.com", 1, 1), "value1", ttl=1.0)
+        self.assertEqual(self.cache.get_item(("example.com", 1, 1)), "value1")
+        self.assertIn(("example.com", 1, 1), self.cache)
+        self.assertIsNone(self.cache.get_item(("example.com", 28, 1)))
+
+    def test_per_shard_capacity(self):
+        for i in range(1000):
+            self.cache.add_item(("example.com", i, 1), i, ttl=1.0)
+        for shard in self.cache.shards:
+            self.assertLessEqual(len(shard), 10)
+        self.assertLessEqual(len(self.cache), self.cache.maxsize)
+
+    def test_ttl_expiration(self):
+        self.cache.add_item("key1", "value1", ttl=0)
+        self.cache.update()
+        self.assertIsNone(self.cache.get_item("key1"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_file_persistence_is_compatible(self):
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            filename = tmp.name
+
+        try:
+            value1 = make_cached_response("key1", "192.0.2.1")
+            value2 = make_cached_response("key2", "192.0.2.2")
+            self.cache.add_item(("key1", 1, 1), value1, ttl=10.0)
+            self.cache.add_item(("key2", 1, 1), value2, ttl=10.0)
+            self.cache.save_to_file(filename)
+
+            single = TimedLruCache.load_from_file(filename)
+            self.assertEqual(single.get_item(("key1", 1, 1)).wire,
+                             value1.wire)
+            single.save_to_file(filename)
+
+            sharded = ShardedTimedLruCache.try_load_from_file(filename, 8, 2)
+            self.assertEqual(sharded.maxsize, 8)
+            self.assertEqual(sharded.get_item(("key1", 1, 1)).wire,
+                             value1.wire)
+            self.assertEqual(sharded.get_item(("key2", 1, 1)).wire,
+                             value2.wire)
+        finally:
+            os.unlink(filename)
+
+    def test_thread_safety(self):
+        def add_items(offset):
+            for i in range(500):
+                key = ("example.com", offset * 500 + i, 1)
+                self.cache.add_item(key, i, ttl=1.0)
+                self.cache.get_item(key)
+
+        threads = [threading.Thread(target=add_items, args=(i,))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertLessEqual(len(self.cache), self.cache.maxsize)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import socket
+import unittest
+from unittest import mock
+
+from server.stub_upstream import bind_sockets
+
+
+class TestStubUpstream(unittest.TestCase):
+    def test_taken_tcp_port_is_retried(self):
+        failed = []
+        bind = socket.socket.bind
+
+        def bind_or_fail(sock, address):
+            if sock.type == socket.SOCK_STREAM and not failed:
+                failed.append(address)
+                raise OSError(98, 'Address already in use')
+            return bind(sock, address)
+
+        with mock.patch.object(socket.socket, 'bind', bind_or_fail):
+            udp, tcp = bind_sockets()
+        with udp, tcp:
+            self.assertEqual(len(failed), 1)
+            self.assertEqual(udp.getsockname(), tcp.getsockname())
+
+
+if __name__ == '__main__':
+    unittest.main()
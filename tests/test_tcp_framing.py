@@ -0,0 +1,104 @@
+import asyncio
+import concurrent.futures
+import socket
+import threading
+import time
+import unittest
+
+from entities.dns_message import DnsMessage
+from server.async_server import AsyncServer
+from server.server import Server
+from server.tcp_framing import receive_message
+from stub_upstream import StubUpstream, make_config, make_request
+
+
+def send_slowly(sock: socket.socket, data: bytes) -> None:
+    for i in range(len(data)):
+        sock.send(data[i:i + 1])
+        time.sleep(0.001)
+
+
+class TestTcpFraming(unittest.TestCase):
+    def test_rejects_wrong_length_prefix(self):
+        data = make_request('example.com', is_tcp=True)
+        for prefix in (b'\x00\x00', (len(data) - 1).to_bytes(2, 'big')):
+            with self.subTest(prefix=prefix):
+                with self.assertRaises(ValueError):
+                    DnsMessage.from_bytes(prefix + data[2:], True)
+
+    def test_reassembles_split_messages(self):
+        first = make_request('a.example.com', 1, True)
+        second = make_request('b.example.com', 2, True)
+        left, right = socket.socketpair()
+        with left, right:
+            sender = threading.Thread(target=send_slowly,
+                                      args=(left, first + second))
+            sender.start()
+            self.assertEqual(receive_message(right), first)
+            self.assertEqual(receive_message(right), second)
+            sender.join()
+            left.shutdown(socket.SHUT_WR)
+            self.assertIsNone(receive_message(right))
+
+    def test_truncated_message_is_an_error(self):
+        data = make_request('example.com', is_tcp=True)
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(data[:-1])
+            left.shutdown(socket.SHUT_WR)
+            with self.assertRaises(ConnectionError):
+                receive_message(right)
+
+
+class TestPipelinedTcpClients(unittest.TestCase):
+    def check_pipelined_answers(self, client: socket.socket) -> None:
+        # The slow name is not cached and its answer waits for the stub,
+        # so the two cached names are answered first.
+        client.sendall(make_request('slow.example.com', 1, True) +
+                       make_request('a.example.com', 2, True) +
+                       make_request('b.example.com', 3, True))
+        ids = [DnsMessage.from_bytes(receive_message(client), True)
+               .transaction_id for _ in range(3)]
+        self.assertEqual(sorted(ids[:2]), [2, 3])
+        self.assertEqual(ids[2], 1)
+        # The connection is closed once it has been idle for long enough.
+        self.assertIsNone(receive_message(client))
+
+    def test_threaded_server(self):
+        with StubUpstream(delay=0.3) as upstream:
+            server = Server(make_config(upstream, tcp_idle_timeout=0.5))
+            for name in ('a.example.com', 'b.example.com'):
+                server.get_bytes_dns_response(make_request(name), False)
+            left, right = socket.socketpair()
+            with left, concurrent.futures.ThreadPoolExecutor(4) as executor:
+                handler = threading.Thread(
+                    target=server.handle_tcp_client,
+                    args=(right, ('127.0.0.1', 0), executor))
+                handler.start()
+                self.check_pipelined_answers(left)
+                handler.join()
+
+    def test_async_server(self):
+        with StubUpstream(delay=0.3) as upstream:
+            server = AsyncServer(make_config(upstream, engine='asyncio',
+                                             tcp_idle_timeout=0.5))
+
+            async def serve():
+                for name in ('a.example.com', 'b.example.com'):
+                    await server.get_bytes_dns_response_async(
+                        make_request(name), False)
+                tcp_server = await asyncio.start_server(
+                    server.handle_tcp_stream, '127.0.0.1', 0)
+                port = tcp_server.sockets[0].getsockname()[1]
+                async with tcp_server:
+                    client = await asyncio.to_thread(
+                        socket.create_connection, ('127.0.0.1', port))
+                    with client:
+                        await asyncio.to_thread(self.check_pipelined_answers,
+                                                client)
+
+            asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    unittest.main()
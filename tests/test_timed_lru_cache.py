@@ -3,6 +3,7 @@ import time
 import os
 import tempfile
 from server.timed_lru_cache import TimedLruCache
+from stub_upstream import make_cached_response
 
 class TestTimedLruCache(unittest.TestCase):
     def setUp(self):
@@ -30,6 +31,79 @@ class TestTimedLruCache(unittest.TestCase):
         self.assertIn("key3", self.cache)
         self.assertIn("key4", self.cache)
 
+    def test_lru_eviction_after_hit(self):
+        self.cache.add_item("key1", "value1", ttl=1.0)
+        self.cache.add_item("key2", "value2", ttl=1.0)
+        self.cache.add_item("key3", "value3", ttl=1.0)
+        self.cache.get_item("key1")
+        self.cache.add_item("key4", "value4", ttl=1.0)
+
+        self.assertIn("key1", self.cache)
+        self.assertNotIn("key2", self.cache)
+        self.assertIn("key3", self.cache)
+        self.assertIn("key4", self.cache)
+
+    def test_expired_item_evicted_before_lru(self):
+        self.cache.add_item("key1", "value1", ttl=1.0)
+        self.cache.add_item("key2", "value2", ttl=0.1)
+        self.cache.add_item("key3", "value3", ttl=1.0)
+        time.sleep(0.2)
+        self.cache.add_item("key4", "value4", ttl=1.0)
+
+        self.assertIn("key1", self.cache)
+        self.assertNotIn("key2", self.cache)
+        self.assertEqual(len(self.cache), 3)
+
+    def test_update_removes_expired_items(self):
+        self.cache.add_item("key1", "value1", ttl=0.1)
+        self.cache.add_item("key2", "value2", ttl=1.0)
+        time.sleep(0.2)
+        self.cache.update()
+        self.assertEqual(list(self.cache.entries), ["key2"])
+
+    def test_expiration_heap_stays_bounded(self):
+        for i in range(1000):
+            self.cache.add_item(f"key{i % 5}", f"value{i}", ttl=10.0)
+        self.assertLessEqual(len(self.cache.expirations),
+                             2 * len(self.cache.entries) + 65)
+
+    def test_refresh_candidates(self):
+        cache = TimedLruCache(maxsize=3, refresh_fraction=0.5)
+        cache.add_item("hot", "value1", ttl=0.2)
+        cache.add_item("cold", "value2", ttl=0.2)
+        cache.add_item("later", "value3", ttl=10.0)
+        for _ in range(3):
+            cache.get_item("hot")
+            cache.get_item("later")
+        self.assertEqual(cache.pop_refresh_candidates(min_hits=3), [])
+        time.sleep(0.15)
+        self.assertEqual(cache.pop_refresh_candidates(min_hits=3), ["hot"])
+        self.assertEqual(cache.pop_refresh_candidates(min_hits=3), [])
+
+    def test_refresh_is_queued_once_when_heaps_are_rebuilt(self):
+        cache = TimedLruCache(maxsize=3, refresh_fraction=0.5)
+        cache.add_item("key", "value", ttl=0.2)
+        while True:
+            cache.add_item("key", "value", ttl=0.2)
+            if len(cache.expirations) == 1:
+                break
+        time.sleep(0.15)
+        self.assertEqual(cache.pop_refresh_candidates(min_hits=0), ["key"])
+
+    def test_stats(self):
+        self.cache.add_item("key1", "value1", ttl=0.1)
+        self.cache.add_item("key2", "value2", ttl=0.1)
+        self.cache.add_item("key3", "value3", ttl=10.0)
+        self.cache.add_item("key4", "value4", ttl=10.0)
+        self.cache.get_item("key3")
+        self.cache.get_item("key1")
+        time.sleep(0.15)
+        self.cache.get_item("key2")
+        self.cache.update()
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2,
+                                              'evictions': 1,
+                                              'expirations': 1})
+
     def test_update_existing_item(self):
         self.cache.add_item("key1", "value1", ttl=1.0)
         self.cache.add_item("key1", "value2", ttl=1.0)
@@ -40,13 +114,18 @@ class TestTimedLruCache(unittest.TestCase):
             filename = tmp.name
 
         try:
-            self.cache.add_item("key1", "value1", ttl=1.0)
-            self.cache.add_item("key2", "value2", ttl=1.0)
+            value1 = make_cached_response("key1", "192.0.2.1")
+            value2 = make_cached_response("key2", "192.0.2.2")
+            self.cache.add_item(("key1", 1, 1), value1, ttl=1.0)
+            self.cache.add_item(("key2", 1, 1), value2, ttl=1.0)
             self.cache.save_to_file(filename)
 
             new_cache = TimedLruCache.load_from_file(filename)
-            self.assertEqual(new_cache.get_item("key1"), "value1")
-            self.assertEqual(new_cache.get_item("key2"), "value2")
+            self.assertEqual(new_cache.get_item(("key1", 1, 1)).wire,
+                             value1.wire)
+            self.assertEqual(
+                new_cache.get_item(("key2", 1, 1)).message.to_bytes(),
+                value2.message.to_bytes())
             self.assertEqual(new_cache.maxsize, self.cache.maxsize)
 
         finally:
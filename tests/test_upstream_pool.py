@@ -0,0 +1,130 @@
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+from entities.dns_message import DnsMessage
+from server.upstream_pool import PendingQueries, UpstreamPool, get_question
+from stub_upstream import StubUpstream, make_request
+
+
+class TestUpstreamPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = UpstreamPool(size=2, idle_timeout=0.3)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def exchange_many(self, port: int, tcp: bool, count: int = 50):
+        results = {}
+
+        def query(i):
+            # All clients use the same transaction ID; the pool must still
+            # match every reply to its own query.
+            data = self.pool.exchange(make_request(f'host{i}.example.com',
+                                                   42, tcp),
+                                      '127.0.0.1', port, tcp)
+            results[i] = DnsMessage.from_bytes(data, tcp)
+
+        threads = [threading.Thread(target=query, args=(i,))
+                   for i in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_udp_replies_matched_by_transaction_id(self):
+        with StubUpstream(delay=0.05) as upstream:
+            results = self.exchange_many(upstream.port, False)
+        for i, response in results.items():
+            self.assertEqual(response.transaction_id, 42)
+            self.assertEqual(response.answers[0].name, f'host{i}.example.com')
+        stats = self.pool.stats()
+        self.assertEqual(stats['udp_queries'], 50)
+        self.assertEqual(stats['udp_sockets'], 2)
+
+    def test_tcp_queries_pipelined_over_one_connection(self):
+        with StubUpstream() as upstream:
+            results = self.exchange_many(upstream.port, True)
+        for i, response in results.items():
+            self.assertEqual(response.transaction_id, 42)
+            self.assertEqual(response.answers[0].name, f'host{i}.example.com')
+        stats = self.pool.stats()
+        self.assertEqual(stats['tcp_queries'], 50)
+        self.assertEqual(stats['tcp_connections'], 1)
+        self.assertGreater(stats['reuse_rate'], 0.9)
+
+    def test_reply_with_other_question_is_dropped(self):
+        pending = PendingQueries()
+        query = make_request('Example.com')
+        transaction_id, future = pending.register(('192.0.2.1', 53),
+                                                  get_question(query))
+        pending.resolve(transaction_id, ('192.0.2.1', 53),
+                        make_request('evil.com', transaction_id))
+        self.assertFalse(future.done())
+        reply = make_request('EXAMPLE.COM', transaction_id)
+        pending.resolve(transaction_id, ('192.0.2.1', 53), reply)
+        self.assertEqual(future.result(0), reply)
+        self.assertEqual(len(pending), 0)
+
+    def test_slow_tcp_connect_does_not_block_udp(self):
+        def connect(address, timeout):
+            time.sleep(0.5)
+            raise socket.timeout('timed out')
+
+        with StubUpstream() as upstream, \
+                mock.patch('socket.create_connection', connect):
+            blocked = threading.Thread(target=self.exchange_or_fail,
+                                       args=(upstream.port + 1,))
+            blocked.start()
+            time.sleep(0.1)
+            start = time.perf_counter()
+            self.pool.exchange(make_request('example.com'), '127.0.0.1',
+                               upstream.port, False)
+            elapsed = time.perf_counter() - start
+            blocked.join()
+        self.assertLess(elapsed, 0.3)
+
+    def exchange_or_fail(self, port: int) -> None:
+        try:
+            self.pool.exchange(make_request('example.com', 1, True),
+                               '127.0.0.1', port, True)
+        except OSError:
+            pass
+
+    def test_upstream_name_is_looked_up_once(self):
+        with StubUpstream() as upstream, \
+                mock.patch('socket.gethostbyname',
+                           return_value='127.0.0.1') as gethostbyname:
+            for transaction_id in (1, 2):
+                self.pool.exchange(make_request('example.com', transaction_id),
+                                   'localhost', upstream.port, False)
+        gethostbyname.assert_called_once_with('localhost')
+
+    def test_unanswered_udp_query_is_discarded(self):
+        pool = UpstreamPool(size=1, idle_timeout=0.3, timeout=0.1)
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind(('127.0.0.1', 0))
+        try:
+            with self.assertRaises(socket.timeout):
+                pool.exchange(make_request('example.com'), '127.0.0.1',
+                              silent.getsockname()[1], False)
+            self.assertEqual(len(pool.channels[0].pending), 0)
+        finally:
+            silent.close()
+            pool.close()
+
+    def test_idle_tcp_connection_is_closed(self):
+        with StubUpstream() as upstream:
+            self.pool.exchange(make_request('example.com', 1, True),
+                               '127.0.0.1', upstream.port, True)
+            time.sleep(0.6)
+            self.pool.exchange(make_request('example.com', 2, True),
+                               '127.0.0.1', upstream.port, True)
+        self.assertEqual(self.pool.stats()['tcp_connections'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
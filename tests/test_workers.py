@@ -0,0 +1,131 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+from entities.dns_message import DnsMessage
+from server.config import Config
+from server.timed_lru_cache import TimedLruCache, TimedLruCacheEntry
+from server.workers import run_workers
+from stub_upstream import StubUpstream, make_cached_response, make_request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def report_large_cache(config, index, results):
+    """A worker that stops on its own with a cache larger than a pipe
+    buffer."""
+    results.put((index, make_entries(index, 2000), True))
+
+
+def report_and_wait_for_snapshot(config, index, results):
+    """A worker that reports its cache, waits for the parent to save a
+    snapshot and stops with what the snapshot holds as its cache."""
+    results.put((index, make_entries(index, 100), False))
+    deadline = time.monotonic() + 10
+    while (not os.path.exists(config.cache_file) and
+           time.monotonic() < deadline):
+        time.sleep(0.1)
+    saved = TimedLruCache.try_load_from_file(config.cache_file, 1000)
+    results.put((index, saved.get_entries(), True))
+
+
+def make_entries(index, count):
+    return {(f'host{i}.w{index}.example.com', 1, 1): TimedLruCacheEntry(
+        make_cached_response(f'host{i}.w{index}.example.com', '192.0.2.1'),
+        300) for i in range(count)}
+
+
+@unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'), 'requires SO_REUSEPORT')
+class TestWorkers(unittest.TestCase):
+    def test_workers_serve_and_persist_cache_once(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                StubUpstream() as upstream:
+            port = get_free_port()
+            config_path = os.path.join(directory, 'config.json')
+            cache_path = os.path.join(directory, 'cache.bin')
+            with open(config_path, 'w') as f:
+                json.dump({'hostname': '127.0.0.1', 'port': port,
+                           'cache_file': cache_path,
+                           'log_file': os.path.join(directory, 'log.txt'),
+                           'proxy_hostname': '127.0.0.1',
+                           'proxy_port': upstream.port}, f)
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'server', '-c', config_path,
+                 '-w', '3'], cwd=ROOT,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                names = [f'host{i}.example.com' for i in range(20)]
+                for i, name in enumerate(names):
+                    response = self.query(port, make_request(name, i))
+                    self.assertEqual(response.transaction_id, i)
+                    self.assertEqual(response.answers[0].name, name)
+            finally:
+                process.send_signal(signal.SIGTERM)
+                process.wait(timeout=30)
+
+            cache = TimedLruCache.load_from_file(cache_path)
+            self.assertEqual(sorted(key[0] for key in cache.entries),
+                             sorted(names))
+
+    def test_large_caches_of_stopped_workers_are_merged(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('server.workers.run_worker', report_large_cache):
+            config = Config()
+            config.cache_file = os.path.join(directory, 'cache.bin')
+            config.cache_size = 10000
+            handler = signal.getsignal(signal.SIGTERM)
+            signal.alarm(60)
+            try:
+                self.assertEqual(run_workers(config, 2), 0)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGTERM, handler)
+            cache = TimedLruCache.load_from_file(config.cache_file)
+        self.assertEqual(len(cache.entries), 4000)
+
+    def test_caches_of_running_workers_are_saved_periodically(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('server.workers.run_worker',
+                           report_and_wait_for_snapshot):
+            config = Config()
+            config.cache_file = os.path.join(directory, 'cache.bin')
+            config.cache_size = 1000
+            config.cache_snapshot_interval = 0.5
+            handler = signal.getsignal(signal.SIGTERM)
+            signal.alarm(60)
+            try:
+                self.assertEqual(run_workers(config, 2), 0)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGTERM, handler)
+            cache = TimedLruCache.load_from_file(config.cache_file)
+        self.assertEqual(len(cache.entries), 200)
+
+    def query(self, port: int, request: bytes) -> DnsMessage:
+        deadline = time.monotonic() + 10
+        # Each query uses a fresh source port so the kernel spreads them
+        # across the workers.
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(0.5)
+            while True:
+                sock.sendto(request, ('127.0.0.1', port))
+                try:
+                    data, _ = sock.recvfrom(8192)
+                    return DnsMessage.from_bytes(data, False)
+                except socket.timeout:
+                    if time.monotonic() > deadline:
+                        raise